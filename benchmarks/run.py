@@ -0,0 +1,330 @@
+"""
+Benchmarks del motor difuso y de los endpoints HTTP.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.run                       # resultados JSON por stdout
+    python -m benchmarks.run --quick -o actual.json
+    python -m benchmarks.run --compare base.json   # compara contra una ejecución previa
+
+Cada resultado tiene un nombre estable, sus parámetros y métricas numéricas, para
+poder comparar ejecuciones entre commits.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fuzzy_service import FuzzyService, ENGINES  # noqa: E402
+from services.fuzzy_rescore import rescore  # noqa: E402
+from services.fuzzy_rulebase import load_definition  # noqa: E402
+from services.sensor_service import SensorService  # noqa: E402
+from services.sensor_store import DeviceStore  # noqa: E402
+from services.sensor_snapshot import SnapshotStore  # noqa: E402
+
+# Métricas donde un valor mayor es mejor (el resto: menor es mejor)
+HIGHER_IS_BETTER = ('ops_per_s', 'rows_per_s', 'req_per_s')
+
+
+def _random_readings(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.uniform(15, 39, count),
+        rng.uniform(0, 99, count),
+        rng.uniform(0, 1022, count),
+        rng.uniform(0, 1022, count),
+    ])
+
+
+def _latency_metrics(samples):
+    samples = np.asarray(samples) * 1e6
+    return {
+        "p50_us": round(float(np.percentile(samples, 50)), 2),
+        "p99_us": round(float(np.percentile(samples, 99)), 2),
+        "mean_us": round(float(samples.mean()), 2),
+        "ops_per_s": round(float(1e6 / samples.mean()), 1),
+    }
+
+
+def _timed_calls(function, arguments):
+    samples = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_construction(engines):
+    results = []
+    for engine in engines:
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        service = FuzzyService(engine=engine)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({
+            "name": f"construction.{engine}",
+            "params": {"engine": engine},
+            "metrics": {
+                "seconds": round(elapsed, 4),
+                "retained_kib": round(current / 1024, 1),
+                "peak_kib": round(peak / 1024, 1),
+            }
+        })
+        del service
+    return results
+
+
+def bench_evaluate_conditions(services, calls):
+    results = []
+    readings = _random_readings(calls, seed=1).tolist()
+    for engine, service in services.items():
+        service.evaluate_conditions(*readings[0])  # calentamiento
+        results.append({
+            "name": f"evaluate_conditions.{engine}",
+            "params": {"engine": engine, "calls": calls, "cache": False},
+            "metrics": _latency_metrics(_timed_calls(service.evaluate_conditions, readings))
+        })
+
+    # Con caché: lecturas repetidas de un conjunto pequeño, como un sensor estable
+    cached = FuzzyService(engine='numpy')
+    pool = _random_readings(64, seed=2)
+    repeated = pool[np.random.default_rng(3).integers(0, len(pool), calls)].tolist()
+    results.append({
+        "name": "evaluate_conditions.numpy_cached",
+        "params": {"engine": "numpy", "calls": calls, "cache": True, "distinct_inputs": len(pool)},
+        "metrics": dict(_latency_metrics(_timed_calls(cached.evaluate_conditions, repeated)),
+                        hit_ratio=cached.cache_stats()['hit_ratio'])
+    })
+    return results
+
+
+def bench_evaluate_batch(services, sizes, repeats):
+    results = []
+    for engine, service in services.items():
+        if engine == 'skfuzzy':
+            continue  # evaluate_batch usa el evaluador vectorizado o la tabla
+        for size in sizes:
+            readings = _random_readings(size, seed=4)
+            service.evaluate_batch(readings[:16])
+            samples = _timed_calls(service.evaluate_batch, [(readings,)] * repeats)
+            best = min(samples)
+            results.append({
+                "name": f"evaluate_batch.{engine}.{size}",
+                "params": {"engine": engine, "rows": size, "repeats": repeats},
+                "metrics": {
+                    "best_ms": round(best * 1000, 3),
+                    "mean_ms": round(float(np.mean(samples)) * 1000, 3),
+                    "rows_per_s": round(size / best, 1),
+                }
+            })
+    return results
+
+
+def bench_restore(rows, devices=10):
+    """
+    Tiempo de arranque de un SnapshotStore con `rows` lecturas: desde un snapshot
+    (cierre ordenado) y reproduciendo todo el log (proceso terminado sin snapshot)
+    """
+    readings = _random_readings(rows, seed=7).tolist()
+    evaluations = [{"estado": 50.0, "tiempo_bomba": 5.0, "activar_bomba": True}] * rows
+    names = [f"dev{i % devices}" for i in range(rows)]
+    results = []
+    for mode in ('log', 'snapshot'):
+        directory = tempfile.mkdtemp(prefix='bench-snapshot-')
+        try:
+            store = SnapshotStore(directory, retention=rows, interval=3600)
+            store.extend(list(range(rows)), readings, evaluations, names)
+            if mode == 'snapshot':
+                store.snapshot()
+            samples = _timed_calls(lambda: SnapshotStore(directory, retention=rows), [()] * 5)
+            store.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        results.append({
+            "name": f"restore.{mode}.{rows}",
+            "params": {"rows": rows, "devices": devices, "source": mode},
+            "metrics": {"best_ms": round(min(samples) * 1000, 3), "mean_ms": round(float(np.mean(samples)) * 1000, 3)}
+        })
+    return results
+
+
+def bench_rescore(rows, processes=(1,), chunk_size=5000):
+    """
+    Reevaluación del historial con fuzzy_rescore, leyendo por bloques de un DeviceStore
+    """
+    store = DeviceStore(retention=rows)
+    readings = _random_readings(rows, seed=11).tolist()
+    evaluations = [{"estado": 50.0, "tiempo_bomba": 5.0, "activar_bomba": True}] * rows
+    store.extend(list(range(rows)), readings, evaluations)
+    definition = load_definition()
+    results = []
+    for count in processes:
+        start = time.perf_counter()
+        rescore(store, definition, chunk_size=chunk_size, processes=count)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "name": f"rescore.p{count}.{rows}",
+            "params": {"rows": rows, "processes": count, "chunk_size": chunk_size},
+            "metrics": {"total_ms": round(elapsed * 1000, 1), "rows_per_s": round(rows / elapsed, 1)}
+        })
+    return results
+
+
+def _http_metrics(samples):
+    metrics = _latency_metrics(samples)
+    metrics["req_per_s"] = metrics.pop("ops_per_s")
+    return metrics
+
+
+def bench_http(requests, history_sizes):
+    from main import app
+    from routes import sensor_routes
+
+    client = app.test_client()
+    results = []
+
+    def use_fresh_service(history):
+        service = SensorService(store=DeviceStore(retention=max(history, 1)))
+        if history:
+            service.save_values(_random_readings(history, seed=5).tolist(), list(range(history)))
+        sensor_routes.sensor_service = service
+
+    use_fresh_service(0)
+    bodies = [dict(zip(('temperatura', 'humedad', 'humedadSuelo', 'luz'), row))
+              for row in _random_readings(requests, seed=6).tolist()]
+    client.post('/api/sensors', json=bodies[0])
+    samples = _timed_calls(lambda body: client.post('/api/sensors', json=body), [(body,) for body in bodies])
+    results.append({
+        "name": "http.post_sensors",
+        "params": {"requests": requests},
+        "metrics": _http_metrics(samples)
+    })
+
+    for history in history_sizes:
+        use_fresh_service(history)
+        for query in ('', '?limit=100'):
+            count = max(5, min(requests, 20000 // max(history, 1)))
+            samples = _timed_calls(lambda: client.get('/api/sensors' + query), [()] * count)
+            results.append({
+                "name": f"http.get_sensors{'.limit100' if query else ''}.{history}",
+                "params": {"history": history, "query": query, "requests": count},
+                "metrics": _http_metrics(samples)
+            })
+
+    for encoding in ('identity', 'gzip'):
+        headers = {'Accept-Encoding': encoding}
+        client.get('/api/membership-functions', headers=headers)
+        samples = _timed_calls(lambda: client.get('/api/membership-functions', headers=headers), [()] * requests)
+        size = len(client.get('/api/membership-functions', headers=headers).data)
+        results.append({
+            "name": f"http.membership_functions.{encoding}",
+            "params": {"requests": requests, "encoding": encoding},
+            "metrics": dict(_http_metrics(samples), bytes=size)
+        })
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(quick=False, engines=ENGINES, http=True):
+    calls = 300 if quick else 2000
+    requests = 100 if quick else 500
+    batch_sizes = (1000,) if quick else (1000, 10000)
+    history_sizes = (100, 1000) if quick else (100, 1000, 10000)
+
+    results = bench_construction(engines)
+    services = {engine: FuzzyService(engine=engine, cache_size=0) for engine in engines}
+    results += bench_evaluate_conditions(services, calls)
+    results += bench_evaluate_batch(services, batch_sizes, repeats=3 if quick else 10)
+    results += bench_restore(10000 if quick else 100000)
+    results += bench_rescore(20000 if quick else 200000, processes=sorted({1, os.cpu_count() or 1}))
+    if http:
+        results += bench_http(requests, history_sizes)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "quick": quick,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results
+    }
+
+
+def compare(current, baseline):
+    """
+    Retorna líneas con el cambio relativo de cada métrica presente en ambas ejecuciones;
+    las regresiones se marcan con '!'
+    """
+    previous = {result['name']: result['metrics'] for result in baseline['results']}
+    lines = []
+    for result in current['results']:
+        old_metrics = previous.get(result['name'])
+        if not old_metrics:
+            continue
+        for metric, value in result['metrics'].items():
+            old = old_metrics.get(metric)
+            if not old:
+                continue
+            change = (value - old) / old * 100
+            worse = change < 0 if metric in HIGHER_IS_BETTER else change > 0
+            mark = '!' if worse and abs(change) >= 10 else ' '
+            lines.append(f"{mark} {result['name']:<45} {metric:<12} {old:>14} -> {value:<14} {change:+.1f}%")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='menos iteraciones (para CI o pruebas rápidas)')
+    parser.add_argument('--engines', default=','.join(ENGINES), help='motores a medir, separados por coma')
+    parser.add_argument('--no-http', action='store_true', help='omitir los benchmarks de endpoints')
+    parser.add_argument('-o', '--output', help='archivo JSON de salida (por defecto stdout)')
+    parser.add_argument('--compare', help='JSON de una ejecución anterior para comparar')
+    args = parser.parse_args()
+
+    # Los logs INFO por petición distorsionan las mediciones HTTP
+    logging.disable(logging.INFO)
+
+    engines = tuple(engine.strip() for engine in args.engines.split(',') if engine.strip())
+    report = run(quick=args.quick, engines=engines, http=not args.no_http)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(report, baseline)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import gc
+import os
+
+# Procesos e hilos por proceso. Por defecto un hilo (workers sync). Para atender
+# varias peticiones por proceso definir GUNICORN_THREADS > 1: gunicorn pasa a workers
+# gthread. FuzzyService y SensorService son seguros para acceso concurrente, pero con
+# FUZZY_ENGINE=skfuzzy las evaluaciones se serializan, así que conviene usar 'numpy' o 'lut'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+
+# Con FUZZY_PRELOAD=1 la app (y el motor difuso, ver main.py) se carga en el
+# proceso maestro antes de crear los workers
+preload_app = os.environ.get('FUZZY_PRELOAD') == '1'
+
+
+def pre_fork(server, worker):
+    # Mover los objetos ya creados fuera del recolector de basura para que sus
+    # páginas no se copien en cada worker al recorrerlas
+    gc.freeze()
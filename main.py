@@ -1,13 +1,23 @@
 from flask import Flask
 from flask_cors import CORS
 from routes.sensor_routes import sensor_bp
+from routes.metrics_routes import metrics_bp, TimedJSONProvider
+from services import fuzzy_registry
 import os
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)  # Habilitar CORS para todas las rutas
 
 # Registrar el blueprint de sensores
 app.register_blueprint(sensor_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp, url_prefix='/api')
+
+# Construir el motor difuso al importar la app en lugar de en la primera petición.
+# Con `gunicorn --preload` (FUZZY_PRELOAD=1 en gunicorn.conf.py) ocurre una sola vez
+# en el proceso maestro y los workers lo comparten
+if os.environ.get('FUZZY_PRELOAD') == '1':
+    fuzzy_registry.preload()
 
 if __name__ == '__main__':
     # Obtener el puerto del entorno o usar 5000 por defecto
@@ -0,0 +1,110 @@
+from flask import Blueprint, Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from services.metrics import REGISTRY, REQUEST_BUCKETS, STAGE_BUCKETS
+from routes import sensor_routes
+import time
+
+metrics_bp = Blueprint('metrics', __name__)
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'Peticiones atendidas', ('endpoint', 'method', 'status')
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Duración de las peticiones hasta generar la respuesta',
+    ('endpoint', 'method'), REQUEST_BUCKETS
+)
+HTTP_STAGES = REGISTRY.histogram(
+    'http_stage_seconds', 'Etapas de cada ruta: json_parse (cuerpo de la petición) y serialize (respuesta JSON)',
+    ('endpoint', 'stage'), STAGE_BUCKETS
+)
+
+
+def _endpoint():
+    # La regla de la ruta (no la URL) mantiene acotada la cardinalidad de las etiquetas
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """
+    Proveedor JSON de Flask que mide el parseo del cuerpo (request.get_json) y la
+    serialización de las respuestas (jsonify) de cada ruta
+    """
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            if has_request_context():
+                HTTP_STAGES.observe(time.perf_counter() - start, endpoint=_endpoint(), stage='serialize')
+
+    def loads(self, s, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().loads(s, **kwargs)
+        finally:
+            if has_request_context():
+                HTTP_STAGES.observe(time.perf_counter() - start, endpoint=_endpoint(), stage='json_parse')
+
+
+@metrics_bp.before_app_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@metrics_bp.after_app_request
+def _record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = _endpoint()
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    return response
+
+
+# Contadores del caché antes de construir el motor difuso o con el caché desactivado
+EMPTY_CACHE_STATS = {"size": 0, "hits": 0, "misses": 0, "hit_ratio": 0.0}
+
+
+def _cache_stats():
+    # Un scrape no debe construir el motor difuso (varios segundos con skfuzzy)
+    service = sensor_routes.sensor_service.current_fuzzy_service
+    stats = service.cache_stats() if service is not None else None
+    return stats or EMPTY_CACHE_STATS
+
+
+REGISTRY.gauge('sensor_store_readings', 'Lecturas retenidas en el almacén',
+               lambda: len(sensor_routes.sensor_service.store))
+REGISTRY.gauge('sensor_ingest_queue_depth', 'Lecturas en la cola de ingesta asíncrona',
+               lambda: sensor_routes.ingest_worker.depth())
+REGISTRY.gauge('fuzzy_cache_entries', 'Entradas en el caché de evaluaciones',
+               lambda: _cache_stats().get('size'))
+REGISTRY.gauge('fuzzy_cache_hit_ratio', 'Proporción de aciertos del caché de evaluaciones',
+               lambda: _cache_stats().get('hit_ratio'))
+REGISTRY.gauge('fuzzy_cache_hits_total', 'Aciertos del caché de evaluaciones',
+               lambda: _cache_stats().get('hits'), kind='counter')
+REGISTRY.gauge('fuzzy_cache_misses_total', 'Fallos del caché de evaluaciones',
+               lambda: _cache_stats().get('misses'), kind='counter')
+REGISTRY.gauge('sensor_ingest_rejected_total', 'Lecturas rechazadas con 429 por cola llena',
+               lambda: sensor_routes.ingest_worker.rejected, kind='counter')
+
+
+def _controller_stat(key):
+    controller = sensor_routes.sensor_service.controller
+    return controller.stats()[key] if controller is not None else None
+
+
+REGISTRY.gauge('pump_controller_evaluations_total', 'Evaluaciones difusas hechas por el controlador de la bomba',
+               lambda: _controller_stat('evaluaciones'), kind='counter')
+REGISTRY.gauge('pump_controller_skipped_total', 'Lecturas sin reevaluación por cambio menor al umbral',
+               lambda: _controller_stat('omitidas'), kind='counter')
+REGISTRY.gauge('pump_controller_pumps_on', 'Dispositivos con la bomba encendida',
+               lambda: _controller_stat('bombas_encendidas'))
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Métricas del proceso en el formato de texto de Prometheus
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -1,184 +1,551 @@
-from flask import Blueprint, request, jsonify
-from services.sensor_service import SensorService
-from services.fuzzy_service import FuzzyService
+from flask import Blueprint, Response, request, jsonify
+from services.sensor_service import SensorService, DEVICE_LIMIT_ERROR, validate_reading, validate_device
+from services.fuzzy_registry import get_fuzzy_service
+from services.fuzzy_rulebase import RULEBASE_PATH, build_rulebase, fingerprint
+from services.sensor_aggregates import format_buckets
+from services.log_config import Payload, configure_logging, log_event
+from services.sensor_ingest import IngestWorker, DEFAULT_QUEUE_SIZE, DEFAULT_BATCH_SIZE
+from services.fuzzy_lut import INPUT_LABELS, OUTPUT_LABELS
+from services.fuzzy_surface import compute_surface, surface_to_dict
+from services.fuzzy_rescore import rescore
+from services.membership_payload import MembershipPayloads, FORMATS as MEMBERSHIP_FORMATS, \
+    ENCODINGS as MEMBERSHIP_ENCODINGS
+from datetime import datetime, timezone
+import hashlib
+import json
 import logging
-import numpy as np
+import os
+import time
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+# Configurar logging (estructurado, con escritura asíncrona; ver services/log_config.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 sensor_bp = Blueprint('sensor', __name__)
 sensor_service = SensorService()
-fuzzy_service = FuzzyService()
+membership_payloads = MembershipPayloads()
+
+# Ingesta de POST /sensors: 'sync' evalúa y almacena dentro de la petición; 'async'
+# encola la lectura y responde 202 (ver services/sensor_ingest.py)
+INGEST_MODE = os.environ.get('SENSOR_INGEST_MODE', 'sync')
+ingest_worker = IngestWorker(
+    sensor_service,
+    max_size=int(os.environ.get('SENSOR_INGEST_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+    batch_size=int(os.environ.get('SENSOR_INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+)
+
+# Máximo de lecturas aceptadas por lote en POST /sensors/batch
+MAX_BATCH_SIZE = int(os.environ.get('SENSOR_BATCH_MAX_SIZE', 10000))
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+# Máximo de lecturas por página en GET /sensors?limit=...
+MAX_PAGE_SIZE = int(os.environ.get('SENSOR_PAGE_MAX_SIZE', 5000))
+# Puntos por eje por defecto y máximos en GET /fuzzy/surface
+DEFAULT_SURFACE_RESOLUTION = 50
+MAX_SURFACE_RESOLUTION = int(os.environ.get('FUZZY_SURFACE_MAX_RESOLUTION', 200))
+# Buckets por defecto y máximos en GET /sensors/aggregates
+DEFAULT_AGGREGATE_BUCKETS = 60
+MAX_AGGREGATE_BUCKETS = int(os.environ.get('SENSOR_AGGREGATE_MAX_BUCKETS', 5000))
+# Máximo (y valor por defecto de limit) de lecturas en POST /fuzzy/rulebase/rescore;
+# historiales más grandes se reevalúan con `python -m services.fuzzy_rescore`
+MAX_RESCORE_ROWS = int(os.environ.get('FUZZY_RESCORE_MAX_ROWS', 50000))
+
+def _read_batch_items():
+    """
+    Lee el cuerpo de POST /sensors/batch: un arreglo JSON (o {"lecturas": [...]})
+    o NDJSON, una lectura por línea leída del stream. Retorna una lista de
+    (lectura, error de parseo). El NDJSON se deja de leer al pasar MAX_BATCH_SIZE
+    lecturas, así un lote demasiado grande se rechaza sin cargarlo completo
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except ValueError:
+                items.append((None, "Línea NDJSON inválida"))
+            if len(items) > MAX_BATCH_SIZE:
+                break
+        return items
+
+    payload = request.get_json(force=True, silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('lecturas')
+    if not isinstance(payload, list):
+        raise ValueError("Se esperaba un arreglo de lecturas")
+    return [(item, None) for item in payload]
 
 @sensor_bp.route('/sensors', methods=['POST'])
 def save_sensor_data():
+    if INGEST_MODE == 'async':
+        return _enqueue_sensor_data()
     try:
         data = request.get_json()
-        logger.info(f"Datos recibidos: {data}")
+        log_event(logger, logging.DEBUG, "Datos recibidos", payload=Payload(data))
         
         # Guardar datos y obtener evaluación
         sensor_service.save_data(data)
         
-        # Obtener la última evaluación
-        evaluation = sensor_service.get_latest_evaluation()
-        logger.info(f"Evaluación generada: {evaluation}")
-        
         # Devolver mensaje y evaluación
         response = {
             "message": "Datos almacenados",
-            "evaluacion": evaluation
+            "evaluacion": data['evaluacion']
         }
-        logger.info(f"Respuesta enviada: {response}")
         return jsonify(response), 200
     except Exception as e:
-        logger.error(f"Error al procesar datos: {str(e)}")
+        log_event(logger, logging.WARNING, "Error al procesar datos", error=str(e),
+                  payload=Payload(request.get_data(as_text=True)))
+        return jsonify({"error": str(e)}), 400
+
+def _enqueue_sensor_data():
+    """
+    Modo asíncrono: solo valida y encola la lectura; el worker de ingesta la evalúa
+    y almacena en micro-lotes. Responde 202, o 429 si la cola está llena. El dispositivo
+    se admite aquí, así una lectura encolada no se rechaza después por el máximo de dispositivos
+    """
+    data = request.get_json(force=True, silent=True)
+    try:
+        values = validate_reading(data)
+        device = validate_device(data)
+        sensor_service.require_devices([device])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not ingest_worker.submit(values, device):
+        response = jsonify({"error": "Cola de ingesta llena, reintente más tarde"})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    return jsonify({"message": "Lectura encolada", "en_cola": ingest_worker.depth()}), 202
+
+@sensor_bp.route('/sensors/ingest', methods=['GET'])
+def get_ingest_stats():
+    """
+    Estado de la cola de ingesta asíncrona (profundidad, lecturas aceptadas,
+    rechazadas y procesadas, micro-lotes)
+    """
+    return jsonify(dict(ingest_worker.stats(), mode=INGEST_MODE)), 200
+
+def _parse_time(value):
+    """
+    Convierte un parámetro de fecha (epoch en segundos o ISO 8601) a epoch
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        raise ValueError(f"Fecha inválida: {value}")
+
+def _parse_int(name, minimum=0):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"El parámetro '{name}' debe ser un entero")
+    if value < minimum:
+        raise ValueError(f"El parámetro '{name}' debe ser mayor o igual a {minimum}")
+    return value
+
+def _project(record, fields):
+    """
+    Conserva solo los campos pedidos; admite campos anidados con punto (evaluacion.estado)
+    """
+    if not fields:
+        return record
+    result = {}
+    for field in fields:
+        value = record
+        parts = field.split('.')
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = result
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return result
+
+@sensor_bp.route('/sensors/batch', methods=['POST'])
+def save_sensor_batch():
+    try:
+        items = _read_batch_items()
+        if not items:
+            return jsonify({"error": "El lote está vacío"}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"El lote supera el máximo de {MAX_BATCH_SIZE} lecturas"}), 413
+
+        # Validar todas las lecturas antes de evaluar
+        candidates = []
+        errors = []
+        for index, (item, parse_error) in enumerate(items):
+            try:
+                if parse_error:
+                    raise ValueError(parse_error)
+                validate_reading(item)
+                device = validate_device(item)
+            except ValueError as e:
+                errors.append({"indice": index, "error": str(e)})
+                continue
+            candidates.append((index, item, device))
+
+        # Las lecturas de dispositivos que superan el máximo se rechazan una a una
+        rejected = sensor_service.admit_devices([device for _, _, device in candidates])
+        valid = []
+        valid_indexes = []
+        for index, item, device in candidates:
+            if device in rejected:
+                errors.append({"indice": index, "error": DEVICE_LIMIT_ERROR.format(device)})
+                continue
+            valid.append(item)
+            valid_indexes.append(index)
+        errors.sort(key=lambda error: error["indice"])
+
+        # Evaluar y guardar las válidas en un solo paso
+        evaluations = sensor_service.save_batch(valid)
+        results = [
+            {"indice": index, "evaluacion": evaluation}
+            for index, evaluation in zip(valid_indexes, evaluations)
+        ]
+        log_event(logger, logging.INFO, "Lote recibido", lecturas=len(items), almacenadas=len(valid),
+                  errores=len(errors))
+
+        response = {
+            "message": "Datos almacenados" if valid else "Ninguna lectura válida",
+            "almacenados": len(valid),
+            "resultados": results,
+            "errores": errors
+        }
+        return jsonify(response), 200 if valid else 400
+    except Exception as e:
+        logger.error("Error al procesar lote: %s", e)
         return jsonify({"error": str(e)}), 400
 
 @sensor_bp.route('/sensors', methods=['GET'])
 def get_sensor_data():
+    """
+    Parámetros opcionales:
+    since / until: rango de tiempo (epoch en segundos o ISO 8601)
+    limit / cursor: paginación; el cursor de la página siguiente va en X-Next-Cursor
+    fields: campos a retornar separados por coma (p. ej. temperatura,evaluacion.estado)
+    dispositivo: solo las lecturas de ese dispositivo
+    format=ndjson (o Accept: application/x-ndjson): respuesta en streaming, una lectura por línea
+    """
     try:
-        data = sensor_service.get_all_data()
-        logger.info(f"Datos almacenados: {data}")
-        return jsonify(data), 200
+        since = _parse_time(request.args.get('since'))
+        until = _parse_time(request.args.get('until'))
+        limit = _parse_int('limit', minimum=1)
+        cursor = _parse_int('cursor')
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+        device = request.args.get('dispositivo')
+
+        streaming = request.args.get('format') == 'ndjson' or \
+            request.accept_mimetypes.best in NDJSON_MIMETYPES
+        if streaming:
+            records = sensor_service.iter_data(since=since, until=until, after_id=cursor, limit=limit,
+                                               device=device)
+            lines = (json.dumps(_project(record, fields)) + "\n" for record in records)
+            return Response(lines, mimetype='application/x-ndjson')
+
+        if limit is None:
+            data = sensor_service.query_data(since=since, until=until, after_id=cursor, device=device)
+            next_cursor = None
+        else:
+            # Pedir una lectura extra para saber si hay página siguiente
+            limit = min(limit, MAX_PAGE_SIZE)
+            data = sensor_service.query_data(since=since, until=until, after_id=cursor, limit=limit + 1,
+                                             device=device)
+            next_cursor = data[limit - 1]['id'] if len(data) > limit else None
+            data = data[:limit]
+
+        log_event(logger, logging.DEBUG, "Lecturas retornadas", lecturas=len(data), cursor=cursor)
+        response = jsonify([_project(record, fields) for record in data])
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+        return response, 200
     except Exception as e:
-        logger.error(f"Error al obtener datos: {str(e)}")
+        logger.error("Error al obtener datos: %s", e)
         return jsonify({"error": str(e)}), 400
 
+@sensor_bp.route('/sensors/aggregates', methods=['GET'])
+def get_sensor_aggregates():
+    """
+    Agregados por bucket (min/max/mean/last) de las entradas y de estado/tiempo_bomba.
+    Parámetros: resolution (segundos, por defecto 60), since / until (por defecto
+    los últimos 60 buckets hasta ahora), dispositivo (opcional). Se retornan completos
+    los buckets que tocan [since, until]
+    """
+    try:
+        resolution = float(request.args.get('resolution', 60))
+        if resolution <= 0:
+            raise ValueError("El parámetro 'resolution' debe ser mayor que cero")
+        until = _parse_time(request.args.get('until'))
+        if until is None:
+            until = time.time()
+        since = _parse_time(request.args.get('since'))
+        if since is None:
+            since = until - resolution * DEFAULT_AGGREGATE_BUCKETS
+        if since > until:
+            raise ValueError("'since' debe ser anterior a 'until'")
+        if (until - since) / resolution > MAX_AGGREGATE_BUCKETS:
+            raise ValueError(f"La ventana supera el máximo de {MAX_AGGREGATE_BUCKETS} buckets")
+
+        device = request.args.get('dispositivo')
+        keys, stats = sensor_service.get_aggregates(resolution, since, until, device)
+        return jsonify({
+            "dispositivo": device,
+            "resolution": resolution,
+            "since": since,
+            "until": until,
+            "buckets": format_buckets(keys, stats, resolution)
+        }), 200
+    except Exception as e:
+        logger.error("Error al obtener agregados: %s", e)
+        return jsonify({"error": str(e)}), 400
+
+def _latest_evaluation_response(device=None):
+    """
+    Responde con la evaluación guardada al ingresar la última lectura (de `device`,
+    o del parámetro ?dispositivo=, si se indica), sin volver a evaluar. Incluye ETag
+    y Last-Modified para que los dispositivos que consultan periódicamente reciban
+    304 si no hubo lecturas nuevas
+    """
+    latest_data = sensor_service.get_latest_data(device or request.args.get('dispositivo'))
+    if not latest_data:
+        return jsonify({"message": "No hay datos disponibles"}), 404
+
+    response = jsonify(latest_data['evaluacion'])
+    response.set_etag(f"{latest_data['id']}-{int(latest_data['timestamp'] * 1000)}")
+    response.last_modified = datetime.fromtimestamp(latest_data['timestamp'], tz=timezone.utc)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @sensor_bp.route('/sensors/evaluation', methods=['GET'])
 def get_evaluation():
     try:
-        evaluation = sensor_service.get_latest_evaluation()
-        if evaluation:
-            return jsonify(evaluation), 200
-        return jsonify({"message": "No hay datos disponibles"}), 404
+        return _latest_evaluation_response()
     except Exception as e:
-        logger.error(f"Error al obtener evaluación: {str(e)}")
+        logger.error("Error al obtener evaluación: %s", e)
         return jsonify({"error": str(e)}), 400
 
 @sensor_bp.route('/sensors/pump', methods=['GET'])
 def get_pump_recommendation():
     try:
-        # Obtener los últimos datos
-        data = sensor_service.get_all_data()
-        if not data:
-            return jsonify({"message": "No hay datos disponibles"}), 404
-        
-        # Obtener la última lectura
-        latest_data = data[-1]
-        
-        # Evaluar si se debe activar la bomba usando evaluate_conditions
-        pump_evaluation = sensor_service.fuzzy_service.evaluate_conditions(
-            latest_data['temperatura'],
-            latest_data['humedad'],
-            latest_data['humedadSuelo'],
-            latest_data['luz']
-        )
-        
-        return jsonify(pump_evaluation), 200
+        return _latest_evaluation_response()
     except Exception as e:
-        logger.error(f"Error al obtener recomendación de bomba: {str(e)}")
+        logger.error("Error al obtener recomendación de bomba: %s", e)
         return jsonify({"error": str(e)}), 400
 
 @sensor_bp.route('/pump', methods=['GET'])
 def check_pump():
     try:
-        # Obtener los últimos datos
-        data = sensor_service.get_all_data()
-        if not data:
-            return jsonify({"message": "No hay datos disponibles"}), 404
-        
-        # Obtener la última lectura
-        latest_data = data[-1]
-        
-        # Evaluar si se debe activar la bomba usando evaluate_conditions
-        pump_evaluation = sensor_service.fuzzy_service.evaluate_conditions(
-            latest_data['temperatura'],
-            latest_data['humedad'],
-            latest_data['humedadSuelo'],
-            latest_data['luz']
-        )
-        
-        return jsonify(pump_evaluation), 200
+        return _latest_evaluation_response()
     except Exception as e:
-        logger.error(f"Error al verificar estado de la bomba: {str(e)}")
+        logger.error("Error al verificar estado de la bomba: %s", e)
         return jsonify({"error": str(e)}), 400
 
-@sensor_bp.route('/membership-functions', methods=['GET'])
-def get_membership_functions():
+@sensor_bp.route('/pump/controller', methods=['GET'])
+def get_pump_controller():
+    """
+    Estado del controlador de la bomba (PUMP_CONTROLLER=1): totales de lecturas y
+    evaluaciones omitidas, o el estado de un dispositivo con ?dispositivo=
+    """
+    controller = sensor_service.controller
+    if controller is None:
+        return jsonify({"enabled": False}), 200
+    device = request.args.get('dispositivo')
+    if device is None:
+        return jsonify(dict(controller.stats(), enabled=True)), 200
+    state = controller.state(device)
+    if state is None:
+        return jsonify({"message": f"Sin lecturas del dispositivo {device}"}), 404
+    return jsonify(state), 200
+
+@sensor_bp.route('/devices', methods=['GET'])
+def get_devices():
     """
-    Retorna los datos de las funciones de pertenencia para visualización
+    Lista los dispositivos con lecturas, con la cantidad retenida y la fecha de la última
     """
     try:
-        # Obtener datos de temperatura
-        temp_data = {
-            'range': fuzzy_service.temp_range.tolist(),
-            'sets': {
-                'fría': fuzzy_service.temperature['fría'].mf.tolist(),
-                'óptima': fuzzy_service.temperature['óptima'].mf.tolist(),
-                'caliente': fuzzy_service.temperature['caliente'].mf.tolist()
-            }
-        }
+        return jsonify(sensor_service.get_devices()), 200
+    except Exception as e:
+        logger.error("Error al listar dispositivos: %s", e)
+        return jsonify({"error": str(e)}), 400
 
-        # Obtener datos de humedad
-        humidity_data = {
-            'range': fuzzy_service.humidity_range.tolist(),
-            'sets': {
-                'baja': fuzzy_service.humidity['baja'].mf.tolist(),
-                'óptima': fuzzy_service.humidity['óptima'].mf.tolist(),
-                'alta': fuzzy_service.humidity['alta'].mf.tolist()
-            }
-        }
+@sensor_bp.route('/devices/<device>/evaluation', methods=['GET'])
+def get_device_evaluation(device):
+    try:
+        return _latest_evaluation_response(device)
+    except Exception as e:
+        logger.error("Error al obtener evaluación de %s: %s", device, e)
+        return jsonify({"error": str(e)}), 400
 
-        # Obtener datos de suelo
-        soil_data = {
-            'range': fuzzy_service.soil_range.tolist(),
-            'sets': {
-                'seco': fuzzy_service.soil['seco'].mf.tolist(),
-                'húmedo': fuzzy_service.soil['húmedo'].mf.tolist(),
-                'empapado': fuzzy_service.soil['empapado'].mf.tolist()
-            }
-        }
+@sensor_bp.route('/devices/<device>/pump', methods=['GET'])
+def get_device_pump(device):
+    try:
+        return _latest_evaluation_response(device)
+    except Exception as e:
+        logger.error("Error al verificar la bomba de %s: %s", device, e)
+        return jsonify({"error": str(e)}), 400
 
-        # Obtener datos de luz
-        light_data = {
-            'range': fuzzy_service.light_range.tolist(),
-            'sets': {
-                'baja': fuzzy_service.light['baja'].mf.tolist(),
-                'óptima': fuzzy_service.light['óptima'].mf.tolist(),
-                'alta': fuzzy_service.light['alta'].mf.tolist()
-            }
-        }
+@sensor_bp.route('/fuzzy/cache', methods=['GET'])
+def get_fuzzy_cache_stats():
+    """
+    Retorna los contadores del caché de evaluaciones difusas
+    """
+    stats = sensor_service.fuzzy_service.cache_stats()
+    if stats is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(stats, enabled=True)), 200
 
-        # Obtener datos de estado de la planta
-        plant_state_data = {
-            'range': np.arange(0, 100, 1).tolist(),
-            'sets': {
-                'malo': fuzzy_service.plant_state['malo'].mf.tolist(),
-                'regular': fuzzy_service.plant_state['regular'].mf.tolist(),
-                'bueno': fuzzy_service.plant_state['bueno'].mf.tolist()
-            }
-        }
+@sensor_bp.route('/fuzzy/rulebase', methods=['GET'])
+def get_fuzzy_rulebase():
+    """
+    Base de reglas activa en este proceso: versión y definición (el mismo formato que
+    acepta FUZZY_RULEBASE_PATH, así sirve de plantilla)
+    """
+    service = get_fuzzy_service()
+    response = jsonify({
+        "version": service.rulebase_version,
+        "archivo": RULEBASE_PATH,
+        "definicion": service.definition
+    })
+    response.set_etag(service.rulebase_version)
+    return response.make_conditional(request)
 
-        # Obtener datos de tiempo de bomba
-        pump_time_data = {
-            'range': np.arange(0, 60, 1).tolist(),
-            'sets': {
-                'corto': fuzzy_service.pump_time['corto'].mf.tolist(),
-                'medio': fuzzy_service.pump_time['medio'].mf.tolist(),
-                'largo': fuzzy_service.pump_time['largo'].mf.tolist()
-            }
-        }
+@sensor_bp.route('/fuzzy/rulebase/validate', methods=['POST'])
+def validate_fuzzy_rulebase():
+    """
+    Valida una definición sin aplicarla y retorna la versión que tendría. Para
+    activarla se escribe en FUZZY_RULEBASE_PATH, que cada worker recarga en caliente
+    """
+    try:
+        rulebase = build_rulebase(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return jsonify({"valida": False, "error": str(e)}), 400
+    version = fingerprint(rulebase.rules)
+    return jsonify({"valida": True, "version": version,
+                    "activa": version == get_fuzzy_service().rulebase_version}), 200
 
-        return jsonify({
-            'temperatura': temp_data,
-            'humedad': humidity_data,
-            'suelo': soil_data,
-            'luz': light_data,
-            'estado_planta': plant_state_data,
-            'tiempo_bomba': pump_time_data
-        })
+@sensor_bp.route('/fuzzy/rulebase/rescore', methods=['POST'])
+def rescore_fuzzy_rulebase():
+    """
+    Reevalúa el historial guardado con la definición del cuerpo (sin aplicarla) y
+    retorna las diferencias: decisiones de activar_bomba que cambian y distribución
+    de las diferencias de estado y tiempo_bomba (ver services/fuzzy_rescore.py).
+    Parámetros opcionales: since / until, dispositivo, limit (por defecto y como máximo
+    MAX_RESCORE_ROWS; el reporte indica el límite aplicado). Se evalúa en el mismo
+    proceso: un pool de procesos dentro de un worker con hilos no es seguro. Para
+    historiales más grandes está `python -m services.fuzzy_rescore`, que reparte
+    los bloques entre procesos y no tiene el tiempo límite de la petición
+    """
+    try:
+        since = _parse_time(request.args.get('since'))
+        until = _parse_time(request.args.get('until'))
+        limit = _parse_int('limit', minimum=1)
+        if limit is not None and limit > MAX_RESCORE_ROWS:
+            raise ValueError(f"El parámetro 'limit' supera el máximo de {MAX_RESCORE_ROWS} lecturas; "
+                             "para reevaluar más usar `python -m services.fuzzy_rescore`")
+        limit = limit or MAX_RESCORE_ROWS
+        report = rescore(sensor_service.store, request.get_json(force=True, silent=True), since=since,
+                         until=until, device=request.args.get('dispositivo'), limit=limit, processes=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error al reevaluar el historial: %s", e)
+        return jsonify({"error": str(e)}), 500
+    report["limite"] = limit
+    # Con tantas lecturas como el límite puede haber más en la ventana pedida
+    report["incompleto"] = report["lecturas"] >= limit
+    return jsonify(report), 200
 
+@sensor_bp.route('/fuzzy/surface', methods=['GET'])
+def get_fuzzy_surface():
+    """
+    Superficie de salida del sistema difuso sobre dos variables de entrada.
+
+    Parámetros opcionales:
+      x, y: variables de los ejes (por defecto temperatura y humedad)
+      output: estado_planta o tiempo_bomba (por defecto ambas en JSON, estado_planta en PNG)
+      resolution: puntos por eje (por defecto 50, máximo SURFACE_MAX_RESOLUTION)
+      temperatura, humedad, suelo, luz: valores de las entradas que quedan fijas
+      format: json (por defecto) o png (requiere matplotlib)
+    """
+    try:
+        x_label = request.args.get('x', 'temperatura')
+        y_label = request.args.get('y', 'humedad')
+        output = request.args.get('output')
+        if output is not None and output not in OUTPUT_LABELS:
+            raise ValueError(f"Salida desconocida: {output}. Opciones: {', '.join(OUTPUT_LABELS)}")
+        resolution = _parse_int('resolution', minimum=2) or DEFAULT_SURFACE_RESOLUTION
+        if resolution > MAX_SURFACE_RESOLUTION:
+            raise ValueError(f"La resolución máxima es {MAX_SURFACE_RESOLUTION}")
+        fixed = {}
+        for label in INPUT_LABELS:
+            if label in request.args:
+                try:
+                    fixed[label] = float(request.args[label])
+                except ValueError:
+                    raise ValueError(f"El parámetro '{label}' debe ser numérico")
+        fmt = request.args.get('format', 'json')
+        if fmt not in ('json', 'png'):
+            raise ValueError("Formato desconocido: use json o png")
+
+        surface = compute_surface(get_fuzzy_service(), x_label, y_label, resolution=resolution,
+                                  fixed=fixed, processes=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fmt == 'png':
+        try:
+            from services.fuzzy_visualization import render_surface_png
+        except ImportError:
+            return jsonify({"error": "El formato PNG requiere matplotlib"}), 501
+        response = Response(render_surface_png(surface, output or 'estado_planta'), mimetype='image/png')
+    else:
+        response = jsonify(surface_to_dict(surface, output))
+    # La superficie solo cambia con la base de reglas
+    response.set_etag(f"{surface.version}-{hashlib.sha1(request.query_string).hexdigest()[:12]}")
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@sensor_bp.route('/membership-functions', methods=['GET'])
+def get_membership_functions():
+    """
+    Retorna los datos de las funciones de pertenencia para visualización.
+
+    Parámetros opcionales:
+      format: full (por defecto), vertices (solo los vértices de cada conjunto) o
+              float32 (arreglos float32 en base64)
+
+    El documento se serializa y comprime (gzip, brotli si está instalado) una vez por
+    versión de la base de reglas y se sirve con un ETag fuerte
+    """
+    fmt = request.args.get('format', 'full')
+    if fmt not in MEMBERSHIP_FORMATS:
+        return jsonify({"error": f"Formato desconocido: {fmt}. Opciones: {', '.join(MEMBERSHIP_FORMATS)}"}), 400
+    try:
+        payload = membership_payloads.get(get_fuzzy_service().compiled, fmt)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+    encoding = next((e for e in MEMBERSHIP_ENCODINGS if request.accept_encodings[e]), 'identity')
+    response = Response(payload.bodies[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # Cada codificación es una representación distinta: su propio ETag fuerte
+    response.set_etag(payload.etag if encoding == 'identity' else f"{payload.etag}-{encoding}")
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request) 
\ No newline at end of file
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+# Resolución por entrada (temperatura, humedad, suelo, luz): un decimal para
+# temperatura/humedad y enteros para las lecturas ADC de suelo y luz
+DEFAULT_RESOLUTION = (0.1, 0.1, 1.0, 1.0)
+DEFAULT_MAX_SIZE = 4096
+
+
+class EvaluationCache:
+    """
+    Caché LRU de evaluaciones difusas con las entradas cuantizadas a `resolution`.
+    Cada entrada pertenece a una versión de la base de reglas: al cambiar la
+    versión el caché se vacía.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, resolution=DEFAULT_RESOLUTION):
+        if max_size <= 0:
+            raise ValueError("El tamaño del caché debe ser mayor que cero")
+        if len(resolution) != len(DEFAULT_RESOLUTION) or any(r <= 0 for r in resolution):
+            raise ValueError("Se esperan cuatro resoluciones mayores que cero")
+        self.max_size = int(max_size)
+        self.resolution = tuple(float(r) for r in resolution)
+        self.version = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, temperatura, humedad, suelo, luz):
+        """
+        Cuantiza las entradas a la rejilla de la resolución configurada
+        """
+        return tuple(
+            int(round(float(value) / step))
+            for value, step in zip((temperatura, humedad, suelo, luz), self.resolution)
+        )
+
+    def representative(self, key):
+        """
+        Entradas que se evalúan para una clave (el punto de la rejilla)
+        """
+        return tuple(round(index * step, 10) for index, step in zip(key, self.resolution))
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self.version:
+                self._clear(version)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version):
+        with self._lock:
+            if version != self.version:
+                # Resultado de una versión ya reemplazada mientras se calculaba
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, version=None):
+        """
+        Vacía el caché y lo asocia a `version`
+        """
+        with self._lock:
+            self._clear(version)
+
+    def _clear(self, version):
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self.version = version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "resolution": list(self.resolution),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
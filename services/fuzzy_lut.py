@@ -0,0 +1,360 @@
+import bisect
+import logging
+import os
+
+import numpy as np
+from skfuzzy.control.antecedent_consequent import accumulation_max
+from .fuzzy_vectorized import DEFAULT_CHUNK_SIZE, VectorizedEvaluator
+
+logger = logging.getLogger(__name__)
+
+# Orden de las entradas de cada lectura y de las salidas calculadas
+INPUT_LABELS = ('temperatura', 'humedad', 'suelo', 'luz')
+OUTPUT_LABELS = ('estado_planta', 'tiempo_bomba')
+
+# Niveles uniformes entre 0 y 1 por eje de la tabla, que se añaden a los valores que
+# toman las funciones de pertenencia de la salida
+DEFAULT_RESOLUTION = 41
+# Nodos máximos de la tabla de una salida (crece con la potencia del número de conjuntos)
+MAX_TABLE_NODES = 2000000
+# Error absoluto máximo aceptado por salida (estado, tiempo_bomba); si la validación lo
+# supera build() falla. Las tablas por defecto quedan en ~0.04 y ~0.05
+DEFAULT_TOLERANCE = tuple(float(t) for t in os.environ.get('FUZZY_LUT_TOLERANCE', '1,0.1').split(','))
+# Lecturas aleatorias de la validación
+VALIDATION_SAMPLES = 65536
+
+# Equivalentes escalares de las funciones de reglas y acumulación de skfuzzy
+_SCALAR_FUNCTIONS = {np.fmin: min, np.fmax: max, accumulation_max: max}
+
+
+def _breakpoints(universe, terms):
+    """
+    Retorna los puntos del universo donde alguna función de pertenencia cambia de
+    pendiente (con los extremos) y, por conjunto, su valor y su pendiente en cada tramo
+    entre esos puntos, donde todas son lineales
+    """
+    kinks = [np.nonzero(np.abs(np.diff(mf, 2)) > 1e-12)[0] + 1 for mf in terms.values()]
+    indexes = np.unique(np.concatenate([[0, len(universe) - 1]] + kinks))
+    xs = universe[indexes]
+    segments = {}
+    for term, mf in terms.items():
+        ys = mf[indexes]
+        slopes = np.append(np.diff(ys) / np.diff(xs), 0.0)
+        segments[term] = (ys.tolist(), slopes.tolist())
+    return xs.tolist(), segments
+
+
+def build_axis(mfs, resolution):
+    """
+    Construye el eje de la tabla para el nivel de corte de un conjunto de salida:
+    `resolution` niveles uniformes entre 0 y 1 más los valores de las funciones de
+    pertenencia `mfs` de la salida, donde el centroide cambia de pendiente
+    """
+    levels = np.concatenate([np.linspace(0.0, 1.0, max(int(resolution), 2))] + [np.asarray(mf) for mf in mfs])
+    return np.unique(levels[(levels >= 0.0) & (levels <= 1.0)])
+
+
+def _defuzzify(evaluator, label, terms, levels):
+    """
+    Centroide exacto de la salida `label` para un arreglo (N, T) de niveles de corte de
+    `terms`, por bloques como VectorizedEvaluator.evaluate para acotar la memoria
+    """
+    result = np.empty(len(levels))
+    for start in range(0, len(levels), DEFAULT_CHUNK_SIZE):
+        chunk = levels[start:start + DEFAULT_CHUNK_SIZE]
+        cuts = {(label, term): chunk[:, i] for i, term in enumerate(terms)}
+        result[start:start + len(chunk)] = evaluator.defuzzify(label, cuts, len(chunk))
+    return result
+
+
+def _grid(axes):
+    # Puntos (N, d) de la rejilla formada por `axes`, con el primer eje como el más significativo
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+
+
+def _corners(dimensions):
+    # Desplazamientos de las 2^d esquinas de una celda
+    return np.array(np.meshgrid(*[[0, 1]] * dimensions, indexing='ij')).reshape(dimensions, -1).T
+
+
+def _compile_scalar(node, and_func, or_func):
+    """
+    Convierte un antecedente compilado por VectorizedEvaluator en una función de las
+    pertenencias escalares de una lectura
+    """
+    kind = node[0]
+    if kind == 'term':
+        key = (node[1], node[2])
+        return lambda memberships: memberships[key]
+    if kind == 'not':
+        inner = _compile_scalar(node[1], and_func, or_func)
+        return lambda memberships: 1.0 - inner(memberships)
+    first = _compile_scalar(node[1], and_func, or_func)
+    second = _compile_scalar(node[2], and_func, or_func)
+    combine = and_func if kind == 'and' else or_func
+    return lambda memberships: combine(first(memberships), second(memberships))
+
+
+class LookupTableEngine:
+    """
+    Motor de inferencia compilado. La fuzzificación y el disparo de las reglas
+    (interpolación lineal y min/max, baratos) se calculan exactos para cada lectura;
+    la defuzzificación, la parte cara, se resuelve con interpolación multilineal sobre
+    una tabla precalculada del centroide de cada salida en función de los niveles de
+    corte de sus conjuntos. Una tabla sobre las entradas no sirve: los min/max de las
+    reglas cruzan sus celdas en diagonal y el error solo baja con el paso de la rejilla.
+
+    Las celdas que tocan un nodo sin membresía (NaN) o cuyo error supera la tolerancia
+    se resuelven con el centroide exacto, así el motor da el mismo resultado (o el
+    mismo error) que 'numpy' y 'skfuzzy' dentro de la tolerancia.
+    """
+
+    def __init__(self, evaluator, axes, tables, exact=None, max_error=None, p99_error=None):
+        self.evaluator = evaluator
+        # Conjuntos de cada salida que aparecen en algún consecuente: los ejes de su tabla
+        used = {(variable, term) for *_, consequents in evaluator.rules for variable, term, _ in consequents}
+        self.terms = {label: tuple(term for term in evaluator.outputs[label][1] if (label, term) in used)
+                      for label in OUTPUT_LABELS}
+        self.axes = {label: tuple(np.asarray(axis, dtype=np.float64) for axis in axes[label]) for label in OUTPUT_LABELS}
+        self.tables = {label: np.ascontiguousarray(tables[label], dtype=np.float64) for label in OUTPUT_LABELS}
+        self.exact = {
+            label: np.zeros(tuple(len(axis) - 1 for axis in self.axes[label]), dtype=bool)
+            if exact is None else np.asarray(exact[label], dtype=bool)
+            for label in OUTPUT_LABELS
+        }
+        # Error máximo y percentil 99 observados en la validación, por salida (estado, tiempo_bomba)
+        self.max_error = None if max_error is None else tuple(float(e) for e in max_error)
+        self.p99_error = None if p99_error is None else tuple(float(e) for e in p99_error)
+
+        for label in OUTPUT_LABELS:
+            expected = tuple(len(axis) for axis in self.axes[label])
+            if len(expected) != len(self.terms[label]) or self.tables[label].shape != expected:
+                raise ValueError(f"Tabla de '{label}' con forma {self.tables[label].shape}, se esperaba "
+                                 f"un eje por conjunto usado ({len(self.terms[label])})")
+            if self.exact[label].shape != tuple(n - 1 for n in expected):
+                raise ValueError(f"Celdas exactas de '{label}' con forma {self.exact[label].shape}")
+
+        self._prepare()
+
+    def _prepare(self):
+        # Estructuras derivadas: esquinas de las celdas y, para la ruta escalar en Python
+        # puro, tramos lineales de las funciones de pertenencia de entrada, reglas con
+        # min/max de Python, ejes y tablas en listas
+        evaluator = self.evaluator
+        self._corners = {label: _corners(len(self.terms[label])) for label in OUTPUT_LABELS}
+        self._inputs = [(label, *_breakpoints(*evaluator.inputs[label])) for label in INPUT_LABELS]
+        self._rules = [
+            (_compile_scalar(antecedent, _SCALAR_FUNCTIONS.get(and_func, and_func),
+                             _SCALAR_FUNCTIONS.get(or_func, or_func)), consequents)
+            for antecedent, and_func, or_func, consequents in evaluator.rules
+        ]
+        self._accumulation = {label: _SCALAR_FUNCTIONS.get(output[2], output[2])
+                              for label, output in evaluator.outputs.items()}
+        self._axis_lists = {label: [axis.tolist() for axis in axes] for label, axes in self.axes.items()}
+        # Tablas aplanadas y desplazamiento de cada esquina de la celda en ellas, con el
+        # primer eje como el más significativo (el orden en que _lookup reduce la celda)
+        self._flat = {label: table.ravel().tolist() for label, table in self.tables.items()}
+        self._strides = {label: [stride // table.itemsize for stride in table.strides]
+                         for label, table in self.tables.items()}
+        self._offsets = {label: [int(np.dot(corner, self._strides[label])) for corner in self._corners[label]]
+                         for label in OUTPUT_LABELS}
+        # Celdas exactas por el índice aplanado de su esquina inferior
+        self._exact_bases = {
+            label: set(np.dot(np.argwhere(self.exact[label]), self._strides[label]).astype(int).tolist())
+            for label in OUTPUT_LABELS
+        }
+
+    def __getstate__(self):
+        # Las estructuras derivadas (closures, listas) no se serializan: se reconstruyen al cargar
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._prepare()
+
+    @classmethod
+    def build(cls, control_system, evaluator=None, resolution=DEFAULT_RESOLUTION,
+              validation_samples=VALIDATION_SAMPLES, tolerance=DEFAULT_TOLERANCE, seed=0):
+        """
+        Precalcula la tabla de cada salida con el centroide exacto en cada nodo, marca
+        para cálculo exacto las celdas que tocan un nodo sin membresía o cuyo centro se
+        aleja más de la mitad de `tolerance`, y mide el error sobre lecturas (ver
+        measure_error). Lanza ValueError si una tabla supera MAX_TABLE_NODES o si el
+        error máximo supera `tolerance` en alguna salida
+        """
+        if evaluator is None:
+            evaluator = VectorizedEvaluator(control_system)
+        used = {(variable, term) for *_, consequents in evaluator.rules for variable, term, _ in consequents}
+
+        axes, tables, exact = {}, {}, {}
+        for label, limit in zip(OUTPUT_LABELS, tolerance):
+            terms = [term for term in evaluator.outputs[label][1] if (label, term) in used]
+            mfs = [evaluator.outputs[label][1][term] for term in terms]
+            axes[label] = [build_axis(mfs, resolution)] * len(terms)
+            shape = tuple(len(axis) for axis in axes[label])
+            if np.prod(shape, dtype=np.float64) > MAX_TABLE_NODES:
+                raise ValueError(f"La tabla de '{label}' tendría {int(np.prod(shape, dtype=np.float64))} nodos "
+                                 f"(máximo {MAX_TABLE_NODES})")
+            tables[label] = _defuzzify(evaluator, label, terms, _grid(axes[label])).reshape(shape)
+
+            # Celdas con algún nodo NaN, o cuyo centro interpolado se aleja del exacto
+            cells = tuple(n - 1 for n in shape)
+            touches_nan = np.zeros(cells, dtype=bool)
+            interpolated = np.zeros(cells)
+            for corner in _corners(len(terms)):
+                values = tables[label][tuple(slice(c, c + n) for c, n in zip(corner, cells))]
+                touches_nan |= np.isnan(values)
+                interpolated += values
+            interpolated /= 2 ** len(terms)
+            centers = [(axis[:-1] + axis[1:]) / 2 for axis in axes[label]]
+            error = np.abs(interpolated - _defuzzify(evaluator, label, terms, _grid(centers)).reshape(cells))
+            exact[label] = touches_nan | ~(error <= limit / 2)
+
+        engine = cls(evaluator, axes, tables, exact)
+        if validation_samples:
+            engine.max_error, engine.p99_error = engine.measure_error(validation_samples, seed)
+            exceeded = [f"{label} {error:.3f} > {limit}" for label, error, limit
+                        in zip(OUTPUT_LABELS, engine.max_error, tolerance) if error > limit]
+            if exceeded:
+                raise ValueError(f"La tabla del motor 'lut' supera la tolerancia ({', '.join(exceeded)})")
+            logger.info("Tablas del motor 'lut': error máximo %s, celdas exactas %s",
+                        dict(zip(OUTPUT_LABELS, engine.max_error)),
+                        {label: int(exact[label].sum()) for label in OUTPUT_LABELS})
+        return engine
+
+    def measure_error(self, samples=VALIDATION_SAMPLES, seed=0):
+        """
+        Compara el motor contra el evaluador vectorizado en `samples` lecturas aleatorias
+        sobre los universos de entrada. Retorna (error máximo, percentil 99) por salida;
+        una lectura que solo uno de los dos marca sin membresía cuenta como error infinito.
+        El máximo es empírico, el error real puede ser algo mayor entre los puntos medidos
+        """
+        rng = np.random.default_rng(seed)
+        lower = [self.evaluator.inputs[label][0][0] for label in INPUT_LABELS]
+        upper = [self.evaluator.inputs[label][0][-1] for label in INPUT_LABELS]
+        points = rng.uniform(lower, upper, size=(int(samples), len(INPUT_LABELS)))
+        outputs = self.evaluator.evaluate(dict(zip(INPUT_LABELS, points.T)))
+        expected = np.stack([outputs[label] for label in OUTPUT_LABELS], axis=-1)
+        actual = self.evaluate_many(points)
+        mismatch = np.isnan(actual) != np.isnan(expected)
+        error = np.where(mismatch, np.inf, np.nan_to_num(np.abs(actual - expected)))
+        return tuple(float(e) for e in error.max(axis=0)), tuple(float(e) for e in np.percentile(error, 99, axis=0))
+
+    def evaluate(self, temperatura, humedad, suelo, luz):
+        """
+        Retorna (estado, tiempo_bomba) para una lectura; lanza ValueError si alguna
+        salida queda sin membresía
+        """
+        memberships = {}
+        for (label, xs, segments), value in zip(self._inputs, (temperatura, humedad, suelo, luz)):
+            value = min(max(float(value), xs[0]), xs[-1])
+            idx = bisect.bisect_right(xs, value) - 1
+            offset = value - xs[idx]
+            for term, (ys, slopes) in segments.items():
+                memberships[(label, term)] = ys[idx] + slopes[idx] * offset
+
+        cuts = {}
+        for antecedent, consequents in self._rules:
+            firing = antecedent(memberships)
+            for variable, term, weight in consequents:
+                activation = firing * weight
+                key = (variable, term)
+                cuts[key] = self._accumulation[variable](activation, cuts[key]) if key in cuts else activation
+
+        estado, tiempo_bomba = (self._lookup(label, cuts) for label in OUTPUT_LABELS)
+        if np.isnan(estado) or np.isnan(tiempo_bomba):
+            raise ValueError("Sin reglas activas para las condiciones dadas")
+        return estado, tiempo_bomba
+
+    def _lookup(self, label, cuts):
+        terms = self.terms[label]
+        if not terms:
+            return float('nan')
+        fractions = []
+        base = 0
+        for axis, term, stride in zip(self._axis_lists[label], terms, self._strides[label]):
+            level = min(max(float(cuts[(label, term)]), 0.0), 1.0)
+            idx = min(bisect.bisect_right(axis, level) - 1, len(axis) - 2)
+            fractions.append((level - axis[idx]) / (axis[idx + 1] - axis[idx]))
+            base += idx * stride
+
+        if base in self._exact_bases[label]:
+            levels = np.array([[float(cuts[(label, term)]) for term in terms]])
+            return float(_defuzzify(self.evaluator, label, terms, levels)[0])
+
+        # Reducir la celda 2×…×2 eje por eje
+        flat = self._flat[label]
+        cell = [flat[base + offset] for offset in self._offsets[label]]
+        for fraction in fractions:
+            half = len(cell) // 2
+            cell = [low + (high - low) * fraction for low, high in zip(cell[:half], cell[half:])]
+        return cell[0]
+
+    def evaluate_many(self, points):
+        """
+        Evaluación vectorizada para un arreglo (N, 4) de lecturas. Retorna (N, 2) con
+        (estado, tiempo_bomba); NaN en las salidas sin membresía
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        evaluator = self.evaluator
+        cuts = evaluator.cut_levels(evaluator.memberships(dict(zip(INPUT_LABELS, points.T))))
+        return np.column_stack([self._lookup_many(label, cuts, len(points)) for label in OUTPUT_LABELS])
+
+    def _lookup_many(self, label, cuts, size):
+        terms = self.terms[label]
+        if not terms:
+            return np.full(size, np.nan)
+        levels = np.clip(np.column_stack([np.broadcast_to(cuts[(label, term)], size) for term in terms]), 0.0, 1.0)
+
+        indices = np.empty(levels.shape, dtype=np.intp)
+        fractions = np.empty(levels.shape, dtype=np.float64)
+        for dim, axis in enumerate(self.axes[label]):
+            idx = np.clip(np.searchsorted(axis, levels[:, dim], side='right') - 1, 0, len(axis) - 2)
+            indices[:, dim] = idx
+            fractions[:, dim] = (levels[:, dim] - axis[idx]) / (axis[idx + 1] - axis[idx])
+
+        table = self.tables[label]
+        result = np.zeros(size, dtype=np.float64)
+        for corner in self._corners[label]:
+            weight = np.prod(np.where(corner, fractions, 1.0 - fractions), axis=1)
+            result += weight * table[tuple((indices + corner).T)]
+
+        exact = self.exact[label][tuple(indices.T)]
+        if exact.any():
+            result[exact] = _defuzzify(self.evaluator, label, terms, levels[exact])
+        return result
+
+    def save(self, path):
+        """
+        Guarda las tablas compiladas en un archivo .npz
+        """
+        arrays = {}
+        for label in OUTPUT_LABELS:
+            arrays[f'table_{label}'] = self.tables[label]
+            arrays[f'exact_{label}'] = self.exact[label]
+            for i, axis in enumerate(self.axes[label]):
+                arrays[f'axis_{label}_{i}'] = axis
+        np.savez_compressed(
+            path,
+            max_error=np.array(self.max_error if self.max_error is not None else [np.nan] * len(OUTPUT_LABELS)),
+            p99_error=np.array(self.p99_error if self.p99_error is not None else [np.nan] * len(OUTPUT_LABELS)),
+            **arrays
+        )
+
+    @classmethod
+    def load(cls, path, evaluator):
+        """
+        Carga las tablas guardadas con save(); `evaluator` debe corresponder a la misma
+        base de reglas
+        """
+        with np.load(path) as data:
+            axes = {}
+            for label in OUTPUT_LABELS:
+                dimensions = len(data[f'table_{label}'].shape)
+                axes[label] = [data[f'axis_{label}_{i}'] for i in range(dimensions)]
+            tables = {label: data[f'table_{label}'] for label in OUTPUT_LABELS}
+            exact = {label: data[f'exact_{label}'] for label in OUTPUT_LABELS}
+            max_error = data['max_error']
+            p99_error = data['p99_error']
+            return cls(evaluator, axes, tables, exact, None if np.isnan(max_error).any() else max_error,
+                       None if np.isnan(p99_error).any() else p99_error)
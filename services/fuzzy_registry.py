@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+from .fuzzy_service import FuzzyService, DEFAULT_ENGINE
+from .fuzzy_rulebase import RULEBASE_PATH, build_rulebase, load_definition
+
+logger = logging.getLogger(__name__)
+
+# Directorio donde se guarda la base de reglas compilada para que otros procesos
+# (workers de gunicorn, reinicios) la carguen en lugar de reconstruirla
+COMPILED_DIR = os.environ.get('FUZZY_COMPILED_DIR')
+# Segundos entre revisiones de FUZZY_RULEBASE_PATH (0 desactiva la recarga en caliente)
+RULEBASE_POLL_INTERVAL = float(os.environ.get('FUZZY_RULEBASE_POLL', 5))
+
+_services = {}
+_lock = threading.Lock()
+# Última definición aplicada con éxito; los servicios creados después la usan
+_definition = None
+_watcher = None
+
+
+def get_fuzzy_service(engine=DEFAULT_ENGINE):
+    """
+    Retorna la instancia compartida de FuzzyService para `engine`, creándola en el
+    primer uso. Todas las rutas y servicios del proceso usan la misma instancia.
+    """
+    service = _services.get(engine)
+    if service is None:
+        with _lock:
+            service = _services.get(engine)
+            if service is None:
+                service = _services[engine] = _build(engine)
+    if _watcher is not None:
+        _watcher.ensure_started()
+    return service
+
+
+def current_fuzzy_service(engine=DEFAULT_ENGINE):
+    """
+    Retorna la instancia compartida de `engine` si ya se construyó, o None; a
+    diferencia de get_fuzzy_service() nunca la construye (métricas, diagnóstico)
+    """
+    return _services.get(engine)
+
+
+def preload(engines=(DEFAULT_ENGINE,)):
+    """
+    Construye los servicios antes de atender peticiones. Con `gunicorn --preload`
+    se ejecuta en el proceso maestro y los workers heredan las instancias por
+    copy-on-write en lugar de construir cada uno la suya.
+    """
+    for engine in engines:
+        get_fuzzy_service(engine)
+
+
+def reload_rulebase(definition=None):
+    """
+    Aplica una base de reglas (por defecto la de FUZZY_RULEBASE_PATH) a todos los
+    servicios del proceso. Lanza ValueError si no es válida, sin cambiar nada.
+    Retorna {motor: versión activa}
+    """
+    global _definition
+    definition = load_definition() if definition is None else definition
+    build_rulebase(definition)
+    with _lock:
+        services = dict(_services)
+        _definition = definition
+    versions = {}
+    for engine, service in services.items():
+        start = time.perf_counter()
+        previous = service.rulebase_version
+        if service.reload(definition):
+            logger.info("Base de reglas de '%s' actualizada: %s -> %s en %.1f ms (pid %d)", engine, previous,
+                        service.rulebase_version, (time.perf_counter() - start) * 1000, os.getpid())
+        versions[engine] = service.rulebase_version
+    return versions
+
+
+class RuleBaseWatcher:
+    """
+    Revisa cada `interval` segundos la fecha y el tamaño de `path` y, si cambiaron,
+    recarga la base de reglas en todos los servicios. Si la definición nueva no es
+    válida se registra el error y se mantiene la versión activa. El hilo se inicia
+    en cada proceso (los workers de gunicorn no heredan hilos del maestro)
+    """
+
+    def __init__(self, path, interval=RULEBASE_POLL_INTERVAL):
+        self.path = path
+        self.interval = float(interval)
+        self._signature = self._stat()
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='fuzzy-rulebase', daemon=True).start()
+
+    def check(self):
+        """
+        Recarga la base de reglas si el archivo cambió; retorna True si se aplicó
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            reload_rulebase(load_definition(self.path))
+        except (OSError, ValueError) as e:
+            logger.error("Base de reglas %s no aplicada: %s", self.path, e)
+            return False
+        return True
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Error al recargar la base de reglas")
+
+
+if RULEBASE_PATH and RULEBASE_POLL_INTERVAL > 0:
+    _watcher = RuleBaseWatcher(RULEBASE_PATH)
+
+
+def _build(engine):
+    start = time.perf_counter()
+    service = FuzzyService(engine=engine, cache_dir=COMPILED_DIR, definition=_definition)
+    elapsed = (time.perf_counter() - start) * 1000
+    logger.info(
+        "FuzzyService '%s' listo en %.1f ms (versión %s, %s, pid %d)",
+        engine, elapsed, service.rulebase_version,
+        f"cargado de {service.loaded_from}" if service.loaded_from else "compilado",
+        os.getpid()
+    )
+    return service
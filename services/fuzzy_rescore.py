@@ -0,0 +1,323 @@
+"""
+Reevaluación del historial guardado con una base de reglas candidata.
+
+Uso (desde la raíz del repositorio, con las mismas variables de entorno del servidor
+para abrir el mismo almacén, p. ej. SENSOR_STORE=sqlite o SENSOR_SNAPSHOT_DIR):
+    python -m services.fuzzy_rescore candidata.json
+    python -m services.fuzzy_rescore candidata.yaml --since 1700000000 --dispositivo d1 -o reporte.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .fuzzy_rulebase import build_rulebase, fingerprint, load_definition
+from .fuzzy_service import FuzzyService
+from .fuzzy_lut import INPUT_LABELS
+from .log_config import log_event
+from .sensor_store import DEVICE_FIELD, INPUT_FIELDS, VERSION_FIELD, create_store, iter_records
+
+logger = logging.getLogger(__name__)
+
+# Lecturas por bloque: se leen del almacén y se evalúan juntas en un proceso del pool
+DEFAULT_CHUNK_SIZE = int(os.environ.get('FUZZY_RESCORE_CHUNK_SIZE', 20000))
+# Procesos del pool (0 = os.cpu_count())
+DEFAULT_PROCESSES = int(os.environ.get('FUZZY_RESCORE_PROCESSES', 0))
+# Decisiones cambiadas que se incluyen como ejemplo en el reporte
+DEFAULT_MAX_EXAMPLES = 20
+# Dispositivos con más cambios que se listan en el reporte
+TOP_DEVICES = 20
+# Límites del histograma de diferencias, como fracción del ancho del universo de cada
+# salida; más finos cerca de cero, donde se concentran los cambios de una base ajustada
+DELTA_EDGES = (0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Las evaluaciones se guardan con 2 decimales: diferencias menores no cuentan como cambio
+DELTA_TOLERANCE = 0.005
+
+# Bloque de lecturas con su evaluación guardada, en columnas
+Chunk = namedtuple('Chunk', ['ids', 'devices', 'timestamps', 'readings', 'estado', 'tiempo_bomba',
+                             'activar_bomba', 'error', 'versions'])
+
+_worker_service = None
+
+
+def _init_worker(definition):
+    # Cada proceso del pool compila la base candidata una sola vez
+    global _worker_service
+    _worker_service = FuzzyService(engine='numpy', cache_size=0, definition=definition)
+
+
+def _evaluate_worker(readings):
+    return _evaluate(_worker_service, readings)
+
+
+def _evaluate(service, readings):
+    batch = service.evaluate_batch(readings)
+    # Mismo redondeo que las evaluaciones guardadas
+    return np.round(batch['estado'], 2), np.round(batch['tiempo_bomba'], 2), batch['activar_bomba'], batch['error']
+
+
+def _chunk(records):
+    evaluations = [record['evaluacion'] for record in records]
+    return Chunk(
+        ids=np.array([record['id'] for record in records], dtype=np.int64),
+        devices=np.array([record[DEVICE_FIELD] for record in records], dtype=object),
+        timestamps=np.array([record['timestamp'] for record in records], dtype=np.float64),
+        readings=np.array([[record[name] for name in INPUT_FIELDS] for record in records], dtype=np.float64),
+        estado=np.array([evaluation['estado'] for evaluation in evaluations], dtype=np.float64),
+        tiempo_bomba=np.array([evaluation['tiempo_bomba'] for evaluation in evaluations], dtype=np.float64),
+        activar_bomba=np.array([evaluation['activar_bomba'] for evaluation in evaluations], dtype=bool),
+        error=np.array(['error' in evaluation for evaluation in evaluations], dtype=bool),
+        versions=[evaluation.get(VERSION_FIELD) for evaluation in evaluations]
+    )
+
+
+class DeltaStats:
+    """
+    Distribución de las diferencias (nueva - guardada) de una salida, acumulada por
+    bloques en memoria constante: totales, extremos e histograma de intervalos fijos
+    """
+
+    def __init__(self, width, edges=DELTA_EDGES):
+        fractions = np.asarray(edges, dtype=np.float64)
+        self.edges = np.concatenate([-fractions[::-1], fractions]) * width
+        self.histogram = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.count = 0
+        self.changed = 0
+        self.total = 0.0
+        self.total_abs = 0.0
+        self.total_sq = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, deltas):
+        if not len(deltas):
+            return
+        self.count += len(deltas)
+        self.changed += int(np.count_nonzero(np.abs(deltas) > DELTA_TOLERANCE))
+        self.total += float(deltas.sum())
+        self.total_abs += float(np.abs(deltas).sum())
+        self.total_sq += float(np.square(deltas).sum())
+        low, high = float(deltas.min()), float(deltas.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        # Los valores fuera del rango caen en los intervalos de los extremos
+        clipped = np.clip(deltas, self.edges[0], self.edges[-1])
+        self.histogram += np.histogram(clipped, self.edges)[0]
+
+    def to_dict(self):
+        mean = self.total / self.count if self.count else None
+        return {
+            "lecturas": self.count,
+            "cambiadas": self.changed,
+            "media": round(mean, 4) if mean is not None else None,
+            "media_absoluta": round(self.total_abs / self.count, 4) if self.count else None,
+            "desviacion": round(max(self.total_sq / self.count - mean * mean, 0.0) ** 0.5, 4) if self.count else None,
+            "min": round(self.min, 4) if self.min is not None else None,
+            "max": round(self.max, 4) if self.max is not None else None,
+            "histograma": [
+                {"desde": round(float(low), 4), "hasta": round(float(high), 4), "lecturas": int(count)}
+                for low, high, count in zip(self.edges[:-1], self.edges[1:], self.histogram)
+            ]
+        }
+
+
+class RescoreReport:
+    """
+    Diferencias entre las evaluaciones guardadas y las de la base candidata. Solo
+    guarda contadores y hasta `max_examples` ejemplos, así su tamaño no depende del historial
+    """
+
+    def __init__(self, version, widths, max_examples=DEFAULT_MAX_EXAMPLES):
+        self.version = version
+        self.max_examples = max_examples
+        self.readings = 0
+        self.turned_on = 0
+        self.turned_off = 0
+        self.errors_before = 0
+        self.errors_after = 0
+        self.new_errors = 0
+        self.resolved_errors = 0
+        self.estado = DeltaStats(widths['estado_planta'])
+        self.tiempo_bomba = DeltaStats(widths['tiempo_bomba'])
+        self.versions = {}
+        self.devices = {}
+        self.examples = []
+
+    def add(self, chunk, result):
+        estado, tiempo_bomba, activar_bomba, error = result
+        self.readings += len(chunk.ids)
+        self.turned_on += int(np.count_nonzero(activar_bomba & ~chunk.activar_bomba))
+        self.turned_off += int(np.count_nonzero(chunk.activar_bomba & ~activar_bomba))
+        self.errors_before += int(np.count_nonzero(chunk.error))
+        self.errors_after += int(np.count_nonzero(error))
+        self.new_errors += int(np.count_nonzero(error & ~chunk.error))
+        self.resolved_errors += int(np.count_nonzero(chunk.error & ~error))
+
+        # Las diferencias solo tienen sentido donde ambas evaluaciones tienen resultado
+        valid = ~(error | chunk.error)
+        self.estado.add(estado[valid] - chunk.estado[valid])
+        self.tiempo_bomba.add(tiempo_bomba[valid] - chunk.tiempo_bomba[valid])
+
+        for version in chunk.versions:
+            self.versions[version] = self.versions.get(version, 0) + 1
+
+        changed = activar_bomba != chunk.activar_bomba
+        names, totals = np.unique(chunk.devices, return_counts=True)
+        changed_names, changed_totals = np.unique(chunk.devices[changed], return_counts=True)
+        changes = dict(zip(changed_names.tolist(), changed_totals.tolist()))
+        for name, total in zip(names.tolist(), totals.tolist()):
+            counts = self.devices.setdefault(name, [0, 0])
+            counts[0] += total
+            counts[1] += changes.get(name, 0)
+
+        for index in np.flatnonzero(changed)[:self.max_examples - len(self.examples)].tolist():
+            self.examples.append({
+                "id": int(chunk.ids[index]),
+                "dispositivo": chunk.devices[index],
+                "timestamp": float(chunk.timestamps[index]),
+                "condiciones": dict(zip(INPUT_LABELS, chunk.readings[index].tolist())),
+                "antes": self._outcome(chunk.estado[index], chunk.tiempo_bomba[index],
+                                       chunk.activar_bomba[index], chunk.error[index], chunk.versions[index]),
+                "despues": self._outcome(estado[index], tiempo_bomba[index], activar_bomba[index],
+                                         error[index], self.version)
+            })
+
+    @staticmethod
+    def _outcome(estado, tiempo_bomba, activar_bomba, error, version):
+        return {"estado": float(estado), "tiempo_bomba": float(tiempo_bomba),
+                "activar_bomba": bool(activar_bomba), "error": bool(error), "version_reglas": version}
+
+    def to_dict(self):
+        changes = self.turned_on + self.turned_off
+        devices = sorted(((counts[1], name, counts[0]) for name, counts in self.devices.items() if counts[1]),
+                         reverse=True)[:TOP_DEVICES]
+        return {
+            "version_candidata": self.version,
+            # Lecturas guardadas antes de versionar la base de reglas no tienen versión
+            "versiones_guardadas": {version or "sin_version": count for version, count in self.versions.items()},
+            "lecturas": self.readings,
+            "activar_bomba": {
+                "cambios": changes,
+                "proporcion": round(changes / self.readings, 4) if self.readings else None,
+                "encendidas": self.turned_on,
+                "apagadas": self.turned_off,
+                "ejemplos": self.examples
+            },
+            "errores": {
+                "antes": self.errors_before,
+                "despues": self.errors_after,
+                "nuevos": self.new_errors,
+                "resueltos": self.resolved_errors
+            },
+            "estado": self.estado.to_dict(),
+            "tiempo_bomba": self.tiempo_bomba.to_dict(),
+            "dispositivos": {
+                "total": len(self.devices),
+                "con_cambios": sum(1 for counts in self.devices.values() if counts[1]),
+                "mas_cambios": [{"dispositivo": name, "lecturas": readings, "cambios": changed}
+                                for changed, name, readings in devices]
+            }
+        }
+
+
+def _chunks(records, chunk_size):
+    while True:
+        records_chunk = list(itertools.islice(records, chunk_size))
+        if not records_chunk:
+            return
+        yield _chunk(records_chunk)
+
+
+def rescore(store, definition, since=None, until=None, device=None, limit=None,
+            chunk_size=DEFAULT_CHUNK_SIZE, processes=DEFAULT_PROCESSES, max_examples=DEFAULT_MAX_EXAMPLES):
+    """
+    Reevalúa las lecturas guardadas en `store` con la base de reglas `definition` y
+    retorna el reporte de diferencias (ver RescoreReport.to_dict).
+
+    El historial se recorre por bloques de `chunk_size` lecturas (iter_records) y cada
+    bloque se evalúa con el evaluador por lotes en un pool de `processes` procesos
+    (0/None = os.cpu_count(), 1 = sin pool; con un solo bloque no se crea el pool).
+    Como mucho hay 2 × processes bloques en curso, así la memoria no depende del
+    tamaño del historial. Los procesos se crean con 'spawn': un fork heredaría los
+    locks que tuvieran tomados otros hilos (logging, métricas). Lanza ValueError si
+    la definición no es válida.
+
+    Se compara con la evaluación guardada de cada lectura; con PUMP_CONTROLLER=1 esa
+    evaluación corresponde a las entradas suavizadas y activar_bomba incluye la histéresis.
+    """
+    start = time.perf_counter()
+    rulebase = build_rulebase(definition)
+    widths = {label: float(np.ptp(rulebase.variables[label].universe)) for label in ('estado_planta', 'tiempo_bomba')}
+    report = RescoreReport(fingerprint(rulebase.rules), widths, max_examples)
+    processes = processes or os.cpu_count() or 1
+
+    chunks = _chunks(iter_records(store, since=since, until=until, device=device, limit=limit,
+                                  chunk_size=chunk_size), chunk_size)
+    first = list(itertools.islice(chunks, 2))
+    if processes == 1 or len(first) < 2:
+        service = FuzzyService(engine='numpy', cache_size=0, definition=rulebase.definition)
+        for chunk in itertools.chain(first, chunks):
+            report.add(chunk, _evaluate(service, chunk.readings))
+    else:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(rulebase.definition,)) as pool:
+            pending = deque()
+            for chunk in itertools.chain(first, chunks):
+                pending.append((chunk, pool.submit(_evaluate_worker, chunk.readings)))
+                # Los resultados se consumen en orden: los ejemplos quedan en orden cronológico
+                if len(pending) >= 2 * processes:
+                    chunk, future = pending.popleft()
+                    report.add(chunk, future.result())
+            while pending:
+                chunk, future = pending.popleft()
+                report.add(chunk, future.result())
+
+    result = report.to_dict()
+    result["duracion_s"] = round(time.perf_counter() - start, 3)
+    result["procesos"] = processes
+    log_event(logger, logging.INFO, "Historial reevaluado", version=report.version, lecturas=report.readings,
+              cambios=result["activar_bomba"]["cambios"], s=result["duracion_s"])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('definicion', help='base de reglas candidata (JSON, o YAML con PyYAML)')
+    parser.add_argument('--since', type=float, help='desde este timestamp (epoch en segundos)')
+    parser.add_argument('--until', type=float, help='hasta este timestamp (epoch en segundos)')
+    parser.add_argument('--dispositivo', help='solo las lecturas de este dispositivo')
+    parser.add_argument('--limit', type=int, help='máximo de lecturas a reevaluar')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='lecturas por bloque')
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES, help='procesos del pool (0 = todos los CPU)')
+    parser.add_argument('--ejemplos', type=int, default=DEFAULT_MAX_EXAMPLES,
+                        help='decisiones cambiadas a incluir como ejemplo')
+    parser.add_argument('-o', '--output', help='archivo JSON del reporte (por defecto stdout)')
+    args = parser.parse_args(argv)
+
+    try:
+        definition = load_definition(args.definicion)
+        store = create_store()
+        report = rescore(store, definition, since=args.since, until=args.until, device=args.dispositivo,
+                         limit=args.limit, chunk_size=args.chunk_size, processes=args.processes,
+                         max_examples=args.ejemplos)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
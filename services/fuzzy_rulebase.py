@@ -0,0 +1,305 @@
+import copy
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+import numpy as np
+import skfuzzy as fuzz
+from skfuzzy import control as ctrl
+from .fuzzy_lut import INPUT_LABELS, OUTPUT_LABELS
+
+try:
+    import yaml
+except ImportError:  # PyYAML es opcional: sin él solo se aceptan definiciones JSON
+    yaml = None
+
+# Archivo con la base de reglas (JSON, o YAML con PyYAML); sin él se usa DEFAULT_DEFINITION
+RULEBASE_PATH = os.environ.get('FUZZY_RULEBASE_PATH')
+
+# Puntos máximos del universo de una variable; cada conjunto y cada evaluación
+# trabajan sobre todos ellos
+MAX_UNIVERSE_POINTS = 10000
+
+# Base de reglas por defecto. Cada variable tiene su universo [inicio, fin, paso]
+# (como np.arange) y sus conjuntos trimf [a, b, c]. Las reglas combinan términos
+# variable[conjunto] con & (y), | (o), ~ (no) y paréntesis
+DEFAULT_DEFINITION = {
+    "variables": {
+        "temperatura": {
+            "universo": [15, 40, 1],
+            "conjuntos": {"fría": [15, 15, 25], "óptima": [20, 25, 30], "caliente": [25, 35, 40]}
+        },
+        "humedad": {
+            "universo": [0, 100, 1],
+            "conjuntos": {"baja": [0, 0, 50], "óptima": [40, 60, 80], "alta": [70, 100, 100]}
+        },
+        "suelo": {
+            "universo": [0, 1023, 1],
+            "conjuntos": {"seco": [0, 0, 500], "húmedo": [400, 600, 800], "empapado": [700, 1023, 1023]}
+        },
+        "luz": {
+            "universo": [0, 1023, 1],
+            "conjuntos": {"baja": [0, 0, 500], "óptima": [400, 600, 800], "alta": [700, 1023, 1023]}
+        },
+        "estado_planta": {
+            "universo": [0, 100, 1],
+            "conjuntos": {"malo": [0, 0, 40], "regular": [30, 50, 70], "bueno": [60, 100, 100]}
+        },
+        "tiempo_bomba": {
+            "universo": [0, 21, 1],
+            "conjuntos": {"corto": [3, 5, 7], "medio": [7, 10, 14], "largo": [13, 17, 20]}
+        }
+    },
+    "reglas": [
+        # Estado de la planta
+        {"si": "temperatura[óptima] & humedad[óptima] & suelo[húmedo] & luz[óptima]",
+         "entonces": "estado_planta[bueno]"},
+        {"si": "temperatura[óptima] & humedad[óptima] & suelo[húmedo]",
+         "entonces": "estado_planta[bueno]"},
+        {"si": "temperatura[fría] | temperatura[caliente] | humedad[baja] | humedad[alta] | "
+               "suelo[seco] | suelo[empapado] | luz[baja] | luz[alta]",
+         "entonces": "estado_planta[malo]"},
+        {"si": "temperatura[óptima] | humedad[óptima] | suelo[húmedo] | luz[óptima]",
+         "entonces": "estado_planta[regular]"},
+        # Tiempo de bomba
+        {"si": "suelo[seco] & humedad[baja]", "entonces": "tiempo_bomba[largo]"},
+        {"si": "suelo[seco] | humedad[baja]", "entonces": "tiempo_bomba[medio]"},
+        {"si": "suelo[húmedo] & humedad[óptima]", "entonces": "tiempo_bomba[corto]"},
+        {"si": "suelo[empapado] | humedad[alta]", "entonces": "tiempo_bomba[corto]"}
+    ]
+}
+
+# Base de reglas validada: variables de skfuzzy por etiqueta, reglas y la definición de origen
+RuleBase = namedtuple('RuleBase', ['variables', 'rules', 'definition'])
+
+TOKEN = re.compile(r'\s*(?:([()&|~])|([^\s\[\]()&|~]+)\[([^\]]+)\])')
+
+
+def load_definition(path=None):
+    """
+    Lee una definición de base de reglas desde `path` (JSON, o YAML si la extensión
+    es .yaml/.yml); sin `path` ni FUZZY_RULEBASE_PATH retorna DEFAULT_DEFINITION
+    """
+    path = path or RULEBASE_PATH
+    if not path:
+        return copy.deepcopy(DEFAULT_DEFINITION)
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("Las definiciones YAML requieren PyYAML")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def build_rulebase(definition):
+    """
+    Valida una definición y construye sus variables y reglas de skfuzzy. Lanza
+    ValueError con todos los problemas encontrados
+    """
+    errors = []
+    if not isinstance(definition, dict):
+        raise ValueError("La definición debe ser un objeto con 'variables' y 'reglas'")
+    specs = definition.get('variables')
+    rules_spec = definition.get('reglas')
+    if not isinstance(specs, dict):
+        raise ValueError("'variables' debe ser un objeto {nombre: {universo, conjuntos}}")
+    if not isinstance(rules_spec, list) or not rules_spec:
+        raise ValueError("'reglas' debe ser una lista no vacía")
+
+    expected = INPUT_LABELS + OUTPUT_LABELS
+    missing = [label for label in expected if label not in specs]
+    unknown = [label for label in specs if label not in expected]
+    if missing:
+        errors.append(f"Faltan variables: {', '.join(missing)}")
+    if unknown:
+        errors.append(f"Variables desconocidas: {', '.join(unknown)}")
+
+    variables = {}
+    for label in expected:
+        if label in specs:
+            variable = _build_variable(label, specs[label], errors)
+            if variable is not None:
+                variables[label] = variable
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    rules = []
+    for index, spec in enumerate(rules_spec, 1):
+        try:
+            rules.append(_build_rule(spec, variables))
+        except ValueError as e:
+            errors.append(f"Regla {index}: {e}")
+    used_inputs = {term.parent.label for rule in rules for term in rule.antecedent_terms}
+    used = {consequent.term.parent.label for rule in rules for consequent in rule.consequent}
+    for label in INPUT_LABELS:
+        if rules and label not in used_inputs:
+            errors.append(f"Ninguna regla usa la entrada '{label}'")
+    for label in OUTPUT_LABELS:
+        if rules and label not in used:
+            errors.append(f"Ninguna regla asigna la salida '{label}'")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return RuleBase(variables, rules, copy.deepcopy(definition))
+
+
+def fingerprint(rules):
+    """
+    Huella de universos, funciones de pertenencia y reglas; identifica la versión de
+    la base de reglas sin construir el sistema de control
+    """
+    variables = {}
+    for rule in rules:
+        for term in rule.antecedent_terms:
+            variables[term.parent.label] = term.parent
+        for consequent in rule.consequent:
+            variables[consequent.term.parent.label] = consequent.term.parent
+
+    digest = hashlib.sha1()
+    for label in sorted(variables):
+        variable = variables[label]
+        digest.update(label.encode())
+        digest.update(np.asarray(variable.universe, dtype=np.float64).tobytes())
+        # Conjuntos por nombre: su orden en la definición no cambia la versión
+        for term_label, term in sorted(variable.terms.items()):
+            digest.update(term_label.encode())
+            digest.update(np.asarray(term.mf, dtype=np.float64).tobytes())
+    for rule in rules:
+        digest.update(str(rule).encode())
+    return digest.hexdigest()[:12]
+
+
+def _build_variable(label, spec, errors):
+    if not isinstance(spec, dict):
+        errors.append(f"'{label}' debe ser un objeto con universo y conjuntos")
+        return None
+    universe = spec.get('universo')
+    if (not isinstance(universe, list) or len(universe) != 3
+            or not all(_is_number(value) for value in universe)
+            or universe[2] <= 0 or universe[1] <= universe[0]):
+        errors.append(f"'{label}': el universo debe ser [inicio, fin, paso] con fin > inicio y paso > 0")
+        return None
+    if (universe[1] - universe[0]) / universe[2] > MAX_UNIVERSE_POINTS:
+        errors.append(f"'{label}': el universo supera el máximo de {MAX_UNIVERSE_POINTS} puntos")
+        return None
+    sets = spec.get('conjuntos')
+    if not isinstance(sets, dict) or not sets:
+        errors.append(f"'{label}': 'conjuntos' debe ser un objeto {{nombre: [a, b, c]}} no vacío")
+        return None
+
+    values = np.arange(*universe)
+    variable = (ctrl.Antecedent if label in INPUT_LABELS else ctrl.Consequent)(values, label)
+    for name, params in sets.items():
+        if (not isinstance(params, list) or len(params) != 3 or not all(_is_number(p) for p in params)
+                or not params[0] <= params[1] <= params[2]):
+            errors.append(f"'{label}[{name}]': trimf requiere [a, b, c] numéricos con a <= b <= c")
+            continue
+        mf = fuzz.trimf(variable.universe, params)
+        if not mf.any():
+            errors.append(f"'{label}[{name}]' no tiene pertenencia en el universo")
+            continue
+        variable[name] = mf
+    return variable
+
+
+def _build_rule(spec, variables):
+    if not isinstance(spec, dict) or not isinstance(spec.get('si'), str):
+        raise ValueError("debe ser un objeto con 'si' (expresión) y 'entonces'")
+    consequents = spec.get('entonces')
+    if isinstance(consequents, str):
+        consequents = [consequents]
+    if not isinstance(consequents, list) or not consequents:
+        raise ValueError("'entonces' debe ser un término o una lista de términos")
+
+    antecedent = _ExpressionParser(spec['si'], variables).parse()
+    terms = []
+    for text in consequents:
+        match = TOKEN.fullmatch(text.strip()) if isinstance(text, str) else None
+        if match is None or match.group(2) is None:
+            raise ValueError(f"consecuente inválido: {text!r}")
+        if match.group(2) not in OUTPUT_LABELS:
+            raise ValueError(f"'{match.group(2)}' no es una salida")
+        terms.append(_term(variables, match.group(2), match.group(3)))
+    return ctrl.Rule(antecedent, terms if len(terms) > 1 else terms[0])
+
+
+def _term(variables, label, name):
+    variable = variables.get(label)
+    if variable is None:
+        raise ValueError(f"variable desconocida '{label}'")
+    if name not in variable.terms:
+        raise ValueError(f"'{label}' no tiene el conjunto '{name}'")
+    return variable[name]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+class _ExpressionParser:
+    """
+    Analizador descendente de antecedentes: ~ tiene mayor precedencia que &, y & que |,
+    con asociatividad por la izquierda (igual que los operadores de Python sobre términos)
+    """
+
+    def __init__(self, text, variables):
+        self.text = text
+        self.variables = variables
+        self.tokens = []
+        position = 0
+        while position < len(text.rstrip()):
+            match = TOKEN.match(text, position)
+            if match is None:
+                raise ValueError(f"expresión inválida cerca de {text[position:position + 20]!r}")
+            self.tokens.append(match.group(1) or (match.group(2), match.group(3)))
+            position = match.end()
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("antecedente vacío")
+        result = self._or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"símbolo inesperado {self._describe(self.tokens[self.position])}")
+        return result
+
+    def _or(self):
+        result = self._and()
+        while self._accept('|'):
+            result = result | self._and()
+        return result
+
+    def _and(self):
+        result = self._not()
+        while self._accept('&'):
+            result = result & self._not()
+        return result
+
+    def _not(self):
+        if self._accept('~'):
+            return ~self._not()
+        if self._accept('('):
+            result = self._or()
+            if not self._accept(')'):
+                raise ValueError("falta ')'")
+            return result
+        if self.position >= len(self.tokens):
+            raise ValueError("la expresión termina antes de tiempo")
+        token = self.tokens[self.position]
+        if not isinstance(token, tuple):
+            raise ValueError(f"símbolo inesperado {self._describe(token)}")
+        self.position += 1
+        label, name = token
+        if label not in INPUT_LABELS:
+            raise ValueError(f"'{label}' no es una entrada")
+        return _term(self.variables, label, name)
+
+    def _accept(self, symbol):
+        if self.position < len(self.tokens) and self.tokens[self.position] == symbol:
+            self.position += 1
+            return True
+        return False
+
+    @staticmethod
+    def _describe(token):
+        return f"'{token[0]}[{token[1]}]'" if isinstance(token, tuple) else f"'{token}'"
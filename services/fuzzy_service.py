@@ -1,141 +1,340 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import namedtuple
 import numpy as np
-import skfuzzy as fuzz
 from skfuzzy import control as ctrl
+from .fuzzy_cache import EvaluationCache
+from .fuzzy_rulebase import build_rulebase, fingerprint, load_definition
+from .fuzzy_lut import LookupTableEngine, INPUT_LABELS
+from .fuzzy_vectorized import VectorizedEvaluator
+from .metrics import FUZZY_EVALUATIONS, FUZZY_BATCHES, FUZZY_BATCH_ROWS, FUZZY_STAGES
+
+logger = logging.getLogger(__name__)
+
+# Motores de inferencia disponibles por instancia
+ENGINES = ('skfuzzy', 'numpy', 'lut')
+DEFAULT_ENGINE = os.environ.get('FUZZY_ENGINE', 'skfuzzy')
+
+# Caché de evaluaciones: tamaño y resolución por entrada. Desactivado por defecto: con
+# FUZZY_CACHE_SIZE > 0 cada lectura recibe la evaluación de su punto de la rejilla
+CACHE_SIZE = int(os.environ.get('FUZZY_CACHE_SIZE', 0))
+CACHE_RESOLUTION = tuple(
+    float(r) for r in os.environ.get('FUZZY_CACHE_RESOLUTION', '0.1,0.1,1,1').split(',')
+)
+
+# Base de reglas compilada. Se reemplaza completa en cada compile(), así los hilos
+# que están evaluando siguen usando una versión coherente sin tomar locks
+CompiledRuleBase = namedtuple(
+    'CompiledRuleBase', ['control_system', 'simulation', 'evaluator', 'lookup_table', 'version']
+)
+# Formato del pickle de la base compilada: cambia cuando cambian los atributos de las
+# clases serializadas, para no cargar archivos escritos por una versión anterior del código
+COMPILED_FORMAT = 4
 
 class FuzzyService:
-    def __init__(self):
-        # Definir rangos universales
-        self.temp_range = np.arange(15, 40, 1)
-        self.humidity_range = np.arange(0, 100, 1)
-        self.soil_range = np.arange(0, 1023, 1)
-        self.light_range = np.arange(0, 1023, 1)
-
-        # Crear conjuntos difusos para temperatura
-        self.temperature = ctrl.Antecedent(self.temp_range, 'temperatura')
-        self.temperature['fría'] = fuzz.trimf(self.temperature.universe, [15, 15, 25])
-        self.temperature['óptima'] = fuzz.trimf(self.temperature.universe, [20, 25, 30])
-        self.temperature['caliente'] = fuzz.trimf(self.temperature.universe, [25, 35, 40])
-
-        # Crear conjuntos difusos para humedad ambiente
-        self.humidity = ctrl.Antecedent(self.humidity_range, 'humedad')
-        self.humidity['baja'] = fuzz.trimf(self.humidity.universe, [0, 0, 50])
-        self.humidity['óptima'] = fuzz.trimf(self.humidity.universe, [40, 60, 80])
-        self.humidity['alta'] = fuzz.trimf(self.humidity.universe, [70, 100, 100])
-
-        # Crear conjuntos difusos para humedad del suelo
-        self.soil = ctrl.Antecedent(self.soil_range, 'suelo')
-        self.soil['seco'] = fuzz.trimf(self.soil.universe, [0, 0, 500])
-        self.soil['húmedo'] = fuzz.trimf(self.soil.universe, [400, 600, 800])
-        self.soil['empapado'] = fuzz.trimf(self.soil.universe, [700, 1023, 1023])
-
-        # Crear conjuntos difusos para luz
-        self.light = ctrl.Antecedent(self.light_range, 'luz')
-        self.light['baja'] = fuzz.trimf(self.light.universe, [0, 0, 500])
-        self.light['óptima'] = fuzz.trimf(self.light.universe, [400, 600, 800])
-        self.light['alta'] = fuzz.trimf(self.light.universe, [700, 1023, 1023])
-
-        # Crear variables de salida
-        self.plant_state = ctrl.Consequent(np.arange(0, 100, 1), 'estado_planta')
-        self.plant_state['malo'] = fuzz.trimf(self.plant_state.universe, [0, 0, 40])
-        self.plant_state['regular'] = fuzz.trimf(self.plant_state.universe, [30, 50, 70])
-        self.plant_state['bueno'] = fuzz.trimf(self.plant_state.universe, [60, 100, 100])
-
-        self.pump_time = ctrl.Consequent(np.arange(0, 21, 1), 'tiempo_bomba')
-        self.pump_time['corto'] = fuzz.trimf(self.pump_time.universe, [3, 5, 7])
-        self.pump_time['medio'] = fuzz.trimf(self.pump_time.universe, [7, 10, 14])
-        self.pump_time['largo'] = fuzz.trimf(self.pump_time.universe, [13, 17, 20])
-
-        # Definir reglas mejoradas
-        self.rules = [
-            # Reglas para estado de la planta
-            ctrl.Rule(
-                (self.temperature['óptima'] & self.humidity['óptima'] & 
-                 self.soil['húmedo'] & self.light['óptima']),
-                self.plant_state['bueno']
-            ),
-            ctrl.Rule(
-                (self.temperature['óptima'] & self.humidity['óptima'] & 
-                 self.soil['húmedo']),
-                self.plant_state['bueno']
-            ),
-            ctrl.Rule(
-                (self.temperature['fría'] | self.temperature['caliente'] | 
-                 self.humidity['baja'] | self.humidity['alta'] | 
-                 self.soil['seco'] | self.soil['empapado'] | 
-                 self.light['baja'] | self.light['alta']),
-                self.plant_state['malo']
-            ),
-            ctrl.Rule(
-                (self.temperature['óptima'] | self.humidity['óptima'] | 
-                 self.soil['húmedo'] | self.light['óptima']),
-                self.plant_state['regular']
-            ),
-
-            # Reglas para tiempo de bomba
-            ctrl.Rule(
-                (self.soil['seco'] & self.humidity['baja']),
-                self.pump_time['largo']
-            ),
-            ctrl.Rule(
-                (self.soil['seco'] | self.humidity['baja']),
-                self.pump_time['medio']
-            ),
-            ctrl.Rule(
-                (self.soil['húmedo'] & self.humidity['óptima']),
-                self.pump_time['corto']
-            ),
-            ctrl.Rule(
-                (self.soil['empapado'] | self.humidity['alta']),
-                self.pump_time['corto']
-            )
-        ]
+    def __init__(self, engine=DEFAULT_ENGINE, lookup_table=None, cache_size=CACHE_SIZE,
+                 cache_resolution=CACHE_RESOLUTION, cache_dir=None, definition=None):
+        """
+        engine: 'skfuzzy' evalúa cada lectura con ControlSystemSimulation.compute();
+        'numpy' usa el evaluador vectorizado sin estado; 'lut' interpola la
+        defuzzificación sobre tablas precalculadas (se construyen al iniciar si no se
+        pasa `lookup_table`; si no cumplen la tolerancia se usa el evaluador vectorizado).
+        cache_size / cache_resolution: caché LRU de evaluate_conditions con las
+        entradas redondeadas a la resolución dada (el resultado es el del punto
+        redondeado, no el de la lectura exacta); cache_size=0, el valor por defecto, lo desactiva.
+        cache_dir: directorio para guardar/cargar la base compilada (ver compile()).
+        definition: base de reglas (ver fuzzy_rulebase); por defecto la de
+        FUZZY_RULEBASE_PATH o DEFAULT_DEFINITION. Se puede reemplazar en caliente con reload().
+
+        Los motores 'numpy' y 'lut' no tienen estado y admiten llamadas concurrentes
+        desde varios hilos. skfuzzy guarda estado intermedio en los propios términos
+        del sistema de control, por eso el motor 'skfuzzy' se serializa con un lock.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Motor desconocido: {engine}. Opciones: {', '.join(ENGINES)}")
+        self.engine = engine
+        self._sim_lock = threading.Lock()
+        self.cache = EvaluationCache(cache_size, cache_resolution) if cache_size else None
+
+        self.cache_dir = cache_dir
+        self._reload_lock = threading.Lock()
+        self._apply(build_rulebase(definition if definition is not None else load_definition()))
+
+        self.compile(lookup_table, cache_dir)
+
+    def compile(self, lookup_table=None, cache_dir=None):
+        """
+        (Re)construye el sistema de control, el evaluador vectorizado y la tabla del
+        motor 'lut' a partir de las funciones de pertenencia y reglas actuales.
+        Debe llamarse después de modificarlas; cambia la versión de la base de
+        reglas, lo que invalida el caché de evaluaciones.
+
+        cache_dir: directorio donde se guarda la base compilada (pickle) por motor y
+        versión; si ya existe se carga en lugar de reconstruirla. Solo debe apuntar
+        a un directorio de confianza.
+        """
+        self.compiled, self.loaded_from = self._compile(self.rules, lookup_table, cache_dir)
+
+    def reload(self, definition):
+        """
+        Valida y compila una nueva base de reglas y la activa de forma atómica: las
+        evaluaciones en curso terminan con la versión anterior y las siguientes usan
+        la nueva. Lanza ValueError si la definición no es válida. Retorna True si la
+        versión cambió
+        """
+        rulebase = build_rulebase(definition)
+        with self._reload_lock:
+            if fingerprint(rulebase.rules) == self.compiled.version:
+                return False
+            compiled, loaded_from = self._compile(rulebase.rules, None, self.cache_dir)
+            self._apply(rulebase)
+            self.compiled, self.loaded_from = compiled, loaded_from
+        return True
+
+    def _apply(self, rulebase):
+        self.definition = rulebase.definition
+        self.rules = rulebase.rules
+        # Variables con los nombres de siempre (los usa fuzzy_visualization)
+        self.temperature = rulebase.variables['temperatura']
+        self.humidity = rulebase.variables['humedad']
+        self.soil = rulebase.variables['suelo']
+        self.light = rulebase.variables['luz']
+        self.plant_state = rulebase.variables['estado_planta']
+        self.pump_time = rulebase.variables['tiempo_bomba']
+        self.temp_range = self.temperature.universe
+        self.humidity_range = self.humidity.universe
+        self.soil_range = self.soil.universe
+        self.light_range = self.light.universe
+
+    def _compile(self, rules, lookup_table, cache_dir):
+        # Retorna (CompiledRuleBase, ruta de la que se cargó o None)
+        version = fingerprint(rules)
+        path = None
+        if cache_dir and lookup_table is None:
+            path = os.path.join(cache_dir, f"fuzzy-{self.engine}-{version}-f{COMPILED_FORMAT}.pkl")
+            compiled = self._load_compiled(path, version)
+            if compiled is not None:
+                return compiled, path
 
         # Crear sistema de control
-        self.plant_ctrl = ctrl.ControlSystem(self.rules)
-        self.plant_sim = ctrl.ControlSystemSimulation(self.plant_ctrl)
+        control_system = ctrl.ControlSystem(rules)
+
+        # Evaluador vectorizado para lotes (y para el motor 'numpy')
+        evaluator = VectorizedEvaluator(control_system)
+
+        # Tabla precalculada para el motor 'lut'; si no cumple la tolerancia el motor
+        # evalúa con el evaluador vectorizado
+        if self.engine == 'lut' and lookup_table is None:
+            try:
+                lookup_table = LookupTableEngine.build(control_system, evaluator)
+            except ValueError as e:
+                logger.warning("Motor 'lut' sin tabla (%s); se usa el evaluador vectorizado", e)
+
+        compiled = CompiledRuleBase(
+            control_system=control_system,
+            simulation=ctrl.ControlSystemSimulation(control_system),
+            evaluator=evaluator,
+            lookup_table=lookup_table if self.engine == 'lut' else None,
+            version=version
+        )
+        if path is not None:
+            self._save_compiled(path, compiled)
+        return compiled, None
+
+    def _load_compiled(self, path, version):
+        try:
+            with open(path, 'rb') as f:
+                compiled = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Archivo dañado o de otra versión de skfuzzy/numpy: se reconstruye
+            logger.warning("No se pudo cargar la base compilada %s: %s", path, e)
+            return None
+        if not isinstance(compiled, CompiledRuleBase) or compiled.version != version:
+            return None
+        return compiled
+
+    def _save_compiled(self, path, compiled):
+        # Escritura atómica: varios workers pueden compilar a la vez al arrancar
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("No se pudo guardar la base compilada en %s: %s", path, e)
+
+    @property
+    def plant_ctrl(self):
+        return self.compiled.control_system
+
+    @property
+    def plant_sim(self):
+        return self.compiled.simulation
+
+    @property
+    def evaluator(self):
+        return self.compiled.evaluator
+
+    @property
+    def lookup_table(self):
+        return self.compiled.lookup_table
+
+    @property
+    def rulebase_version(self):
+        return self.compiled.version
 
     def evaluate_conditions(self, temperatura, humedad, suelo, luz):
         """
         Evalúa las condiciones actuales usando lógica difusa
         """
+        start = time.perf_counter()
+        compiled = self.compiled
+        cache = 'off'
         try:
+            if self.cache is not None:
+                key = self.cache.key(temperatura, humedad, suelo, luz)
+                outputs = self.cache.get(key, compiled.version)
+                cache = 'hit'
+                if outputs is None:
+                    # Evaluar el punto de la rejilla para que la clave determine el resultado
+                    cache = 'miss'
+                    outputs = self._compute(compiled, *self.cache.representative(key))
+                    self.cache.put(key, outputs, compiled.version)
+                estado, tiempo_bomba = outputs
+            else:
+                estado, tiempo_bomba = self._compute(compiled, temperatura, humedad, suelo, luz)
+
+            return self._format_result(temperatura, humedad, suelo, luz, estado, tiempo_bomba, compiled.version)
+        except Exception as e:
+            return self._format_error(temperatura, humedad, suelo, luz, str(e), compiled.version)
+        finally:
+            FUZZY_EVALUATIONS.observe(time.perf_counter() - start, engine=self.engine, cache=cache)
+
+    def cache_stats(self):
+        """
+        Retorna los contadores del caché de evaluaciones, o None si está desactivado
+        """
+        return self.cache.stats() if self.cache is not None else None
+
+    def _compute(self, compiled, temperatura, humedad, suelo, luz):
+        """
+        Retorna (estado, tiempo_bomba) con el motor configurado
+        """
+        if compiled.lookup_table is not None:
+            # Interpolar sobre la tabla precalculada
+            with FUZZY_STAGES.time(stage='lookup'):
+                return compiled.lookup_table.evaluate(temperatura, humedad, suelo, luz)
+
+        if self.engine != 'skfuzzy':
+            outputs = compiled.evaluator.evaluate(dict(zip(INPUT_LABELS, (temperatura, humedad, suelo, luz))))
+            estado = float(outputs['estado_planta'][0])
+            tiempo_bomba = float(outputs['tiempo_bomba'][0])
+            if np.isnan(estado) or np.isnan(tiempo_bomba):
+                raise ValueError("Sin reglas activas para las condiciones dadas")
+            return estado, tiempo_bomba
+
+        with self._sim_lock:
+            sim = compiled.simulation
+
             # Establecer valores de entrada
-            self.plant_sim.input['temperatura'] = float(temperatura)
-            self.plant_sim.input['humedad'] = float(humedad)
-            self.plant_sim.input['suelo'] = float(suelo)
-            self.plant_sim.input['luz'] = float(luz)
+            sim.input['temperatura'] = float(temperatura)
+            sim.input['humedad'] = float(humedad)
+            sim.input['suelo'] = float(suelo)
+            sim.input['luz'] = float(luz)
 
-            # Calcular resultado
-            self.plant_sim.compute()
+            # Calcular resultado (skfuzzy no expone sus etapas por separado)
+            with FUZZY_STAGES.time(stage='skfuzzy_compute'):
+                sim.compute()
 
             # Obtener estado y tiempo de bomba
-            estado = float(self.plant_sim.output['estado_planta'])
-            tiempo_bomba = float(self.plant_sim.output['tiempo_bomba'])
-
-            # Determinar si se debe activar la bomba
-            should_activate = tiempo_bomba > 2  # Solo activar si el tiempo es mayor a 2 segundos
-
-            return {
-                "estado": round(estado, 2),
-                "activar_bomba": should_activate,
-                "tiempo_bomba": round(tiempo_bomba, 2),
-                "condiciones": {
-                    "temperatura": float(temperatura),
-                    "humedad": float(humedad),
-                    "suelo": float(suelo),
-                    "luz": float(luz)
-                }
+            return float(sim.output['estado_planta']), float(sim.output['tiempo_bomba'])
+
+    def evaluate_batch(self, readings):
+        """
+        Evalúa N lecturas a la vez como operaciones sobre arreglos.
+
+        readings: arreglo (N, 4) con columnas temperatura, humedad, suelo, luz.
+        Retorna un dict de arreglos: estado, tiempo_bomba, activar_bomba y
+        error (True en las filas sin reglas activas, que quedan en 0), más la
+        versión de la base de reglas usada.
+        """
+        start = time.perf_counter()
+        readings = np.asarray(readings, dtype=np.float64).reshape(-1, len(INPUT_LABELS))
+        compiled = self.compiled
+
+        if compiled.lookup_table is not None:
+            outputs = compiled.lookup_table.evaluate_many(readings)
+            estado, tiempo_bomba = outputs[:, 0], outputs[:, 1]
+        else:
+            outputs = compiled.evaluator.evaluate(dict(zip(INPUT_LABELS, readings.T)))
+            estado, tiempo_bomba = outputs['estado_planta'], outputs['tiempo_bomba']
+
+        error = np.isnan(estado) | np.isnan(tiempo_bomba)
+        estado = np.where(error, 0.0, estado)
+        tiempo_bomba = np.where(error, 0.0, tiempo_bomba)
+
+        FUZZY_BATCHES.observe(time.perf_counter() - start, engine=self.engine)
+        FUZZY_BATCH_ROWS.inc(len(readings), engine=self.engine)
+        return {
+            "estado": estado,
+            "tiempo_bomba": tiempo_bomba,
+            "activar_bomba": tiempo_bomba > 2,
+            "error": error,
+            "version": compiled.version
+        }
+
+    def evaluate_batch_conditions(self, readings):
+        """
+        Igual que evaluate_batch pero retorna una lista de resultados con el mismo
+        formato que evaluate_conditions
+        """
+        readings = np.asarray(readings, dtype=np.float64).reshape(-1, len(INPUT_LABELS))
+        batch = self.evaluate_batch(readings)
+
+        results = []
+        for row, estado, tiempo_bomba, error in zip(readings.tolist(), batch['estado'].tolist(),
+                                                    batch['tiempo_bomba'].tolist(), batch['error'].tolist()):
+            if error:
+                results.append(self._format_error(*row, "Sin reglas activas para las condiciones dadas", batch['version']))
+            else:
+                results.append(self._format_result(*row, estado, tiempo_bomba, batch['version']))
+        return results
+
+    def _format_result(self, temperatura, humedad, suelo, luz, estado, tiempo_bomba, version):
+        # Determinar si se debe activar la bomba
+        should_activate = tiempo_bomba > 2  # Solo activar si el tiempo es mayor a 2 segundos
+
+        return {
+            "estado": round(estado, 2),
+            "activar_bomba": should_activate,
+            "tiempo_bomba": round(tiempo_bomba, 2),
+            "version_reglas": version,
+            "condiciones": {
+                "temperatura": float(temperatura),
+                "humedad": float(humedad),
+                "suelo": float(suelo),
+                "luz": float(luz)
             }
-        except Exception as e:
-            return {
-                "error": str(e),
-                "estado": 0,
-                "activar_bomba": False,
-                "tiempo_bomba": 0,
-                "condiciones": {
-                    "temperatura": float(temperatura),
-                    "humedad": float(humedad),
-                    "suelo": float(suelo),
-                    "luz": float(luz)
-                }
-            } 
\ No newline at end of file
+        }
+
+    def _format_error(self, temperatura, humedad, suelo, luz, message, version):
+        return {
+            "error": message,
+            "estado": 0,
+            "activar_bomba": False,
+            "tiempo_bomba": 0,
+            "version_reglas": version,
+            "condiciones": {
+                "temperatura": float(temperatura),
+                "humedad": float(humedad),
+                "suelo": float(suelo),
+                "luz": float(luz)
+            }
+        }
@@ -0,0 +1,163 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from .fuzzy_cache import DEFAULT_RESOLUTION as FIXED_RESOLUTION
+from .fuzzy_lut import INPUT_LABELS, OUTPUT_LABELS
+
+logger = logging.getLogger(__name__)
+
+# Valores de las entradas que no forman parte de la superficie
+DEFAULT_FIXED = {'temperatura': 25.0, 'humedad': 60.0, 'suelo': 600.0, 'luz': 600.0}
+# Puntos por eje cuando no se indican valores explícitos
+DEFAULT_RESOLUTION = 50
+# A partir de cuántos puntos se reparte la evaluación en un pool de procesos
+PARALLEL_MIN_POINTS = 200000
+# Directorio del caché de superficies ('' lo desactiva)
+CACHE_DIR = os.environ.get('FUZZY_SURFACE_DIR', 'surface_cache')
+# Máximo de superficies en el caché; al superarlo se borran las usadas hace más tiempo
+CACHE_MAX_FILES = int(os.environ.get('FUZZY_SURFACE_MAX_FILES', 64))
+
+# Superficie evaluada: ejes x (M,) e y (N,), salidas {etiqueta: (N, M)} con NaN donde
+# no hay reglas activas, entradas fijas y versión de la base de reglas
+Surface = namedtuple('Surface', ['x_label', 'y_label', 'x', 'y', 'outputs', 'fixed', 'version'])
+
+
+def _axis(universe, values, resolution):
+    if values is not None:
+        return np.asarray(values, dtype=np.float64)
+    return np.linspace(universe[0], universe[-1], int(resolution))
+
+
+def _evaluate_columns(evaluator, columns):
+    return evaluator.evaluate(columns)
+
+
+def _quantize(label, value):
+    # Entradas fijas redondeadas a la resolución del caché de evaluaciones, para que
+    # valores casi iguales compartan superficie (y archivo de caché)
+    step = FIXED_RESOLUTION[INPUT_LABELS.index(label)]
+    return round(round(float(value) / step) * step, 10)
+
+
+def _prune_cache(cache_dir, version, max_files=CACHE_MAX_FILES):
+    """
+    Borra las superficies de otras versiones de la base de reglas y, si quedan más de
+    `max_files`, las de uso más antiguo (la fecha de modificación se renueva en cada acierto)
+    """
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, 'surface-*.npz')):
+        if path.endswith('.tmp.npz'):
+            # Escritura en curso de otro proceso
+            continue
+        try:
+            if not os.path.basename(path).startswith(f"surface-{version}-"):
+                os.remove(path)
+                continue
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            # Otro worker lo borró o lo está reemplazando
+            continue
+    entries.sort(reverse=True)
+    for _, path in entries[max_files:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _cache_path(cache_dir, version, x_label, y_label, x, y, fixed):
+    digest = hashlib.sha1()
+    digest.update(json.dumps([x_label, y_label, sorted(fixed.items())]).encode())
+    digest.update(x.tobytes())
+    digest.update(y.tobytes())
+    return os.path.join(cache_dir, f"surface-{version}-{digest.hexdigest()[:12]}.npz")
+
+
+def compute_surface(fuzzy_service, x_label='temperatura', y_label='humedad', x_values=None,
+                    y_values=None, resolution=DEFAULT_RESOLUTION, fixed=None, processes=None,
+                    cache_dir=CACHE_DIR):
+    """
+    Evalúa ambas salidas sobre la rejilla x_label × y_label con el evaluador vectorizado.
+
+    x_values / y_values: valores explícitos de cada eje; por defecto `resolution`
+    puntos uniformes sobre el universo de la variable.
+    fixed: valores de las otras dos entradas (por defecto DEFAULT_FIXED).
+    processes: procesos del pool para rejillas de al menos PARALLEL_MIN_POINTS
+    puntos (None = os.cpu_count(), 1 = sin pool).
+    cache_dir: las rejillas se guardan como .npz por versión de la base de reglas
+    y parámetros, y se reutilizan mientras la versión no cambie. Se conservan como
+    mucho CACHE_MAX_FILES, solo de la versión actual.
+    """
+    if x_label not in INPUT_LABELS or y_label not in INPUT_LABELS or x_label == y_label:
+        raise ValueError(f"Se esperan dos variables distintas entre: {', '.join(INPUT_LABELS)}")
+    compiled = fuzzy_service.compiled
+    evaluator = compiled.evaluator
+
+    x = _axis(evaluator.inputs[x_label][0], x_values, resolution)
+    y = _axis(evaluator.inputs[y_label][0], y_values, resolution)
+    fixed = {label: _quantize(label, value) for label, value in dict(DEFAULT_FIXED, **(fixed or {})).items()
+             if label not in (x_label, y_label)}
+
+    path = _cache_path(cache_dir, compiled.version, x_label, y_label, x, y, fixed) if cache_dir else None
+    if path and os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                outputs = {label: data[label] for label in OUTPUT_LABELS}
+            os.utime(path)
+            return Surface(x_label, y_label, x, y, outputs, fixed, compiled.version)
+        except (OSError, ValueError, KeyError):
+            # Borrado por _prune_cache de otro worker, o incompleto: se recalcula
+            pass
+
+    x_mesh, y_mesh = np.meshgrid(x, y)
+    columns = {x_label: x_mesh.ravel(), y_label: y_mesh.ravel()}
+    for label, value in fixed.items():
+        columns[label] = np.full(x_mesh.size, value)
+
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and x_mesh.size >= PARALLEL_MIN_POINTS:
+        # Bloques contiguos por proceso; el evaluador no tiene estado y se serializa con cada bloque
+        bounds = np.linspace(0, x_mesh.size, processes + 1).astype(int)
+        chunks = [{label: values[start:stop] for label, values in columns.items()}
+                  for start, stop in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(processes) as pool:
+            parts = list(pool.map(partial(_evaluate_columns, evaluator), chunks))
+        results = {label: np.concatenate([part[label] for part in parts]) for label in OUTPUT_LABELS}
+    else:
+        results = evaluator.evaluate(columns)
+    outputs = {label: results[label].reshape(x_mesh.shape) for label in OUTPUT_LABELS}
+
+    if path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, **outputs)
+            os.replace(tmp_path, path)
+            _prune_cache(cache_dir, compiled.version)
+        except OSError as e:
+            logger.warning("No se pudo guardar la superficie en %s: %s", cache_dir, e)
+    return Surface(x_label, y_label, x, y, outputs, fixed, compiled.version)
+
+
+def surface_to_dict(surface, output=None):
+    """
+    Convierte una superficie a un documento JSON (NaN -> null)
+    """
+    labels = [output] if output else list(OUTPUT_LABELS)
+
+    def rows(values):
+        return [[None if np.isnan(v) else v for v in row] for row in values.tolist()]
+
+    return {
+        "x": {"variable": surface.x_label, "valores": surface.x.tolist()},
+        "y": {"variable": surface.y_label, "valores": surface.y.tolist()},
+        "fijas": surface.fixed,
+        "version": surface.version,
+        "salidas": {label: rows(surface.outputs[label]) for label in labels}
+    }
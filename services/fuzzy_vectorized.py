@@ -0,0 +1,225 @@
+import time
+import numpy as np
+from skfuzzy.control.term import Term, TermAggregate
+from .metrics import FUZZY_STAGES
+
+# Filas por bloque al evaluar lotes grandes (acota la memoria de la defuzzificación)
+DEFAULT_CHUNK_SIZE = 2048
+
+
+def _compile_antecedent(node):
+    """
+    Convierte el árbol de antecedentes de un ctrl.Rule en tuplas anidadas
+    ('term', variable, conjunto) / ('and' | 'or', a, b) / ('not', a)
+    """
+    if isinstance(node, Term):
+        return ('term', node.parent.label, node.label)
+    if isinstance(node, TermAggregate):
+        if node.kind == 'not':
+            return ('not', _compile_antecedent(node.term1))
+        return (node.kind, _compile_antecedent(node.term1), _compile_antecedent(node.term2))
+    raise ValueError(f"Antecedente no soportado: {node!r}")
+
+
+class VectorizedEvaluator:
+    """
+    Evaluador Mamdani en NumPy puro compilado a partir de un ctrl.ControlSystem.
+
+    Reproduce la inferencia de skfuzzy (fuzzificación con interpolación lineal,
+    min/max de las reglas, recorte y acumulación por máximo, centroide sobre el
+    universo de salida ampliado con los puntos de corte) como operaciones sobre
+    arreglos de N lecturas a la vez. No guarda estado entre llamadas.
+    """
+
+    def __init__(self, control_system):
+        self.inputs = {}
+        for antecedent in control_system.antecedents:
+            self.inputs[antecedent.label] = (
+                np.asarray(antecedent.universe, dtype=np.float64),
+                {label: np.asarray(term.mf, dtype=np.float64) for label, term in antecedent.terms.items()}
+            )
+
+        self.outputs = {}
+        for consequent in control_system.consequents:
+            if consequent.defuzzify_method != 'centroid':
+                raise ValueError(f"Método de defuzzificación no soportado: {consequent.defuzzify_method}")
+            self.outputs[consequent.label] = (
+                np.asarray(consequent.universe, dtype=np.float64),
+                {label: np.asarray(term.mf, dtype=np.float64) for label, term in consequent.terms.items()},
+                consequent.accumulation_method
+            )
+
+        # Rejilla de cada salida, calculada una vez: universo, ancho de cada tramo, pesos
+        # de área y momento de la regla del trapecio sobre el universo y, por conjunto,
+        # su función de pertenencia y su pendiente en cada tramo
+        self.segments = {}
+        for label, (universe, terms, _) in self.outputs.items():
+            width = np.diff(universe)
+            weights = np.zeros((len(universe), 2))
+            weights[:-1, 0] += 0.5 * width
+            weights[1:, 0] += 0.5 * width
+            weights[:-1, 1] += width * (2.0 * universe[:-1] + universe[1:]) / 6.0
+            weights[1:, 1] += width * (universe[:-1] + 2.0 * universe[1:]) / 6.0
+            self.segments[label] = (
+                universe,
+                width,
+                weights,
+                {term: (mf, np.diff(mf) / width) for term, mf in terms.items()}
+            )
+
+        self.rules = []
+        for rule in control_system.rules:
+            self.rules.append((
+                _compile_antecedent(rule.antecedent),
+                rule.and_func,
+                rule.or_func,
+                [(c.term.parent.label, c.term.label, c.weight) for c in rule.consequent]
+            ))
+
+    def evaluate(self, inputs, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Evalúa un lote de lecturas.
+
+        inputs: dict {etiqueta de entrada: arreglo de N valores}
+        Retorna dict {etiqueta de salida: arreglo de N valores}; las filas cuya
+        salida queda sin área (sin reglas activas) se marcan con NaN.
+        """
+        columns = {label: np.atleast_1d(np.asarray(inputs[label], dtype=np.float64)) for label in self.inputs}
+        size = len(next(iter(columns.values())))
+        results = {label: np.empty(size, dtype=np.float64) for label in self.outputs}
+
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            chunk = {label: values[start:stop] for label, values in columns.items()}
+            for label, values in self._evaluate_chunk(chunk).items():
+                results[label][start:stop] = values
+        return results
+
+    def _evaluate_chunk(self, columns):
+        start = time.perf_counter()
+        memberships = self.memberships(columns)
+        fuzzified = time.perf_counter()
+        FUZZY_STAGES.observe(fuzzified - start, stage='fuzzification')
+
+        cuts = self.cut_levels(memberships)
+        fired = time.perf_counter()
+        FUZZY_STAGES.observe(fired - fuzzified, stage='rules')
+
+        size = len(next(iter(columns.values())))
+        results = {label: self.defuzzify(label, cuts, size) for label in self.segments}
+        FUZZY_STAGES.observe(time.perf_counter() - fired, stage='defuzzification')
+        return results
+
+    def memberships(self, columns):
+        """
+        Fuzzificación: {(entrada, conjunto): pertenencia de cada lectura}. Las entradas
+        fuera del universo se recortan, como en skfuzzy
+        """
+        memberships = {}
+        for label, (universe, terms) in self.inputs.items():
+            values = np.clip(columns[label], universe[0], universe[-1])
+            for term, mf in terms.items():
+                memberships[(label, term)] = np.interp(values, universe, mf)
+        return memberships
+
+    def cut_levels(self, memberships):
+        """
+        Disparo de reglas y acumulación: {(salida, conjunto): nivel de corte de cada
+        lectura}, solo para los conjuntos que aparecen en algún consecuente
+        """
+        cuts = {}
+        for antecedent, and_func, or_func, consequents in self.rules:
+            firing = self._fire(antecedent, memberships, and_func, or_func)
+            for variable, term, weight in consequents:
+                activation = firing * weight
+                key = (variable, term)
+                if key in cuts:
+                    cuts[key] = self.outputs[variable][2](activation, cuts[key])
+                else:
+                    cuts[key] = activation
+        return cuts
+
+    def defuzzify(self, label, cuts, size):
+        """
+        Centroide de la salida `label` para `size` lecturas con los niveles de corte
+        `cuts` (ver cut_levels); NaN en las filas sin membresía
+        """
+        universe, width, weights, terms = self.segments[label]
+        labels = [term for term in terms if (label, term) in cuts]
+        if not labels:
+            return np.full(size, np.nan)
+        mfs = np.stack([terms[term][0] for term in labels])
+        slopes = np.stack([terms[term][1] for term in labels])
+        level = np.stack([cuts[(label, term)] for term in labels], axis=1)
+        return _centroid(universe, width, weights, mfs, slopes, level)
+
+    def _fire(self, node, memberships, and_func, or_func):
+        kind = node[0]
+        if kind == 'term':
+            return memberships[(node[1], node[2])]
+        if kind == 'not':
+            return 1.0 - self._fire(node[1], memberships, and_func, or_func)
+        first = self._fire(node[1], memberships, and_func, or_func)
+        second = self._fire(node[2], memberships, and_func, or_func)
+        return and_func(first, second) if kind == 'and' else or_func(first, second)
+
+
+def _trapezoids(x1, x2, y1, y2):
+    # Área y momento de cada trapecio (exactos para y lineal entre x1 y x2)
+    width = x2 - x1
+    area = 0.5 * width * (y1 + y2)
+    moment = width * (x1 * (2.0 * y1 + y2) + x2 * (y1 + 2.0 * y2)) / 6.0
+    return area, moment
+
+
+def _centroid(universe, width, weights, mfs, slopes, cuts):
+    """
+    Centroide de los conjuntos de salida recortados, para N lecturas a la vez.
+
+    universe: (M,), width: (M-1,) ancho de cada tramo, weights: (M, 2) pesos de área
+    y momento de la regla del trapecio sobre el universo, mfs: (T, M), slopes: (T, M-1)
+    pendiente de cada conjunto en cada tramo, cuts: (N, T). Igual que skfuzzy, el
+    universo se amplía con los puntos donde cada conjunto cruza su nivel de corte y
+    el área se integra exactamente suponiendo linealidad entre puntos consecutivos.
+
+    Cada conjunto cruza su nivel en pocos tramos (a lo sumo dos en un trimf), así
+    que se integra primero sobre la rejilla del universo (un producto con `weights`)
+    y solo los tramos (lectura, tramo) con algún cruce se vuelven a integrar con sus
+    puntos de corte.
+    """
+    aggregated = np.zeros((cuts.shape[0], len(universe)))
+    for t in range(mfs.shape[0]):
+        np.maximum(aggregated, np.minimum(cuts[:, t, None], mfs[t]), out=aggregated)
+    area, moment = (aggregated @ weights).T
+
+    low, high = mfs[:, :-1], mfs[:, 1:]
+    level = cuts[:, :, None]
+    crossing = (low - level) * (high - level) < 0
+    row, segment = np.nonzero(crossing.any(axis=1))
+    if len(row):
+        # Puntos de cada tramo con cruces, desde su inicio: 0, el cruce de cada
+        # conjunto (0 si no cruza: punto repetido de ancho cero) y el ancho del tramo
+        cut = cuts[row]
+        start = mfs[:, segment].T
+        slope = slopes[:, segment].T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset = np.where(crossing[row, :, segment], (cut - start) / slope, 0.0)
+        offset.sort(axis=1)
+        points = np.concatenate([np.zeros((len(row), 1)), offset, width[segment, None]], axis=1)
+
+        values = np.zeros_like(points)
+        for t in range(mfs.shape[0]):
+            np.maximum(values, np.minimum(cut[:, t, None], start[:, t, None] + points * slope[:, t, None]),
+                       out=values)
+        x = points + universe[segment, None]
+        refined_area, refined_moment = _trapezoids(x[:, :-1], x[:, 1:], values[:, :-1], values[:, 1:])
+        # Reemplazar el trapecio del tramo sobre la rejilla por el refinado
+        plain_area, plain_moment = _trapezoids(universe[segment], universe[segment + 1],
+                                               aggregated[row, segment], aggregated[row, segment + 1])
+        np.add.at(area, row, refined_area.sum(axis=1) - plain_area)
+        np.add.at(moment, row, refined_moment.sum(axis=1) - plain_moment)
+
+    centroid = moment / np.fmax(area, np.finfo(float).eps)
+    # skfuzzy no puede defuzzificar una salida sin membresía
+    centroid[~aggregated.any(axis=1)] = np.nan
+    return centroid
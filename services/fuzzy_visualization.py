@@ -1,6 +1,12 @@
+import io
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from fuzzy_service import FuzzyService
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from services.fuzzy_service import FuzzyService
+from services.fuzzy_surface import compute_surface
 
 def plot_fuzzy_sets():
     """
@@ -76,7 +82,7 @@ def plot_output_sets():
     ax1.grid(True)
     
     # Tiempo de Bomba
-    pump_range = np.arange(0, 60, 1)
+    pump_range = fuzzy_service.pump_time.universe
     ax2.plot(pump_range, fuzzy_service.pump_time['corto'].mf, 'g', label='Corto')
     ax2.plot(pump_range, fuzzy_service.pump_time['medio'].mf, 'y', label='Medio')
     ax2.plot(pump_range, fuzzy_service.pump_time['largo'].mf, 'r', label='Largo')
@@ -90,58 +96,59 @@ def plot_output_sets():
     plt.savefig('fuzzy_outputs.png')
     plt.close()
 
-def plot_surface_3d():
+# Superficies que genera plot_surface_3d: (eje x, eje y, salida, puntos por eje)
+DEFAULT_SURFACES = (
+    ('temperatura', 'humedad', 'estado_planta', 50),
+    ('suelo', 'humedad', 'tiempo_bomba', 50),
+)
+
+LABELS = {
+    'temperatura': 'Temperatura (°C)',
+    'humedad': 'Humedad (%)',
+    'suelo': 'Suelo',
+    'luz': 'Luz',
+    'estado_planta': 'Estado',
+    'tiempo_bomba': 'Tiempo (s)',
+}
+
+def draw_surface(ax, surface, output):
     """
-    Visualiza superficies 3D para algunas combinaciones importantes de variables
+    Dibuja una superficie de compute_surface() en un eje 3D
     """
-    fuzzy_service = FuzzyService()
+    x_mesh, y_mesh = np.meshgrid(surface.x, surface.y)
+    ax.plot_surface(x_mesh, y_mesh, surface.outputs[output], cmap='viridis')
+    ax.set_title(f"{LABELS[surface.x_label]} vs {LABELS[surface.y_label]} -> {LABELS[output]}")
+    ax.set_xlabel(LABELS[surface.x_label])
+    ax.set_ylabel(LABELS[surface.y_label])
+    ax.set_zlabel(LABELS[output])
+
+def render_surface_png(surface, output):
+    """
+    Retorna los bytes PNG de una superficie. Usa Figure directamente (sin pyplot)
+    para poder llamarse desde varios hilos del servidor
+    """
+    fig = Figure(figsize=(8, 6))
+    draw_surface(fig.add_subplot(111, projection='3d'), surface, output)
+    buffer = io.BytesIO()
+    FigureCanvasAgg(fig).print_png(buffer)
+    return buffer.getvalue()
+
+def plot_surface_3d(surfaces=DEFAULT_SURFACES, processes=None):
+    """
+    Visualiza superficies 3D para pares de variables de entrada. Las rejillas se
+    evalúan en bloque con el evaluador vectorizado y se guardan en caché por
+    versión de la base de reglas
+    """
+    fuzzy_service = FuzzyService(cache_size=0)
     
     # Crear figura con subplots
-    fig = plt.figure(figsize=(15, 10))
-    
-    # Superficie 3D: Temperatura vs Humedad -> Estado de la Planta
-    ax1 = fig.add_subplot(221, projection='3d')
-    temp_range = np.arange(15, 40, 1)
-    hum_range = np.arange(0, 100, 1)
-    temp_mesh, hum_mesh = np.meshgrid(temp_range, hum_range)
-    state_mesh = np.zeros_like(temp_mesh)
-    
-    for i in range(len(temp_range)):
-        for j in range(len(hum_range)):
-            fuzzy_service.plant_sim.input['temperatura'] = temp_range[i]
-            fuzzy_service.plant_sim.input['humedad'] = hum_range[j]
-            fuzzy_service.plant_sim.input['suelo'] = 600  # valor medio
-            fuzzy_service.plant_sim.input['luz'] = 600    # valor medio
-            fuzzy_service.plant_sim.compute()
-            state_mesh[j, i] = fuzzy_service.plant_sim.output['estado_planta']
-    
-    ax1.plot_surface(temp_mesh, hum_mesh, state_mesh, cmap='viridis')
-    ax1.set_title('Temperatura vs Humedad -> Estado')
-    ax1.set_xlabel('Temperatura (°C)')
-    ax1.set_ylabel('Humedad (%)')
-    ax1.set_zlabel('Estado')
-    
-    # Superficie 3D: Suelo vs Humedad -> Tiempo de Bomba
-    ax2 = fig.add_subplot(222, projection='3d')
-    soil_range = np.arange(0, 1023, 50)
-    hum_range = np.arange(0, 100, 5)
-    soil_mesh, hum_mesh = np.meshgrid(soil_range, hum_range)
-    pump_mesh = np.zeros_like(soil_mesh)
-    
-    for i in range(len(soil_range)):
-        for j in range(len(hum_range)):
-            fuzzy_service.plant_sim.input['temperatura'] = 25  # valor medio
-            fuzzy_service.plant_sim.input['humedad'] = hum_range[j]
-            fuzzy_service.plant_sim.input['suelo'] = soil_range[i]
-            fuzzy_service.plant_sim.input['luz'] = 600    # valor medio
-            fuzzy_service.plant_sim.compute()
-            pump_mesh[j, i] = fuzzy_service.plant_sim.output['tiempo_bomba']
+    columns = min(len(surfaces), 2)
+    rows = (len(surfaces) + columns - 1) // columns
+    fig = plt.figure(figsize=(7.5 * columns, 5 * rows))
     
-    ax2.plot_surface(soil_mesh, hum_mesh, pump_mesh, cmap='viridis')
-    ax2.set_title('Suelo vs Humedad -> Tiempo Bomba')
-    ax2.set_xlabel('Suelo')
-    ax2.set_ylabel('Humedad (%)')
-    ax2.set_zlabel('Tiempo (s)')
+    for index, (x_label, y_label, output, resolution) in enumerate(surfaces, start=1):
+        surface = compute_surface(fuzzy_service, x_label, y_label, resolution=resolution, processes=processes)
+        draw_surface(fig.add_subplot(rows, columns, index, projection='3d'), surface, output)
     
     plt.tight_layout()
     plt.savefig('fuzzy_surfaces.png')
@@ -0,0 +1,184 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Fracción de los eventos por lectura que se registran (1 = todos, 0 = ninguno)
+LOG_SAMPLE_RATE = float(os.environ.get('SENSOR_LOG_SAMPLE_RATE', 0.01))
+# Caracteres máximos de un payload en los logs
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get('SENSOR_LOG_PAYLOAD_MAX_CHARS', 512))
+# 'json' (una línea JSON por evento) o 'text'
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Registros en espera del hilo de escritura; si se llena se descartan en vez de bloquear
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+
+class Payload:
+    """
+    Valor para los logs que se serializa y recorta a `limit` caracteres solo cuando
+    el registro se escribe (en el hilo de logging, no en el de la petición)
+    """
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = LOG_PAYLOAD_MAX_CHARS if limit is None else limit
+
+    def _text(self):
+        if isinstance(self.value, str):
+            return self.value
+        return json.dumps(self.value, default=str, ensure_ascii=False)
+
+    def __str__(self):
+        text = self._text()
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...(+{len(text) - self.limit})"
+        return text
+
+    __repr__ = __str__
+
+    def field(self):
+        """
+        Valor para un registro JSON: el original si cabe en el límite, si no el texto recortado
+        """
+        return self.value if len(self._text()) <= self.limit else str(self)
+
+
+class Sampler:
+    """
+    Muestreo determinista: deja pasar uno de cada round(1 / rate) eventos
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        self.rate = float(rate)
+        self._every = max(int(round(1 / self.rate)), 1) if self.rate > 0 else 0
+        self._counter = itertools.count()
+
+    def __call__(self):
+        if not self._every:
+            return False
+        return next(self._counter) % self._every == 0
+
+
+def log_event(logger, level, message, **fields):
+    """
+    Registra `message` con campos estructurados, sin construir nada si el nivel
+    está deshabilitado
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'fields': fields})
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formatea los registros como una línea JSON (LOG_FORMAT=json) o como texto con
+    los campos estructurados en forma clave=valor
+    """
+
+    def __init__(self, fmt=LOG_FORMAT):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        if self.fmt == 'json':
+            fields = {key: value.field() if isinstance(value, Payload) else value
+                      for key, value in fields.items()}
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+
+        text = (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))} "
+                f"{record.levelname} {record.name}: {record.getMessage()}")
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola los registros sin formatearlos; un hilo por proceso los escribe con los
+    handlers de destino. Si la cola se llena el registro se descarta y se cuenta,
+    para que el logging nunca bloquee una petición. El hilo se (re)inicia en el primer
+    registro de cada proceso, así sobrevive al fork de los workers de gunicorn.
+    """
+
+    def __init__(self, handlers, max_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(max_size))
+        self.targets = handlers
+        self.max_size = max_size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        # El formateo (y el recorte de los Payload) ocurre en el hilo del listener
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Proceso hijo: la cola y el hilo heredados no sirven
+                self.queue = queue.Queue(self.max_size)
+            self._listener = logging.handlers.QueueListener(self.queue, *self.targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Escribe los registros pendientes y detiene el hilo
+        """
+        if self._listener is not None and self._pid == os.getpid():
+            try:
+                self._listener.stop()
+            except queue.Full:
+                pass
+            self._listener = None
+            self._pid = None
+
+
+_configured = None
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Instala en el logger raíz un AsyncQueueHandler que escribe en stderr con
+    StructuredFormatter. Es idempotente; retorna el handler instalado
+    """
+    global _configured
+    if _configured is None:
+        target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(StructuredFormatter())
+        _configured = AsyncQueueHandler([target])
+        root = logging.getLogger()
+        root.addHandler(_configured)
+        root.setLevel(level)
+    return _configured
@@ -0,0 +1,105 @@
+import base64
+import gzip
+import hashlib
+import json
+import threading
+from collections import namedtuple
+import numpy as np
+from .fuzzy_lut import INPUT_LABELS, OUTPUT_LABELS
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+# Formatos de GET /membership-functions:
+# 'full': universos y funciones de pertenencia completos (listas de floats)
+# 'vertices': solo los vértices (x, y) de cada conjunto; la curva se reconstruye
+#             interpolando linealmente, sin pérdida para funciones lineales por tramos.
+#             'range' trae solo los extremos [inicio, fin] del universo
+# 'float32': los mismos arreglos de 'full' en float32 little-endian codificados en base64
+FORMATS = ('full', 'vertices', 'float32')
+# Codificaciones precomprimidas, en orden de preferencia
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Cuerpo serializado una vez por versión y formato: etag sin codificar y bytes por
+# codificación ('identity', 'gzip', 'br')
+Payload = namedtuple('Payload', ['etag', 'bodies'])
+
+
+def _vertices(universe, mf):
+    # Puntos donde la función cambia de pendiente, más los extremos del universo
+    kinks = np.nonzero(np.abs(np.diff(mf, 2)) > 1e-12)[0] + 1
+    indices = np.concatenate([[0], kinks, [len(universe) - 1]])
+    return [[float(universe[i]), float(mf[i])] for i in indices]
+
+
+def _float32(values):
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def build_payload(control_system, fmt='full'):
+    """
+    Construye el documento de funciones de pertenencia de un sistema de control
+    """
+    variables = {variable.label: variable
+                 for variable in list(control_system.antecedents) + list(control_system.consequents)}
+    document = {}
+    for label in INPUT_LABELS + OUTPUT_LABELS:
+        variable = variables[label]
+        universe = np.asarray(variable.universe, dtype=np.float64)
+        terms = {name: np.asarray(term.mf, dtype=np.float64) for name, term in variable.terms.items()}
+        if fmt == 'vertices':
+            document[label] = {
+                'range': [float(universe[0]), float(universe[-1])],
+                'sets': {name: _vertices(universe, mf) for name, mf in terms.items()}
+            }
+        elif fmt == 'float32':
+            document[label] = {
+                'range': _float32(universe),
+                'sets': {name: _float32(mf) for name, mf in terms.items()}
+            }
+        else:
+            document[label] = {
+                'range': universe.tolist(),
+                'sets': {name: mf.tolist() for name, mf in terms.items()}
+            }
+    if fmt == 'float32':
+        document['encoding'] = 'float32-le-base64'
+    return document
+
+
+class MembershipPayloads:
+    """
+    Respuestas de GET /membership-functions serializadas y comprimidas una sola vez
+    por versión de la base de reglas y formato
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._payloads = {}
+
+    def get(self, compiled, fmt='full'):
+        """
+        Retorna el Payload de `fmt` para una base de reglas compilada (CompiledRuleBase)
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato desconocido: {fmt}. Opciones: {', '.join(FORMATS)}")
+        with self._lock:
+            if compiled.version != self._version:
+                self._version = compiled.version
+                self._payloads = {}
+            payload = self._payloads.get(fmt)
+            if payload is None:
+                payload = self._payloads[fmt] = self._serialize(compiled, fmt)
+            return payload
+
+    def _serialize(self, compiled, fmt):
+        body = json.dumps(build_payload(compiled.control_system, fmt),
+                          separators=(',', ':'), sort_keys=True).encode('utf-8')
+        bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            bodies['br'] = brotli.compress(body, quality=11)
+        etag = f"{compiled.version}-{fmt}-{hashlib.sha1(body).hexdigest()[:12]}"
+        return Payload(etag=etag, bodies=bodies)
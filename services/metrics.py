@@ -0,0 +1,183 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Buckets (segundos) para peticiones HTTP y para etapas internas del motor difuso
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STAGE_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Contador monótono por combinación de etiquetas
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Histograma acumulado en memoria con buckets fijos; observe() es una búsqueda
+    binaria y un incremento bajo lock
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Conteos por bucket (el último es +Inf), suma
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """
+    Valor calculado al exportar: `callback` retorna un número (o None para omitirlo)
+    o un dict {tupla de etiquetas: número}. Con kind='counter' expone contadores que
+    ya lleva otro componente (p. ej. aciertos del caché)
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def samples(self):
+        values = self.callback()
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        # Las gauges se reemplazan: el callback puede cambiar al recrear un servicio
+        metric = Gauge(name, documentation, callback, labelnames, kind)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def render(self):
+        """
+        Exporta todas las métricas en el formato de texto de Prometheus
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Métricas del motor difuso y del almacenamiento, compartidas por los servicios
+FUZZY_EVALUATIONS = REGISTRY.histogram(
+    'fuzzy_evaluate_seconds', 'Duración de FuzzyService.evaluate_conditions',
+    ('engine', 'cache'), STAGE_BUCKETS
+)
+FUZZY_BATCHES = REGISTRY.histogram(
+    'fuzzy_batch_seconds', 'Duración de FuzzyService.evaluate_batch', ('engine',), REQUEST_BUCKETS
+)
+FUZZY_BATCH_ROWS = REGISTRY.counter('fuzzy_batch_rows_total', 'Lecturas evaluadas en lote', ('engine',))
+FUZZY_STAGES = REGISTRY.histogram(
+    'fuzzy_stage_seconds',
+    'Etapas de la inferencia: fuzzification, rules y defuzzification (evaluador vectorizado), '
+    'lookup (tabla) y skfuzzy_compute (ControlSystemSimulation.compute completo)',
+    ('stage',), STAGE_BUCKETS
+)
+SENSOR_STAGES = REGISTRY.histogram(
+    'sensor_stage_seconds', 'Etapas de SensorService al guardar lecturas (storage, aggregates)',
+    ('stage',), STAGE_BUCKETS
+)
@@ -0,0 +1,266 @@
+import os
+import threading
+import numpy as np
+from .fuzzy_registry import get_fuzzy_service
+from .fuzzy_lut import INPUT_LABELS
+
+# Suavizado exponencial del nivel (alpha) y de la tendencia (beta) de cada entrada
+DEFAULT_SMOOTHING = float(os.environ.get('PUMP_SMOOTHING', 0.3))
+DEFAULT_TREND_SMOOTHING = float(os.environ.get('PUMP_TREND_SMOOTHING', 0.1))
+# Lecturas hacia adelante a las que se proyecta la tendencia antes de evaluar
+DEFAULT_TREND_HORIZON = float(os.environ.get('PUMP_TREND_HORIZON', 1))
+# Cambio mínimo de alguna entrada suavizada, como fracción de su universo, para volver a evaluar
+DEFAULT_REEVALUATE_THRESHOLD = float(os.environ.get('PUMP_REEVALUATE_THRESHOLD', 0.02))
+# Histéresis sobre tiempo_bomba (segundos): se enciende por encima de ON y se apaga por
+# debajo de OFF. Sin PUMP_ON_SECONDS / PUMP_OFF_SECONDS los umbrales son fracciones del
+# universo de tiempo_bomba de la base de reglas (con la base por defecto, 0-20 s: 9 y 7 s)
+DEFAULT_ON_SECONDS = float(os.environ['PUMP_ON_SECONDS']) if os.environ.get('PUMP_ON_SECONDS') else None
+DEFAULT_OFF_SECONDS = float(os.environ['PUMP_OFF_SECONDS']) if os.environ.get('PUMP_OFF_SECONDS') else None
+DEFAULT_ON_FRACTION = float(os.environ.get('PUMP_ON_FRACTION', 0.45))
+DEFAULT_OFF_FRACTION = float(os.environ.get('PUMP_OFF_FRACTION', 0.35))
+# Tiempo mínimo (segundos, según el timestamp de las lecturas) apagada antes de volver a encender
+DEFAULT_MIN_OFF_SECONDS = float(os.environ.get('PUMP_MIN_OFF_SECONDS', 60))
+
+
+class DeviceState:
+    """
+    Estado del controlador para un dispositivo; cada lectura lo actualiza en O(1)
+    """
+    __slots__ = ('lock', 'level', 'trend', 'evaluated_at', 'evaluation', 'pump_on', 'off_since',
+                 'readings', 'evaluations', 'skipped', 'blocked')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.level = None
+        self.trend = None
+        # Entradas (proyectadas) de la última evaluación difusa y su resultado
+        self.evaluated_at = None
+        self.evaluation = None
+        self.pump_on = False
+        self.off_since = None
+        self.readings = 0
+        self.evaluations = 0
+        self.skipped = 0
+        self.blocked = 0
+
+    def to_dict(self):
+        return {
+            "bomba_encendida": self.pump_on,
+            "apagada_desde": self.off_since,
+            "suavizado": dict(zip(INPUT_LABELS, self.level)) if self.level else None,
+            "tendencia": dict(zip(INPUT_LABELS, self.trend)) if self.trend else None,
+            "ultima_evaluacion": self.evaluation,
+            "lecturas": self.readings,
+            "evaluaciones": self.evaluations,
+            "omitidas": self.skipped,
+            "bloqueos_minimo_apagado": self.blocked
+        }
+
+
+class PumpController:
+    """
+    Controlador de la bomba por dispositivo alrededor de FuzzyService.
+
+    Cada lectura actualiza el nivel y la tendencia suavizados de las entradas (Holt,
+    O(1)). La inferencia difusa se repite solo cuando alguna entrada suavizada, proyectada
+    `trend_horizon` lecturas, se movió más de `threshold` (fracción de su universo)
+    desde la última evaluación; si no, se reutiliza el resultado anterior. La bomba se
+    enciende con tiempo_bomba > on_seconds, se apaga con tiempo_bomba < off_seconds y,
+    una vez apagada, no vuelve a encender antes de min_off_seconds. Los umbrales que no
+    se indican se calculan como on_fraction / off_fraction del universo de tiempo_bomba.
+    """
+
+    def __init__(self, fuzzy_service=None, smoothing=DEFAULT_SMOOTHING, trend_smoothing=DEFAULT_TREND_SMOOTHING,
+                 trend_horizon=DEFAULT_TREND_HORIZON, threshold=DEFAULT_REEVALUATE_THRESHOLD,
+                 on_seconds=DEFAULT_ON_SECONDS, off_seconds=DEFAULT_OFF_SECONDS,
+                 min_off_seconds=DEFAULT_MIN_OFF_SECONDS, on_fraction=DEFAULT_ON_FRACTION,
+                 off_fraction=DEFAULT_OFF_FRACTION):
+        if not 0 < smoothing <= 1 or not 0 <= trend_smoothing <= 1:
+            raise ValueError("Los factores de suavizado deben estar en (0, 1]")
+        if on_seconds is not None and off_seconds is not None and off_seconds > on_seconds:
+            raise ValueError("El umbral de apagado no puede ser mayor que el de encendido")
+        if off_fraction > on_fraction:
+            raise ValueError("La fracción de apagado no puede ser mayor que la de encendido")
+        self._fuzzy_service = fuzzy_service
+        self.smoothing = float(smoothing)
+        self.trend_smoothing = float(trend_smoothing)
+        self.trend_horizon = float(trend_horizon)
+        self.threshold = float(threshold)
+        self.on_seconds = float(on_seconds) if on_seconds is not None else None
+        self.off_seconds = float(off_seconds) if off_seconds is not None else None
+        self.on_fraction = float(on_fraction)
+        self.off_fraction = float(off_fraction)
+        self.min_off_seconds = float(min_off_seconds)
+        self._lock = threading.Lock()
+        self._states = {}
+        self._bounds = None
+
+    @property
+    def fuzzy_service(self):
+        return self._fuzzy_service if self._fuzzy_service is not None else get_fuzzy_service()
+
+    def update(self, device, values, timestamp):
+        """
+        Procesa una lectura (valores en el orden de INPUT_LABELS) y retorna la evaluación
+        con la decisión de la bomba, en el formato de FuzzyService.evaluate_conditions
+        """
+        return self.update_batch([device], [values], [timestamp])[0]
+
+    def update_batch(self, devices, values, timestamps):
+        """
+        Procesa varias lecturas en orden; las que requieren inferencia se evalúan en un solo lote
+        """
+        fuzzy_service = self.fuzzy_service
+        version, lower, span, on_seconds, off_seconds = self._universe(fuzzy_service)
+        groups = {}
+        for index, device in enumerate(devices):
+            groups.setdefault(device, []).append(index)
+
+        results = [None] * len(devices)
+        for device, indexes in groups.items():
+            state = self._state(device)
+            # El lock del dispositivo mantiene el orden de sus lecturas entre hilos
+            with state.lock:
+                if state.evaluation is not None and state.evaluation.get('version_reglas') != version:
+                    # La base de reglas cambió: el resultado guardado ya no vale
+                    state.evaluated_at = None
+                points = []
+                controls = []
+                for index in indexes:
+                    points.append(self._smooth(state, [float(v) for v in values[index]], lower, span))
+                    controls.append({
+                        "suavizado": {label: round(v, 4) for label, v in zip(INPUT_LABELS, state.level)},
+                        "tendencia": {label: round(v, 4) for label, v in zip(INPUT_LABELS, state.trend)}
+                    })
+                pending = [position for position, point in enumerate(points) if point is not None]
+                fresh = {}
+                if pending:
+                    try:
+                        batch = fuzzy_service.evaluate_batch_conditions([points[p] for p in pending])
+                    except Exception:
+                        # Forzar la evaluación en la próxima lectura
+                        state.evaluated_at = None
+                        raise
+                    fresh = dict(zip(pending, batch))
+                for position, index in enumerate(indexes):
+                    if position in fresh:
+                        state.evaluation = fresh[position]
+                        state.evaluations += 1
+                    else:
+                        state.skipped += 1
+                    state.readings += 1
+                    result = self._decide(state, timestamps[index], on_seconds, off_seconds)
+                    result['control'] = dict(controls[position], reevaluada=position in fresh)
+                    results[index] = result
+        return results
+
+    def state(self, device):
+        """
+        Retorna el estado del controlador de un dispositivo, o None si no tiene lecturas
+        """
+        with self._lock:
+            state = self._states.get(device)
+        if state is None:
+            return None
+        with state.lock:
+            return state.to_dict()
+
+    def stats(self):
+        """
+        Retorna los totales de lecturas, evaluaciones y evaluaciones omitidas
+        """
+        with self._lock:
+            states = list(self._states.values())
+        # Umbrales efectivos de la última base de reglas usada (sin lecturas, los indicados)
+        bounds = self._bounds
+        on_seconds, off_seconds = bounds[3:] if bounds is not None else (self.on_seconds, self.off_seconds)
+        readings = sum(state.readings for state in states)
+        skipped = sum(state.skipped for state in states)
+        return {
+            "dispositivos": len(states),
+            "bombas_encendidas": sum(state.pump_on for state in states),
+            "lecturas": readings,
+            "evaluaciones": sum(state.evaluations for state in states),
+            "omitidas": skipped,
+            "proporcion_omitidas": round(skipped / readings, 4) if readings else None,
+            "bloqueos_minimo_apagado": sum(state.blocked for state in states),
+            "configuracion": {
+                "suavizado": self.smoothing,
+                "suavizado_tendencia": self.trend_smoothing,
+                "horizonte_tendencia": self.trend_horizon,
+                "umbral_reevaluacion": self.threshold,
+                "encender_sobre": on_seconds,
+                "apagar_bajo": off_seconds,
+                "minimo_apagada": self.min_off_seconds
+            }
+        }
+
+    def _state(self, device):
+        state = self._states.get(device)
+        if state is None:
+            with self._lock:
+                state = self._states.setdefault(device, DeviceState())
+        return state
+
+    def _universe(self, fuzzy_service):
+        # Límites de los universos de entrada y umbrales de la bomba, por versión de la base de reglas
+        version = fuzzy_service.rulebase_version
+        bounds = self._bounds
+        if bounds is None or bounds[0] != version:
+            universes = {variable.label: np.asarray(variable.universe, dtype=np.float64)
+                         for variable in fuzzy_service.plant_ctrl.antecedents}
+            lower = [float(universes[label].min()) for label in INPUT_LABELS]
+            span = [float(np.ptp(universes[label])) or 1.0 for label in INPUT_LABELS]
+            output = next(np.asarray(variable.universe, dtype=np.float64)
+                          for variable in fuzzy_service.plant_ctrl.consequents if variable.label == 'tiempo_bomba')
+            on_seconds = self.on_seconds
+            if on_seconds is None:
+                on_seconds = float(output.min() + self.on_fraction * np.ptp(output))
+            off_seconds = self.off_seconds
+            if off_seconds is None:
+                off_seconds = min(float(output.min() + self.off_fraction * np.ptp(output)), on_seconds)
+            bounds = self._bounds = (version, lower, span, on_seconds, off_seconds)
+        return bounds
+
+    def _smooth(self, state, values, lower, span):
+        """
+        Actualiza nivel y tendencia; retorna el punto a evaluar o None si el cambio
+        desde la última evaluación no supera el umbral
+        """
+        if state.level is None:
+            state.level = values
+            state.trend = [0.0] * len(values)
+        else:
+            alpha, beta = self.smoothing, self.trend_smoothing
+            level = [alpha * x + (1 - alpha) * (l + t) for x, l, t in zip(values, state.level, state.trend)]
+            state.trend = [beta * (new - old) + (1 - beta) * t for new, old, t in zip(level, state.level, state.trend)]
+            state.level = level
+
+        # Proyectar y mantener dentro del universo de cada entrada
+        point = [min(max(l + self.trend_horizon * t, low), low + width)
+                 for l, t, low, width in zip(state.level, state.trend, lower, span)]
+        if state.evaluated_at is not None and all(
+                abs(p - e) <= self.threshold * width for p, e, width in zip(point, state.evaluated_at, span)):
+            return None
+        state.evaluated_at = point
+        return point
+
+    def _decide(self, state, timestamp, on_seconds, off_seconds):
+        evaluation = state.evaluation
+        tiempo_bomba = evaluation['tiempo_bomba']
+        if 'error' in evaluation:
+            turn_on = False
+        elif state.pump_on:
+            turn_on = tiempo_bomba >= off_seconds
+        else:
+            turn_on = tiempo_bomba > on_seconds
+            if turn_on and state.off_since is not None and timestamp - state.off_since < self.min_off_seconds:
+                turn_on = False
+                state.blocked += 1
+        if state.pump_on and not turn_on:
+            state.off_since = timestamp
+        state.pump_on = turn_on
+
+        # condiciones son las entradas suavizadas que se evaluaron; la lectura cruda queda
+        # en los valores del registro
+        return dict(evaluation, activar_bomba=turn_on, condiciones=dict(evaluation['condiciones']))
@@ -0,0 +1,191 @@
+import threading
+import numpy as np
+
+# Campos agregados por bucket: las cuatro entradas y las salidas difusas
+AGGREGATE_FIELDS = ('temperatura', 'humedad', 'humedadSuelo', 'luz', 'estado', 'tiempo_bomba')
+# Buckets que conserva cada agregador incremental
+DEFAULT_CAPACITY = 1440
+
+
+def reduce_stats(keys, stats):
+    """
+    Agrupa estadísticas parciales por clave de bucket de forma vectorizada.
+
+    stats: dict con 'count' (N,), 'min'/'max'/'sum'/'last' (N, F) y 'last_ts' (N,).
+    Una lectura suelta es una estadística con count=1 y min=max=sum=last=valor.
+    Retorna (claves únicas ordenadas, estadísticas combinadas por clave).
+    """
+    if len(keys) == 0:
+        return keys, stats
+    # Ordenar por clave y, dentro de cada clave, por timestamp para obtener el último valor
+    order = np.lexsort((stats['last_ts'], keys))
+    keys = keys[order]
+    stats = {name: values[order] for name, values in stats.items()}
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    return keys[starts], {
+        'count': np.add.reduceat(stats['count'], starts),
+        'min': np.minimum.reduceat(stats['min'], starts, axis=0),
+        'max': np.maximum.reduceat(stats['max'], starts, axis=0),
+        'sum': np.add.reduceat(stats['sum'], starts, axis=0),
+        'last': stats['last'][ends],
+        'last_ts': stats['last_ts'][ends],
+    }
+
+
+def readings_to_stats(timestamps, values):
+    """
+    Convierte lecturas (N,) / (N, F) en estadísticas parciales de una lectura cada una
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), len(AGGREGATE_FIELDS))
+    return {
+        'count': np.ones(len(timestamps), dtype=np.int64),
+        'min': values,
+        'max': values,
+        'sum': values,
+        'last': values,
+        'last_ts': timestamps,
+    }
+
+
+def format_buckets(keys, stats, resolution):
+    """
+    Convierte buckets agregados a la lista que retorna la API
+    """
+    buckets = []
+    means = stats['sum'] / stats['count'][:, None] if len(keys) else stats['sum']
+    for i, key in enumerate(keys.tolist()):
+        bucket = {"inicio": key * resolution, "fin": (key + 1) * resolution, "lecturas": int(stats['count'][i])}
+        for j, field in enumerate(AGGREGATE_FIELDS):
+            bucket[field] = {
+                "min": float(stats['min'][i, j]),
+                "max": float(stats['max'][i, j]),
+                "mean": float(means[i, j]),
+                "last": float(stats['last'][i, j])
+            }
+        buckets.append(bucket)
+    return buckets
+
+
+def bucket_bounds(since, until, resolution):
+    """
+    Retorna [inicio, fin) de los buckets completos de `resolution` segundos que tocan
+    [since, until]: ambas rutas de agregados incluyen siempre los buckets enteros
+    """
+    return np.floor(since / resolution) * resolution, (np.floor(until / resolution) + 1) * resolution
+
+
+def aggregate_readings(timestamps, values, resolution, since=None, until=None):
+    """
+    Agrega lecturas crudas en buckets de `resolution` segundos (ruta sin agregador
+    incremental); con since / until solo los buckets que tocan [since, until]
+    """
+    stats = readings_to_stats(timestamps, values)
+    keys = np.floor(stats['last_ts'] / resolution).astype(np.int64)
+    keep = np.ones(len(keys), dtype=bool)
+    if since is not None:
+        keep &= keys >= np.floor(since / resolution)
+    if until is not None:
+        keep &= keys <= np.floor(until / resolution)
+    return reduce_stats(keys[keep], {name: column[keep] for name, column in stats.items()})
+
+
+class BucketAggregator:
+    """
+    Agregados por bucket de tiempo (min/max/media/último) mantenidos de forma incremental
+    en arreglos circulares de `capacity` buckets; consultar una ventana es O(buckets).
+    """
+
+    def __init__(self, resolution, capacity=DEFAULT_CAPACITY):
+        self.resolution = float(resolution)
+        self.capacity = int(capacity)
+        fields = len(AGGREGATE_FIELDS)
+        # Clave del bucket que ocupa cada posición (-1 = vacía)
+        self._keys = np.full(self.capacity, -1, dtype=np.int64)
+        self._count = np.zeros(self.capacity, dtype=np.int64)
+        self._min = np.zeros((self.capacity, fields))
+        self._max = np.zeros((self.capacity, fields))
+        self._sum = np.zeros((self.capacity, fields))
+        self._last = np.zeros((self.capacity, fields))
+        self._last_ts = np.zeros(self.capacity)
+        self._newest = -1
+        self._lock = threading.Lock()
+
+    def add(self, timestamps, values):
+        """
+        Incorpora lecturas: timestamps (N,) y valores (N, F) en el orden de AGGREGATE_FIELDS
+        """
+        stats = readings_to_stats(timestamps, values)
+        keys = np.floor(stats['last_ts'] / self.resolution).astype(np.int64)
+        keys, stats = reduce_stats(keys, stats)
+        if len(keys) == 0:
+            return
+
+        with self._lock:
+            # Descartar buckets que ya quedaron fuera de la ventana retenida
+            self._newest = max(self._newest, int(keys[-1]))
+            keep = keys > self._newest - self.capacity
+            keys = keys[keep]
+            stats = {name: values[keep] for name, values in stats.items()}
+
+            slots = keys % self.capacity
+            fresh = self._keys[slots] != keys
+            fresh_slots = slots[fresh]
+            self._keys[fresh_slots] = keys[fresh]
+            self._count[fresh_slots] = 0
+            self._min[fresh_slots] = np.inf
+            self._max[fresh_slots] = -np.inf
+            self._sum[fresh_slots] = 0.0
+            self._last_ts[fresh_slots] = -np.inf
+
+            self._count[slots] += stats['count']
+            self._min[slots] = np.minimum(self._min[slots], stats['min'])
+            self._max[slots] = np.maximum(self._max[slots], stats['max'])
+            self._sum[slots] += stats['sum']
+            newer = stats['last_ts'] >= self._last_ts[slots]
+            self._last[slots[newer]] = stats['last'][newer]
+            self._last_ts[slots[newer]] = stats['last_ts'][newer]
+
+    def covers(self, since, resolution=None):
+        """
+        Indica si la ventana retenida alcanza a cubrir desde el inicio del bucket de
+        `resolution` segundos que contiene `since`
+        """
+        if since is None or self._newest < 0:
+            return False
+        start, _ = bucket_bounds(since, since, resolution or self.resolution)
+        return np.floor(start / self.resolution) > self._newest - self.capacity
+
+    def query(self, since, until, resolution=None):
+        """
+        Retorna (claves, estadísticas) de los buckets completos que tocan [since, until].
+        Si `resolution` es múltiplo de la resolución propia, los buckets se combinan a esa resolución
+        """
+        resolution = resolution or self.resolution
+        factor = int(round(resolution / self.resolution))
+        with self._lock:
+            valid = self._keys >= 0
+            valid &= self._keys >= np.floor(since / resolution) * factor
+            valid &= self._keys < (np.floor(until / resolution) + 1) * factor
+            slots = np.flatnonzero(valid)
+
+            # La indexación por arreglo copia los datos: se combinan fuera del lock
+            keys = self._keys[slots] // factor
+            stats = {
+                'count': self._count[slots],
+                'min': self._min[slots],
+                'max': self._max[slots],
+                'sum': self._sum[slots],
+                'last': self._last[slots],
+                'last_ts': self._last_ts[slots],
+            }
+        return reduce_stats(keys, stats)
+
+    def supports(self, resolution):
+        """
+        Indica si `resolution` se puede obtener combinando buckets propios
+        """
+        factor = resolution / self.resolution
+        return factor >= 1 and abs(factor - round(factor)) < 1e-9
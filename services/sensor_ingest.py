@@ -0,0 +1,147 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from .sensor_store import DEFAULT_DEVICE
+
+logger = logging.getLogger(__name__)
+
+# Lecturas en espera antes de rechazar con 429
+DEFAULT_QUEUE_SIZE = 10000
+# Lecturas por micro-lote y espera máxima para completarlo (segundos)
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT = 0.05
+# Tiempo máximo para vaciar la cola al detener el worker (segundos)
+DEFAULT_DRAIN_TIMEOUT = 10.0
+
+
+class IngestWorker:
+    """
+    Cola acotada de lecturas validadas y un hilo que la vacía en micro-lotes a
+    través de SensorService.save_values (una sola evaluación vectorizada por lote).
+
+    El hilo se inicia con el primer submit() de cada proceso, así funciona igual
+    con `gunicorn --preload` (los hilos no sobreviven al fork). Al terminar el
+    proceso se procesan las lecturas pendientes antes de salir.
+    """
+
+    def __init__(self, sensor_service, max_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        self.sensor_service = sensor_service
+        self.max_size = int(max_size)
+        self.batch_size = int(batch_size)
+        self.max_wait = float(max_wait)
+        self.drain_timeout = float(drain_timeout)
+        self._queue = queue.Queue(self.max_size)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+
+    def submit(self, values, device=DEFAULT_DEVICE, timestamp=None):
+        """
+        Encola una lectura validada. Retorna False si la cola está llena o el worker
+        se está deteniendo
+        """
+        self._ensure_started()
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put_nowait((time.time() if timestamp is None else timestamp, values, device))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "depth": self._queue.qsize(),
+                "max_size": self.max_size,
+                "max_depth": self.max_depth,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "batches": self.batches,
+                "errors": self.errors,
+                "last_batch_size": self.last_batch_size,
+                "last_batch_ms": round(self.last_batch_ms, 3)
+            }
+
+    def stop(self, timeout=None):
+        """
+        Deja de aceptar lecturas y espera a que se procesen las pendientes
+        """
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(self.drain_timeout if timeout is None else timeout)
+            if thread.is_alive():
+                logger.warning("Worker de ingesta detenido con %d lecturas pendientes", self._queue.qsize())
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Proceso hijo tras un fork: la cola y los contadores heredados no sirven
+                self._queue = queue.Queue(self.max_size)
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='sensor-ingest', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        timestamps, values, devices = zip(*batch)
+        try:
+            self.sensor_service.save_values(list(values), list(timestamps), list(devices))
+        except Exception:
+            logger.exception("Error al procesar un lote de %d lecturas encoladas", len(batch))
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.processed += len(batch)
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            self.last_batch_ms = (time.perf_counter() - start) * 1000
@@ -1,47 +1,247 @@
-from .fuzzy_service import FuzzyService
+from .fuzzy_registry import current_fuzzy_service, get_fuzzy_service
+from .sensor_store import create_store, iter_records, DEFAULT_DEVICE, DEVICE_FIELD
+from .sensor_aggregates import AGGREGATE_FIELDS, BucketAggregator, aggregate_readings, bucket_bounds
+from .metrics import SENSOR_STAGES
+from .log_config import Payload, Sampler, log_event
+from .pump_controller import PumpController
 import logging
+import math
+import os
+import re
+import time
+import numpy as np
 
 logger = logging.getLogger(__name__)
+# Muestreo de los logs por lectura (SENSOR_LOG_SAMPLE_RATE)
+sample_reading_log = Sampler()
+
+# Resoluciones (segundos) de los agregados que se mantienen de forma incremental
+AGGREGATE_RESOLUTIONS = [
+    float(r) for r in os.environ.get('SENSOR_AGGREGATE_RESOLUTIONS', '60,3600').split(',') if r.strip()
+]
+
+# Con PUMP_CONTROLLER=1 la decisión de la bomba pasa por PumpController (suavizado,
+# histéresis y reevaluación solo ante cambios) en lugar de evaluar cada lectura
+PUMP_CONTROLLER = os.environ.get('PUMP_CONTROLLER') == '1'
+
+# Campos obligatorios de cada lectura, en el orden que espera FuzzyService
+REQUIRED_FIELDS = ('temperatura', 'humedad', 'humedadSuelo', 'luz')
+# Identificador de dispositivo aceptado en el campo 'dispositivo'
+DEVICE_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]{1,64}$')
+# Motivo del rechazo cuando el almacén ya tiene el máximo de dispositivos
+DEVICE_LIMIT_ERROR = "Se alcanzó el máximo de dispositivos; no se aceptan lecturas de '{}'"
+
+def validate_reading(data):
+    """
+    Valida una lectura y retorna sus valores numéricos en el orden de REQUIRED_FIELDS;
+    lanza ValueError con el motivo si no es válida
+    """
+    if not isinstance(data, dict):
+        raise ValueError("La lectura debe ser un objeto JSON")
+    missing = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f"Faltan campos: {', '.join(missing)}")
+
+    values = []
+    for field in REQUIRED_FIELDS:
+        value = data[field]
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"El campo '{field}' debe ser numérico")
+        if not math.isfinite(value):
+            raise ValueError(f"El campo '{field}' debe ser un número finito")
+        values.append(value)
+    return values
+
+def validate_device(data):
+    """
+    Retorna el dispositivo de una lectura (DEFAULT_DEVICE si no lo indica); lanza
+    ValueError si el identificador no es válido
+    """
+    device = data.get(DEVICE_FIELD, DEFAULT_DEVICE) if isinstance(data, dict) else DEFAULT_DEVICE
+    if not isinstance(device, str) or not DEVICE_PATTERN.match(device):
+        raise ValueError(f"El campo '{DEVICE_FIELD}' debe tener de 1 a 64 letras, números o _ . : -")
+    return device
 
 class SensorService:
-    def __init__(self):
-        self.sensor_data = []
-        self.fuzzy_service = FuzzyService()
+    def __init__(self, store=None, fuzzy_service=None, controller=None):
+        """
+        store: backend de almacenamiento (RingBufferStore, SQLiteStore); por defecto
+        el configurado por variables de entorno en sensor_store.create_store()
+        fuzzy_service: por defecto la instancia compartida de fuzzy_registry, que se
+        construye en la primera evaluación
+        controller: PumpController que decide la bomba por dispositivo; por defecto uno
+        nuevo si PUMP_CONTROLLER=1, si no cada lectura se evalúa por separado
+        """
+        self.store = store if store is not None else create_store()
+        self._fuzzy_service = fuzzy_service
+        if controller is None and PUMP_CONTROLLER:
+            controller = PumpController(fuzzy_service)
+        self.controller = controller
+
+        # Agregados incrementales, inicializados con el historial ya almacenado
+        self.aggregators = [BucketAggregator(resolution) for resolution in AGGREGATE_RESOLUTIONS]
+        columns = self.store.columns()
+        if len(columns['timestamp']):
+            history = np.column_stack([columns[field] for field in AGGREGATE_FIELDS])
+            for aggregator in self.aggregators:
+                aggregator.add(columns['timestamp'], history)
+
+    @property
+    def fuzzy_service(self):
+        return self._fuzzy_service if self._fuzzy_service is not None else get_fuzzy_service()
+
+    @property
+    def current_fuzzy_service(self):
+        """
+        El FuzzyService que usa este servicio si ya existe, o None (no lo construye)
+        """
+        return self._fuzzy_service if self._fuzzy_service is not None else current_fuzzy_service()
 
     def save_data(self, data):
         """
         Guarda los datos del sensor y evalúa las condiciones
         """
-        logger.info(f"Evaluando condiciones para datos: {data}")
-        
+        values = validate_reading(data)
+        device = validate_device(data)
+        self.require_devices([device])
+
         # Evaluar condiciones con lógica difusa
-        evaluation = self.fuzzy_service.evaluate_conditions(
-            data['temperatura'],
-            data['humedad'],
-            data['humedadSuelo'],
-            data['luz']
-        )
-        
-        logger.info(f"Evaluación generada: {evaluation}")
+        timestamp = time.time()
+        if self.controller is not None:
+            evaluation = self.controller.update(device, values, timestamp)
+        else:
+            evaluation = self.fuzzy_service.evaluate_conditions(*values)
+        if 'error' in evaluation:
+            log_event(logger, logging.WARNING, "Evaluación fallida", dispositivo=device,
+                      valores=Payload(values), error=evaluation['error'])
+        elif sample_reading_log():
+            log_event(logger, logging.INFO, "Lectura evaluada", dispositivo=device, valores=Payload(values),
+                      estado=evaluation['estado'], tiempo_bomba=evaluation['tiempo_bomba'],
+                      muestreo=sample_reading_log.rate)
         
         # Agregar evaluación a los datos
         data['evaluacion'] = evaluation
-        self.sensor_data.append(data)
+        with SENSOR_STAGES.time(stage='storage'):
+            self.store.append(timestamp, values, evaluation, device)
+        self._update_aggregates([timestamp], [values], [evaluation])
         return True
 
+    def save_batch(self, readings):
+        """
+        Guarda varias lecturas ya validadas en un solo paso, evaluándolas en un único
+        lote vectorizado. Retorna la lista de evaluaciones en el mismo orden
+        """
+        if not readings:
+            return []
+
+        values = [validate_reading(data) for data in readings]
+        devices = [validate_device(data) for data in readings]
+        evaluations = self.save_values(values, [time.time()] * len(values), devices)
+        for data, evaluation in zip(readings, evaluations):
+            data['evaluacion'] = evaluation
+        log_event(logger, logging.INFO, "Lote evaluado y almacenado", lecturas=len(readings))
+        return evaluations
+
+    def save_values(self, values, timestamps, devices=None):
+        """
+        Evalúa en un solo lote y almacena lecturas ya validadas (listas en el orden de
+        REQUIRED_FIELDS) con sus timestamps de recepción y dispositivos. Retorna las evaluaciones;
+        lanza ValueError, antes de evaluar, si algún dispositivo supera el máximo del almacén
+        """
+        devices = devices or [DEFAULT_DEVICE] * len(values)
+        self.require_devices(devices)
+        if self.controller is not None:
+            evaluations = self.controller.update_batch(devices, values, timestamps)
+        else:
+            evaluations = self.fuzzy_service.evaluate_batch_conditions(values)
+        with SENSOR_STAGES.time(stage='storage'):
+            self.store.extend(timestamps, values, evaluations, devices)
+        self._update_aggregates(timestamps, values, evaluations)
+        return evaluations
+
+    def admit_devices(self, devices):
+        """
+        Reserva en el almacén los dispositivos de lecturas aún no evaluadas. Retorna los
+        rechazados por superar el máximo de dispositivos; los admitidos no fallan al guardar
+        """
+        return self.store.admit(devices)
+
+    def require_devices(self, devices):
+        """
+        Como admit_devices(), pero lanza ValueError si se rechaza algún dispositivo
+        """
+        rejected = self.admit_devices(devices)
+        if rejected:
+            raise ValueError(DEVICE_LIMIT_ERROR.format(min(rejected)))
+
+    def _update_aggregates(self, timestamps, values, evaluations):
+        with SENSOR_STAGES.time(stage='aggregates'):
+            rows = [list(v) + [e['estado'], e['tiempo_bomba']] for v, e in zip(values, evaluations)]
+            for aggregator in self.aggregators:
+                aggregator.add(timestamps, rows)
+
+    def get_aggregates(self, resolution, since, until, device=None):
+        """
+        Retorna (claves, estadísticas) de los buckets completos de `resolution` segundos
+        que tocan [since, until]. Usa el agregador incremental más grueso compatible; si
+        ninguno cubre la ventana, o se pide un solo dispositivo, agrega de forma
+        vectorizada las lecturas almacenadas de esos mismos buckets
+        """
+        candidates = [a for a in self.aggregators if a.supports(resolution) and a.covers(since, resolution)]
+        if candidates and device is None:
+            aggregator = max(candidates, key=lambda a: a.resolution)
+            return aggregator.query(since, until, resolution)
+
+        start, end = bucket_bounds(since, until, resolution)
+        columns = self.store.columns(since=start, until=end, device=device)
+        values = np.column_stack([columns[field] for field in AGGREGATE_FIELDS])
+        return aggregate_readings(columns['timestamp'], values, resolution, since, until)
+
     def get_all_data(self):
         """
         Retorna todos los datos almacenados
         """
-        return self.sensor_data
+        return self.store.records()
+
+    def query_data(self, since=None, until=None, after_id=None, limit=None, device=None):
+        """
+        Retorna las lecturas en el rango [since, until] (epoch en segundos) posteriores
+        al cursor `after_id`, hasta `limit` lecturas; solo las de `device` si se indica
+        """
+        return self.store.query(since=since, until=until, after_id=after_id, limit=limit, device=device)
+
+    def iter_data(self, since=None, until=None, after_id=None, limit=None, device=None):
+        """
+        Igual que query_data pero recorre el historial por bloques, para exportarlo
+        sin construirlo completo en memoria
+        """
+        return iter_records(self.store, since=since, until=until, after_id=after_id, limit=limit, device=device)
+
+    def get_devices(self):
+        """
+        Retorna el resumen de cada dispositivo (lecturas retenidas, última lectura)
+        """
+        return self.store.devices()
+
+    def get_latest_data(self, device=None):
+        """
+        Retorna la última lectura almacenada, global o de un dispositivo (O(1)), o None si no hay datos
+        """
+        return self.store.latest(device)
 
-    def get_latest_evaluation(self):
+    def get_latest_evaluation(self, device=None):
         """
-        Retorna la última evaluación realizada
+        Retorna la última evaluación realizada, global o de un dispositivo
         """
-        if self.sensor_data:
-            evaluation = self.sensor_data[-1]['evaluacion']
-            logger.info(f"Retornando última evaluación: {evaluation}")
+        latest = self.store.latest(device)
+        if latest:
+            evaluation = latest['evaluacion']
+            log_event(logger, logging.DEBUG, "Retornando última evaluación", dispositivo=device,
+                      evaluacion=Payload(evaluation))
             return evaluation
-        logger.warning("No hay datos disponibles para evaluación")
-        return None 
\ No newline at end of file
+        log_event(logger, logging.DEBUG, "No hay datos disponibles para evaluación", dispositivo=device)
+        return None
@@ -0,0 +1,350 @@
+import atexit
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import numpy as np
+from .sensor_store import (COLUMNS, DEFAULT_DEVICE, DEFAULT_MAX_DEVICES, DEFAULT_RETENTION, DEVICE_FIELD,
+                           ERROR_FIELD, INPUT_FIELDS, VERSION_FIELD, DeviceStore, RingBufferStore)
+from .log_config import log_event
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre snapshots periódicos (además del que se toma al terminar el proceso)
+DEFAULT_SNAPSHOT_INTERVAL = 300.0
+# Registro de tamaño fijo de cada lectura en el log: id, columnas, versión de la base
+# de reglas, dispositivo (DEVICE_PATTERN limita los identificadores a 64 caracteres ASCII)
+# y motivo del error en UTF-8, truncado a 128 bytes
+_LOG_FIELDS = [('id', '<i8')] + [(name, '?' if dtype is np.bool_ else '<f8') for name, dtype in COLUMNS]
+LOG_DTYPE = np.dtype(_LOG_FIELDS + [(VERSION_FIELD, 'S16'), (DEVICE_FIELD, 'S64'), (ERROR_FIELD, 'S128')])
+# Formato del registro de cada log, indicado en el nombre del archivo (log-N.fF.bin; sin
+# sufijo, el formato 1 anterior a guardar el motivo de los errores)
+LOG_FORMAT = 2
+LOG_DTYPES = {1: np.dtype(_LOG_FIELDS + [(VERSION_FIELD, 'S16'), (DEVICE_FIELD, 'S64')]), LOG_FORMAT: LOG_DTYPE}
+SNAPSHOT_PATTERN = re.compile(r'^snapshot-(\d+)$')
+LOG_PATTERN = re.compile(r'^log-(\d+)(?:\.f(\d+))?\.bin$')
+ARRAY_FIELDS = [name for name, _ in COLUMNS] + ['id', VERSION_FIELD, ERROR_FIELD]
+# Campos de texto: en el log y en el snapshot se guardan como bytes de tamaño fijo
+TEXT_FIELDS = (VERSION_FIELD, ERROR_FIELD)
+
+
+class SnapshotStore(DeviceStore):
+    """
+    DeviceStore que conserva su historial entre reinicios en `directory`:
+
+    - snapshot-N/: una columna .npy por campo, con las lecturas agrupadas por
+      dispositivo, y meta.json con los rangos de cada dispositivo
+    - log-N.fF.bin: registros binarios (LOG_DTYPE) de las lecturas posteriores al snapshot N
+
+    Al crearse lee el último snapshot, reproduce los logs siguientes y construye las
+    particiones de forma vectorizada: de cada dispositivo se copian solo sus últimas
+    `retention` lecturas, y si hay más de `max_devices` se conservan los de lectura
+    más reciente. Cada `interval` segundos, y al terminar el proceso, se toma un
+    snapshot nuevo y se descartan los anteriores.
+
+    Solo un proceso a la vez escribe en el directorio (bloqueo con flock, tomado en
+    la primera escritura de cada proceso). Con varios workers de gunicorn los demás
+    atienden sus lecturas solo en memoria.
+    """
+
+    def __init__(self, directory, retention=DEFAULT_RETENTION, max_devices=DEFAULT_MAX_DEVICES,
+                 interval=DEFAULT_SNAPSHOT_INTERVAL):
+        super().__init__(retention, max_devices)
+        self.directory = directory
+        self.interval = float(interval)
+        os.makedirs(directory, exist_ok=True)
+        self._log_lock = threading.Lock()
+        self._log = None
+        self._lock_file = None
+        self._owner = False
+        self._pid = None
+        self._seq = 0
+        self._pending = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        self.restored = 0
+        self.restore_ms = 0.0
+        self._restore()
+
+    def extend(self, timestamps, values, evaluations, devices=None):
+        with self._log_lock:
+            super().extend(timestamps, values, evaluations, devices)
+            if len(timestamps) and self._ensure_log():
+                self._write_log(timestamps, values, evaluations, devices)
+
+    def snapshot(self):
+        """
+        Escribe un snapshot del historial actual y continúa el log en un archivo nuevo.
+        Retorna las lecturas guardadas, o None si este proceso no escribe en el directorio
+        """
+        with self._log_lock:
+            if not self._ensure_log():
+                return None
+            # Las escrituras esperan solo la copia de las columnas, no la escritura a disco.
+            # admit() agrega particiones sin _log_lock: copiar el diccionario bajo _lock
+            with self._lock:
+                partitions = list(self._partitions.items())
+            parts = [(device, partition.arrays()) for device, partition in partitions if len(partition)]
+            count = self._count
+            self._seq += 1
+            self._log.close()
+            self._log = self._open_log(self._seq)
+            self._pending = 0
+            seq = self._seq
+
+        start = time.perf_counter()
+        rows = self._write_snapshot(seq, parts, count)
+        self._cleanup(seq)
+        log_event(logger, logging.INFO, "Snapshot del historial guardado", snapshot=seq, lecturas=rows,
+                  dispositivos=len(parts), ms=round((time.perf_counter() - start) * 1000, 1))
+        return rows
+
+    def close(self):
+        """
+        Detiene los snapshots periódicos, toma uno final si hay lecturas nuevas y libera el directorio
+        """
+        self._stopping.set()
+        if not self._owner or self._pid != os.getpid():
+            return
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._pending:
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("Error al guardar el snapshot final del historial")
+        with self._log_lock:
+            self._log.close()
+            if self._lock_file is not None:
+                self._lock_file.close()
+            self._owner = False
+
+    def _ensure_log(self):
+        # Se ejecuta con _log_lock tomado. Con `gunicorn --preload` el historial se
+        # restaura en el maestro y cada worker decide aquí si le toca escribir
+        if self._pid == os.getpid():
+            return self._owner
+        self._pid = os.getpid()
+        self._log = None
+        self._lock_file = None
+        self._owner = self._acquire()
+        if self._owner:
+            self._log = self._open_log(self._seq)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='sensor-snapshot', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self._owner
+
+    def _acquire(self):
+        if fcntl is None:
+            return True
+        handle = open(os.path.join(self.directory, 'lock'), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            logger.warning("%s está en uso por otro proceso; las lecturas de pid %d no se persistirán",
+                           self.directory, os.getpid())
+            return False
+        self._lock_file = handle
+        return True
+
+    def _open_log(self, seq):
+        handle = open(self._log_path(seq), 'ab')
+        # Descartar un registro incompleto al final (proceso terminado a mitad de una escritura)
+        size = handle.tell()
+        if size % LOG_DTYPE.itemsize:
+            handle.truncate(size - size % LOG_DTYPE.itemsize)
+        return handle
+
+    def _write_log(self, timestamps, values, evaluations, devices):
+        records = np.zeros(len(timestamps), dtype=LOG_DTYPE)
+        records['id'] = np.arange(self._count - len(timestamps) + 1, self._count + 1)
+        records['timestamp'] = timestamps
+        inputs = np.asarray(values, dtype=np.float64).reshape(len(timestamps), len(INPUT_FIELDS))
+        for index, field in enumerate(INPUT_FIELDS):
+            records[field] = inputs[:, index]
+        records['estado'] = [evaluation['estado'] for evaluation in evaluations]
+        records['tiempo_bomba'] = [evaluation['tiempo_bomba'] for evaluation in evaluations]
+        records['activar_bomba'] = [evaluation['activar_bomba'] for evaluation in evaluations]
+        records['error'] = ['error' in evaluation for evaluation in evaluations]
+        records[VERSION_FIELD] = _encode_texts([evaluation.get(VERSION_FIELD) for evaluation in evaluations],
+                                               LOG_DTYPE[VERSION_FIELD])
+        records[ERROR_FIELD] = _encode_texts([evaluation.get('error') for evaluation in evaluations],
+                                             LOG_DTYPE[ERROR_FIELD])
+        records[DEVICE_FIELD] = devices if devices is not None else DEFAULT_DEVICE
+        # flush: la lectura sobrevive a la caída del proceso (no a la del sistema)
+        self._log.write(records.tobytes())
+        self._log.flush()
+        self._pending += len(timestamps)
+
+    def _write_snapshot(self, seq, parts, count):
+        path = self._snapshot_path(seq)
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        devices = []
+        offset = 0
+        for device, arrays in parts:
+            size = len(arrays['id'])
+            devices.append([device, offset, offset + size])
+            offset += size
+        for name in ARRAY_FIELDS:
+            if parts:
+                column = np.concatenate([arrays[name] for _, arrays in parts])
+            else:
+                column = np.zeros(0, dtype=LOG_DTYPE[name])
+            if name in TEXT_FIELDS:
+                column = _encode_texts(column.tolist(), LOG_DTYPE[name])
+            self._write_file(os.path.join(tmp, f'{name}.npy'), lambda f: np.save(f, column))
+        meta = {"seq": seq, "count": count, "rows": offset, "devices": devices, "created": time.time()}
+        self._write_file(os.path.join(tmp, 'meta.json'), lambda f: f.write(json.dumps(meta).encode()))
+        os.replace(tmp, path)
+        return offset
+
+    @staticmethod
+    def _write_file(path, write):
+        with open(path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _cleanup(self, seq):
+        for name in os.listdir(self.directory):
+            match = SNAPSHOT_PATTERN.match(name) or LOG_PATTERN.match(name)
+            if match and int(match.group(1)) < seq:
+                path = os.path.join(self.directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            if self._pending:
+                try:
+                    self.snapshot()
+                except Exception:
+                    logger.exception("Error al guardar el snapshot del historial")
+
+    def _restore(self):
+        start = time.perf_counter()
+        snapshots = self._sequences(SNAPSHOT_PATTERN)
+        logs = self._sequences(LOG_PATTERN)
+        base = snapshots[-1] if snapshots else 0
+        # Lecturas de cada dispositivo, como bloques de columnas en orden cronológico
+        parts = {}
+
+        if snapshots:
+            path = self._snapshot_path(base)
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            columns = {}
+            for name in ARRAY_FIELDS:
+                column_path = os.path.join(path, f'{name}.npy')
+                if os.path.exists(column_path):
+                    # Mapeado solo para leer del disco las filas que se copian abajo
+                    columns[name] = np.load(column_path, mmap_mode='r')
+                else:
+                    # Snapshot anterior a versionar las reglas o a guardar el motivo de los errores
+                    columns[name] = np.zeros(meta['rows'], dtype=LOG_DTYPE[name])
+            for device, begin, end in meta['devices']:
+                parts[device] = [{name: column[begin:end] for name, column in columns.items()}]
+            self._count = int(meta['count'])
+
+        for seq in logs:
+            if seq < base:
+                continue
+            for log_format, dtype in LOG_DTYPES.items():
+                path = self._log_path(seq, log_format)
+                if os.path.exists(path):
+                    self._replay(np.fromfile(path, dtype=dtype, count=os.path.getsize(path) // dtype.itemsize),
+                                 parts)
+
+        # Con más dispositivos que `max_devices` se conservan los de lectura más reciente
+        if len(parts) > self.max_devices:
+            newest = sorted(parts, key=lambda device: max((int(block['id'][-1]) for block in parts[device]
+                                                           if len(block['id'])), default=0), reverse=True)
+            dropped = newest[self.max_devices:]
+            for device in dropped:
+                del parts[device]
+            logger.warning("%d dispositivos del historial superan el máximo de %d y no se restauran",
+                           len(dropped), self.max_devices)
+
+        latest_id = 0
+        for device, blocks in parts.items():
+            # Solo las últimas `retention` lecturas de cada dispositivo se copian a su partición
+            arrays = {name: np.concatenate([block[name][-self.retention:] for block in blocks])
+                      for name in ARRAY_FIELDS}
+            for name in TEXT_FIELDS:
+                arrays[name] = _decode_texts(arrays[name])
+            partition = RingBufferStore(self.retention)
+            partition.restore(arrays, device)
+            if not len(partition):
+                continue
+            self._partitions[device] = partition
+            if partition.latest()['id'] > latest_id:
+                latest_id = partition.latest()['id']
+                self._latest = partition.latest()
+
+        self._seq = max([base] + logs)
+        self.restored = len(self)
+        self.restore_ms = (time.perf_counter() - start) * 1000
+        if snapshots or logs:
+            log_event(logger, logging.INFO, "Historial restaurado", directorio=self.directory,
+                      lecturas=self.restored, dispositivos=len(self._partitions), snapshot=base,
+                      logs=len([seq for seq in logs if seq >= base]), ms=round(self.restore_ms, 1))
+
+    def _replay(self, records, parts):
+        # Agrega a `parts` las lecturas de un log, agrupadas por dispositivo
+        if not len(records):
+            return
+        names, inverse = np.unique(records[DEVICE_FIELD], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(names)))])
+        for index, name in enumerate(names):
+            rows = records[order[bounds[index]:bounds[index + 1]]]
+            # Los logs de formato 1 no tienen el motivo de los errores
+            parts.setdefault(name.decode(), []).append({
+                field: rows[field] if field in rows.dtype.names else np.zeros(len(rows), dtype=LOG_DTYPE[field])
+                for field in ARRAY_FIELDS
+            })
+        self._count = max(self._count, int(records['id'].max()))
+
+    def _sequences(self, pattern):
+        sequences = set()
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                sequences.add(int(match.group(1)))
+        return sorted(sequences)
+
+    def _snapshot_path(self, seq):
+        return os.path.join(self.directory, f'snapshot-{seq:08d}')
+
+    def _log_path(self, seq, log_format=LOG_FORMAT):
+        suffix = f'.f{log_format}' if log_format > 1 else ''
+        return os.path.join(self.directory, f'log-{seq:08d}{suffix}.bin')
+
+
+def _encode_texts(values, dtype):
+    # UTF-8 truncado al tamaño del campo; un carácter cortado se descarta al decodificar
+    return np.array([(value or '').encode()[:dtype.itemsize] for value in values], dtype=dtype)
+
+
+def _decode_texts(column):
+    # Versiones y errores se repiten mucho: decodificar solo los valores distintos
+    if len(column) and (column == column[0]).all():
+        return np.full(len(column), column[0].decode(errors='ignore') or None, dtype=object)
+    values, inverse = np.unique(column, return_inverse=True)
+    decoded = np.array([value.decode(errors='ignore') or None for value in values.tolist()], dtype=object)
+    return decoded[inverse.reshape(-1)]
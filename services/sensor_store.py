@@ -0,0 +1,633 @@
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# Columnas almacenadas por lectura
+INPUT_FIELDS = ('temperatura', 'humedad', 'humedadSuelo', 'luz')
+COLUMNS = (
+    ('timestamp', np.float64),
+    ('temperatura', np.float64),
+    ('humedad', np.float64),
+    ('humedadSuelo', np.float64),
+    ('luz', np.float64),
+    ('estado', np.float64),
+    ('tiempo_bomba', np.float64),
+    ('activar_bomba', np.bool_),
+    ('error', np.bool_),
+)
+
+# Dispositivo que envía cada lectura (texto, fuera de COLUMNS por no ser numérico)
+DEVICE_FIELD = 'dispositivo'
+DEFAULT_DEVICE = 'default'
+# Versión de la base de reglas que produjo cada evaluación (None en lecturas anteriores)
+VERSION_FIELD = 'version_reglas'
+# Motivo de las evaluaciones fallidas (None si no falló, o en lecturas anteriores)
+ERROR_FIELD = 'mensaje_error'
+
+SELECT_COLUMNS = ', '.join(['id', DEVICE_FIELD, VERSION_FIELD, ERROR_FIELD] + [name for name, _ in COLUMNS])
+
+# Lecturas que se conservan por defecto en memoria (por dispositivo en DeviceStore)
+DEFAULT_RETENTION = 10000
+# Máximo de dispositivos distintos en DeviceStore
+DEFAULT_MAX_DEVICES = 10000
+# Capacidad inicial de un RingBufferStore; crece al doble hasta `retention`
+INITIAL_CAPACITY = 64
+# Motivo de las evaluaciones fallidas guardadas sin ERROR_FIELD
+ERROR_MESSAGE = "Evaluación fallida"
+# Filas por bloque al recorrer el historial con iter_records()
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def build_record(row):
+    """
+    Reconstruye una lectura con su evaluación a partir de los valores de sus columnas
+    """
+    condiciones = {
+        "temperatura": float(row['temperatura']),
+        "humedad": float(row['humedad']),
+        "suelo": float(row['humedadSuelo']),
+        "luz": float(row['luz'])
+    }
+    if row['error']:
+        evaluation = {"error": row[ERROR_FIELD] or ERROR_MESSAGE, "estado": 0, "activar_bomba": False,
+                      "tiempo_bomba": 0, "version_reglas": row[VERSION_FIELD], "condiciones": condiciones}
+    else:
+        evaluation = {"estado": float(row['estado']), "activar_bomba": bool(row['activar_bomba']),
+                      "tiempo_bomba": float(row['tiempo_bomba']), "version_reglas": row[VERSION_FIELD],
+                      "condiciones": condiciones}
+    return {
+        "id": int(row['id']),
+        "dispositivo": row[DEVICE_FIELD],
+        "timestamp": float(row['timestamp']),
+        "temperatura": condiciones['temperatura'],
+        "humedad": condiciones['humedad'],
+        "humedadSuelo": condiciones['suelo'],
+        "luz": condiciones['luz'],
+        "evaluacion": evaluation
+    }
+
+
+def _evaluation_row(timestamp, values, evaluation, row_id=None, device=DEFAULT_DEVICE):
+    row = dict(zip(INPUT_FIELDS, values))
+    row.update({
+        'id': row_id,
+        DEVICE_FIELD: device,
+        VERSION_FIELD: evaluation.get(VERSION_FIELD),
+        ERROR_FIELD: evaluation.get('error'),
+        'timestamp': timestamp,
+        'estado': evaluation['estado'],
+        'tiempo_bomba': evaluation['tiempo_bomba'],
+        'activar_bomba': evaluation['activar_bomba'],
+        'error': 'error' in evaluation
+    })
+    return row
+
+
+def _latest_rows(rows):
+    # Última lectura de cada dispositivo presente en `rows`
+    latest = {}
+    for row in rows:
+        latest[row[DEVICE_FIELD]] = row
+    return {device: build_record(row) for device, row in latest.items()}
+
+
+def _device_summary(device, count, latest):
+    return {
+        "dispositivo": device,
+        "lecturas": int(count),
+        "ultima_lectura": latest['timestamp'] if latest else None
+    }
+
+
+class RingBufferStore:
+    """
+    Almacén en memoria con columnas NumPy de tamaño fijo: al llegar a `retention`
+    lecturas se sobrescriben las más antiguas, así la memoria no crece con el uptime.
+    Las columnas se reservan de forma incremental (INITIAL_CAPACITY, luego al doble)
+    para que muchos almacenes pequeños, uno por dispositivo, no ocupen `retention` filas cada uno.
+    """
+
+    def __init__(self, retention=DEFAULT_RETENTION):
+        self.retention = int(retention)
+        if self.retention <= 0:
+            raise ValueError("La retención debe ser mayor que cero")
+        self._lock = threading.Lock()
+        self._capacity = min(INITIAL_CAPACITY, self.retention)
+        self._columns = {name: np.zeros(self._capacity, dtype=dtype) for name, dtype in COLUMNS}
+        # Identificador secuencial de cada lectura, usado como cursor de paginación
+        self._ids = np.zeros(self._capacity, dtype=np.int64)
+        self._devices = np.full(self._capacity, DEFAULT_DEVICE, dtype=object)
+        # np.empty con dtype=object se inicializa con None
+        self._versions = np.empty(self._capacity, dtype=object)
+        self._errors = np.empty(self._capacity, dtype=object)
+        self._count = 0
+        self._next = 0
+        self._size = 0
+        self._latest = None
+        self._latest_by_device = {}
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, values, evaluation, device=DEFAULT_DEVICE):
+        """
+        Agrega una lectura (valores en el orden de INPUT_FIELDS) con su evaluación
+        """
+        self.extend([timestamp], [values], [evaluation], [device])
+
+    def extend(self, timestamps, values, evaluations, devices=None, ids=None):
+        """
+        Agrega varias lecturas en una sola escritura vectorizada por columna.
+        ids: identificadores crecientes asignados por fuera (DeviceStore); por defecto
+        se numeran de forma secuencial
+        """
+        with self._lock:
+            if devices is None:
+                devices = [DEFAULT_DEVICE] * len(timestamps)
+            if ids is None:
+                ids = range(self._count + 1, self._count + len(timestamps) + 1)
+            rows = [_evaluation_row(t, v, e, i, d)
+                    for t, v, e, d, i in zip(timestamps, values, evaluations, devices, ids)]
+            if not rows:
+                return
+            # Solo las últimas `retention` lecturas sobreviven
+            kept = rows[-self.retention:]
+            self._reserve(self._size + len(kept))
+            positions = (self._next + np.arange(len(kept))) % self._capacity
+            for name, column in self._columns.items():
+                column[positions] = [row[name] for row in kept]
+            self._ids[positions] = [row['id'] for row in kept]
+            self._devices[positions] = [row[DEVICE_FIELD] for row in kept]
+            self._versions[positions] = [row[VERSION_FIELD] for row in kept]
+            self._errors[positions] = [row[ERROR_FIELD] for row in kept]
+            self._count = max(self._count, int(rows[-1]['id']))
+            self._next = int((positions[-1] + 1) % self._capacity)
+            self._size = min(self._size + len(rows), self.retention)
+            self._latest_by_device.update(_latest_rows(rows))
+            self._latest = self._latest_by_device[rows[-1][DEVICE_FIELD]]
+
+    def _reserve(self, size):
+        # Mientras la capacidad es menor que `retention` nunca se sobrescribe: las
+        # lecturas ocupan [0, _size) en orden y basta copiarlas al arreglo nuevo
+        if size <= self._capacity or self._capacity == self.retention:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        capacity = min(capacity, self.retention)
+        for name, dtype in COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._ids = ids
+        devices = np.full(capacity, DEFAULT_DEVICE, dtype=object)
+        devices[:self._size] = self._devices[:self._size]
+        self._devices = devices
+        versions = np.empty(capacity, dtype=object)
+        versions[:self._size] = self._versions[:self._size]
+        self._versions = versions
+        errors = np.empty(capacity, dtype=object)
+        errors[:self._size] = self._errors[:self._size]
+        self._errors = errors
+        self._capacity = capacity
+        self._next = self._size
+
+    def arrays(self):
+        """
+        Retorna una copia de las columnas, los ids, las versiones de la base de reglas y
+        los motivos de error de las lecturas retenidas, en orden cronológico
+        """
+        with self._lock:
+            order = self._order()
+            arrays = {name: column[order] for name, column in self._columns.items()}
+            arrays['id'] = self._ids[order]
+            arrays[VERSION_FIELD] = self._versions[order]
+            arrays[ERROR_FIELD] = self._errors[order]
+            return arrays
+
+    def restore(self, arrays, device=DEFAULT_DEVICE):
+        """
+        Reemplaza el contenido por lecturas ya evaluadas de un dispositivo, dadas como
+        columnas en orden cronológico (como las de arrays()); se conservan las últimas `retention`
+        """
+        with self._lock:
+            size = min(len(arrays['id']), self.retention)
+            self._capacity = max(min(INITIAL_CAPACITY, self.retention), size)
+            self._columns = {name: np.zeros(self._capacity, dtype=dtype) for name, dtype in COLUMNS}
+            for name, column in self._columns.items():
+                column[:size] = arrays[name][len(arrays[name]) - size:]
+            self._ids = np.zeros(self._capacity, dtype=np.int64)
+            self._ids[:size] = arrays['id'][len(arrays['id']) - size:]
+            self._devices = np.full(self._capacity, device, dtype=object)
+            self._versions = np.empty(self._capacity, dtype=object)
+            self._errors = np.empty(self._capacity, dtype=object)
+            for name, column in ((VERSION_FIELD, self._versions), (ERROR_FIELD, self._errors)):
+                if name in arrays:
+                    column[:size] = arrays[name][len(arrays[name]) - size:]
+            self._size = size
+            self._next = size % self._capacity
+            self._count = int(self._ids[size - 1]) if size else 0
+            self._latest = self._build(np.array([size - 1]))[0] if size else None
+            self._latest_by_device = {device: self._latest} if size else {}
+
+    def admit(self, devices):
+        """
+        Sin límite de dispositivos: nunca rechaza (ver DeviceStore.admit)
+        """
+        return set()
+
+    def latest(self, device=None):
+        """
+        Retorna la última lectura (del dispositivo, si se indica) en O(1), o None si no hay datos
+        """
+        if device is None:
+            return self._latest
+        return self._latest_by_device.get(device)
+
+    def devices(self):
+        """
+        Retorna un resumen por dispositivo: lecturas retenidas y timestamp de la última
+        """
+        with self._lock:
+            names, counts = np.unique(self._devices[self._order()].astype(str), return_counts=True)
+            latest = dict(self._latest_by_device)
+        return [_device_summary(name, count, latest.get(name)) for name, count in zip(names.tolist(), counts)]
+
+    def records(self, device=None):
+        """
+        Retorna las lecturas retenidas en orden cronológico
+        """
+        return self.query(device=device)
+
+    def query(self, since=None, until=None, after_id=None, limit=None, device=None):
+        """
+        Retorna, en orden cronológico, las lecturas con timestamp en [since, until]
+        e id mayor que `after_id`, hasta `limit` lecturas
+        """
+        with self._lock:
+            return self._build(self._select(since, until, after_id, limit, device))
+
+    def ids(self, since=None, until=None, after_id=None, limit=None, device=None):
+        """
+        Igual que query pero retorna solo los ids (arreglo NumPy), sin construir las lecturas
+        """
+        with self._lock:
+            return self._ids[self._select(since, until, after_id, limit, device)]
+
+    def columns(self, since=None, until=None, device=None):
+        """
+        Retorna las columnas (arreglos NumPy) de las lecturas en [since, until], en orden cronológico
+        """
+        with self._lock:
+            order = self._order()
+            order = order[self._mask(order, since, until, device)]
+            return {name: column[order] for name, column in self._columns.items()}
+
+    def _select(self, since, until, after_id, limit, device):
+        # Posiciones de las lecturas que cumplen los filtros, en orden cronológico
+        order = self._order()
+        if after_id is not None:
+            # Los ids crecen en orden cronológico: búsqueda binaria
+            order = order[np.searchsorted(self._ids[order], after_id, side='right'):]
+        order = order[self._mask(order, since, until, device)]
+        if limit is not None:
+            order = order[:limit]
+        return order
+
+    def _mask(self, order, since, until, device):
+        mask = np.ones(len(order), dtype=bool)
+        if since is not None:
+            mask &= self._columns['timestamp'][order] >= since
+        if until is not None:
+            mask &= self._columns['timestamp'][order] <= until
+        if device is not None:
+            mask &= self._devices[order] == device
+        return mask
+
+    def _order(self):
+        # Posiciones de las lecturas retenidas, de la más antigua a la más reciente
+        return (self._next - self._size + np.arange(self._size)) % self._capacity
+
+    def _build(self, positions):
+        columns = {name: column[positions].tolist() for name, column in self._columns.items()}
+        columns['id'] = self._ids[positions].tolist()
+        columns[DEVICE_FIELD] = self._devices[positions].tolist()
+        columns[VERSION_FIELD] = self._versions[positions].tolist()
+        columns[ERROR_FIELD] = self._errors[positions].tolist()
+        return [build_record({name: values[i] for name, values in columns.items()}) for i in range(len(positions))]
+
+
+class DeviceStore:
+    """
+    Almacén en memoria particionado por dispositivo: cada dispositivo tiene su propio
+    RingBufferStore con `retention` lecturas, así un dispositivo muy activo no desplaza
+    el historial de los demás. La última lectura global y por dispositivo es O(1) y las
+    consultas de un dispositivo solo recorren su partición. Los ids son globales y
+    crecientes, por lo que la paginación por cursor funciona igual sobre todos.
+    """
+
+    def __init__(self, retention=DEFAULT_RETENTION, max_devices=DEFAULT_MAX_DEVICES):
+        self.retention = int(retention)
+        if self.retention <= 0:
+            raise ValueError("La retención debe ser mayor que cero")
+        self.max_devices = int(max_devices)
+        self._lock = threading.Lock()
+        self._partitions = {}
+        self._count = 0
+        self._latest = None
+
+    def __len__(self):
+        return sum(len(partition) for partition in self._snapshot())
+
+    def append(self, timestamp, values, evaluation, device=DEFAULT_DEVICE):
+        self.extend([timestamp], [values], [evaluation], [device])
+
+    def extend(self, timestamps, values, evaluations, devices=None):
+        if devices is None:
+            devices = [DEFAULT_DEVICE] * len(timestamps)
+        groups = {}
+        for index, device in enumerate(devices):
+            groups.setdefault(device, []).append(index)
+        if not groups:
+            return
+
+        # Asignar ids y escribir bajo el mismo lock mantiene los ids crecientes en cada partición
+        with self._lock:
+            new = [device for device in groups if device not in self._partitions]
+            if len(self._partitions) + len(new) > self.max_devices:
+                raise ValueError(f"Se alcanzó el máximo de {self.max_devices} dispositivos")
+            for device in new:
+                self._partitions[device] = RingBufferStore(self.retention)
+            for device, indexes in groups.items():
+                self._partitions[device].extend(
+                    [timestamps[i] for i in indexes], [values[i] for i in indexes],
+                    [evaluations[i] for i in indexes], [device] * len(indexes),
+                    ids=[self._count + i + 1 for i in indexes]
+                )
+            self._count += len(devices)
+            self._latest = self._partitions[devices[-1]].latest()
+
+    def admit(self, devices):
+        """
+        Crea de antemano las particiones de los dispositivos nuevos mientras quede cupo,
+        para rechazar lecturas antes de evaluarlas. Retorna los dispositivos que superan
+        `max_devices`; los ya reservados nunca se rechazan en extend()
+        """
+        rejected = set()
+        with self._lock:
+            for device in dict.fromkeys(devices):
+                if device in self._partitions:
+                    continue
+                if len(self._partitions) >= self.max_devices:
+                    rejected.add(device)
+                else:
+                    self._partitions[device] = RingBufferStore(self.retention)
+        return rejected
+
+    def latest(self, device=None):
+        if device is None:
+            return self._latest
+        partition = self._partitions.get(device)
+        return partition.latest() if partition is not None else None
+
+    def devices(self):
+        with self._lock:
+            partitions = list(self._partitions.items())
+        # Las particiones reservadas aún sin lecturas no se listan
+        return [_device_summary(device, len(partition), partition.latest())
+                for device, partition in partitions if len(partition)]
+
+    def records(self, device=None):
+        return self.query(device=device)
+
+    def query(self, since=None, until=None, after_id=None, limit=None, device=None):
+        if device is not None:
+            partition = self._partitions.get(device)
+            return partition.query(since, until, after_id, limit) if partition is not None else []
+        # Sin dispositivo: elegir primero, solo con los ids, las `limit` lecturas de menor
+        # id entre todas las particiones y construir únicamente esas
+        partitions = self._snapshot()
+        counts = [None] * len(partitions)
+        if limit is not None:
+            ids = [partition.ids(since, until, after_id, limit) for partition in partitions]
+            selected = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+            if len(selected) > limit:
+                threshold = np.partition(selected, limit - 1)[limit - 1]
+                counts = [int(np.count_nonzero(part <= threshold)) for part in ids]
+            else:
+                counts = [len(part) for part in ids]
+        pages = [partition.query(since, until, after_id, count)
+                 for partition, count in zip(partitions, counts) if count != 0]
+        return list(itertools.islice(heapq.merge(*pages, key=lambda record: record['id']), limit))
+
+    def columns(self, since=None, until=None, device=None):
+        if device is not None:
+            partition = self._partitions.get(device)
+            partitions = [partition] if partition is not None else []
+        else:
+            partitions = self._snapshot()
+        parts = [partition.columns(since, until) for partition in partitions]
+        if not parts:
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+        columns = {name: np.concatenate([part[name] for part in parts]) for name, _ in COLUMNS}
+        order = np.argsort(columns['timestamp'], kind='stable')
+        return {name: column[order] for name, column in columns.items()}
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._partitions.values())
+
+
+class SQLiteStore:
+    """
+    Almacén durable en SQLite con índices por timestamp y por dispositivo. `retention`
+    opcional limita la cantidad de filas conservadas y `device_retention` las de cada
+    dispositivo.
+    """
+
+    def __init__(self, path, retention=None, device_retention=None):
+        self.path = path
+        self.retention = int(retention) if retention else None
+        self.device_retention = int(device_retention) if device_retention else None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lecturas ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                + ", ".join(f"{name} {'INTEGER' if dtype is np.bool_ else 'REAL'} NOT NULL" for name, dtype in COLUMNS)
+                + f", {DEVICE_FIELD} TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}', {VERSION_FIELD} TEXT, {ERROR_FIELD} TEXT)"
+            )
+            # Bases creadas antes de la partición por dispositivo, de versionar las reglas
+            # o de guardar el motivo de los errores
+            existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(lecturas)")}
+            if DEVICE_FIELD not in existing:
+                self._conn.execute(
+                    f"ALTER TABLE lecturas ADD COLUMN {DEVICE_FIELD} TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}'"
+                )
+            if VERSION_FIELD not in existing:
+                self._conn.execute(f"ALTER TABLE lecturas ADD COLUMN {VERSION_FIELD} TEXT")
+            if ERROR_FIELD not in existing:
+                self._conn.execute(f"ALTER TABLE lecturas ADD COLUMN {ERROR_FIELD} TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_lecturas_timestamp ON lecturas (timestamp)")
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_lecturas_dispositivo ON lecturas ({DEVICE_FIELD}, id)"
+            )
+        self._latest = self._load_latest()
+        self._latest_by_device = {}
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM lecturas").fetchone()[0]
+
+    def append(self, timestamp, values, evaluation, device=DEFAULT_DEVICE):
+        self.extend([timestamp], [values], [evaluation], [device])
+
+    def extend(self, timestamps, values, evaluations, devices=None):
+        if devices is None:
+            devices = [DEFAULT_DEVICE] * len(timestamps)
+        rows = [_evaluation_row(t, v, e, device=d) for t, v, e, d in zip(timestamps, values, evaluations, devices)]
+        if not rows:
+            return
+        names = [DEVICE_FIELD, VERSION_FIELD, ERROR_FIELD] + [name for name, _ in COLUMNS]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO lecturas ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                [tuple(row[name] for name in names) for row in rows]
+            )
+            # La transacción tiene la base bloqueada: los ids insertados son consecutivos
+            last_id = self._conn.execute("SELECT MAX(id) FROM lecturas").fetchone()[0]
+            for offset, row in enumerate(rows):
+                row['id'] = last_id - len(rows) + 1 + offset
+            if self.retention:
+                bound = last_id - self.retention
+                self._conn.execute("DELETE FROM lecturas WHERE id <= ?", (bound,))
+                # Un dispositivo puede quedar sin lecturas: descartar las últimas ya borradas
+                self._latest_by_device = {device: latest for device, latest in self._latest_by_device.items()
+                                          if latest['id'] > bound}
+                rows = [row for row in rows if row['id'] > bound]
+            if self.device_retention:
+                for device in set(devices):
+                    self._conn.execute(
+                        f"DELETE FROM lecturas WHERE {DEVICE_FIELD} = ? AND id <= ("
+                        f"SELECT id FROM lecturas WHERE {DEVICE_FIELD} = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (device, device, self.device_retention)
+                    )
+            self._latest_by_device.update(_latest_rows(rows))
+            self._latest = self._latest_by_device[rows[-1][DEVICE_FIELD]]
+
+    def admit(self, devices):
+        """
+        Sin límite de dispositivos: nunca rechaza (ver DeviceStore.admit)
+        """
+        return set()
+
+    def latest(self, device=None):
+        if device is None:
+            return self._latest
+        latest = self._latest_by_device.get(device)
+        if latest is None:
+            # Dispositivo sin lecturas desde el arranque: buscar la última en la base
+            rows = self.query(device=device, newest_first=True, limit=1)
+            if not rows:
+                return None
+            latest = self._latest_by_device.setdefault(device, rows[0])
+        return latest
+
+    def devices(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {DEVICE_FIELD}, COUNT(*), MAX(timestamp) FROM lecturas GROUP BY {DEVICE_FIELD}"
+            ).fetchall()
+        return [{"dispositivo": row[0], "lecturas": row[1], "ultima_lectura": row[2]} for row in rows]
+
+    def records(self, device=None):
+        return self.query(device=device)
+
+    def query(self, since=None, until=None, after_id=None, limit=None, device=None, newest_first=False):
+        clauses, params = self._where(since, until, after_id, device)
+        sql = f"SELECT {SELECT_COLUMNS} FROM lecturas{clauses} ORDER BY id{' DESC' if newest_first else ''}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [build_record(row) for row in rows]
+
+    def columns(self, since=None, until=None, device=None):
+        clauses, params = self._where(since, until, None, device)
+        names = [name for name, _ in COLUMNS]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(names)} FROM lecturas{clauses} ORDER BY id", params
+            ).fetchall()
+        return {
+            name: np.array([row[i] for row in rows], dtype=dtype)
+            for i, (name, dtype) in enumerate(COLUMNS)
+        }
+
+    def _where(self, since, until, after_id, device):
+        clauses = []
+        params = []
+        for condition, value in (("timestamp >= ?", since), ("timestamp <= ?", until), ("id > ?", after_id),
+                                 (f"{DEVICE_FIELD} = ?", device)):
+            if value is not None:
+                clauses.append(condition)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _load_latest(self):
+        row = self._conn.execute(f"SELECT {SELECT_COLUMNS} FROM lecturas ORDER BY id DESC LIMIT 1").fetchone()
+        return build_record(row) if row else None
+
+
+def iter_records(store, since=None, until=None, after_id=None, limit=None, device=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Recorre las lecturas de un almacén por bloques usando el id como cursor, sin
+    materializar todo el historial
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        chunk = store.query(since=since, until=until, after_id=after_id, limit=size, device=device)
+        if not chunk:
+            return
+        yield from chunk
+        after_id = chunk[-1]['id']
+        if remaining is not None:
+            remaining -= len(chunk)
+        if len(chunk) < size:
+            return
+
+
+def create_store():
+    """
+    Crea el almacén configurado por variables de entorno:
+    SENSOR_STORE ('memory' | 'sqlite'), SENSOR_RETENTION, SENSOR_DEVICE_RETENTION,
+    SENSOR_MAX_DEVICES y SENSOR_DB_PATH. En memoria la retención es por dispositivo
+    (SENSOR_DEVICE_RETENTION, o SENSOR_RETENTION si no se indica); con SENSOR_SNAPSHOT_DIR
+    el historial se guarda en ese directorio cada SENSOR_SNAPSHOT_INTERVAL segundos y
+    se restaura al arrancar (ver sensor_snapshot.SnapshotStore)
+    """
+    backend = os.environ.get('SENSOR_STORE', 'memory')
+    retention = os.environ.get('SENSOR_RETENTION')
+    device_retention = os.environ.get('SENSOR_DEVICE_RETENTION')
+    if backend == 'sqlite':
+        return SQLiteStore(os.environ.get('SENSOR_DB_PATH', 'sensor_data.db'), retention, device_retention)
+    if backend == 'memory':
+        retention = int(device_retention or retention or DEFAULT_RETENTION)
+        max_devices = int(os.environ.get('SENSOR_MAX_DEVICES', DEFAULT_MAX_DEVICES))
+        snapshot_dir = os.environ.get('SENSOR_SNAPSHOT_DIR')
+        if snapshot_dir:
+            from .sensor_snapshot import SnapshotStore, DEFAULT_SNAPSHOT_INTERVAL
+            interval = float(os.environ.get('SENSOR_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL))
+            return SnapshotStore(snapshot_dir, retention, max_devices, interval)
+        return DeviceStore(retention, max_devices)
+    raise ValueError(f"Almacén desconocido: {backend}")
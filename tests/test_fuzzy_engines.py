@@ -0,0 +1,182 @@
+"""
+Equivalencia de los motores de inferencia ('numpy', 'lut', caché) con skfuzzy
+"""
+import numpy as np
+import pytest
+from skfuzzy import control as ctrl
+
+from services import fuzzy_lut
+from services.fuzzy_service import FuzzyService
+from services.fuzzy_lut import DEFAULT_TOLERANCE, INPUT_LABELS, OUTPUT_LABELS, LookupTableEngine
+
+
+def _evaluate_points(control_system, points):
+    # Referencia: skfuzzy con entradas vectorizadas, en una simulación propia
+    sim = ctrl.ControlSystemSimulation(control_system)
+    for label, values in zip(INPUT_LABELS, points.T):
+        sim.input[label] = np.ascontiguousarray(values)
+    sim.compute()
+    return np.column_stack([sim.output[label] for label in OUTPUT_LABELS])
+
+
+def _readings(count, seed=0):
+    rng = np.random.default_rng(seed)
+    readings = np.column_stack([
+        rng.uniform(10, 45, count),
+        rng.uniform(-5, 105, count),
+        rng.uniform(-50, 1100, count),
+        rng.uniform(-50, 1100, count),
+    ])
+    # Incluir lecturas sobre los puntos del universo y sobre los vértices de los conjuntos
+    readings[:count // 10] = np.round(readings[:count // 10])
+    readings[0] = (25, 60, 600, 600)
+    readings[1] = (15, 0, 0, 0)
+    readings[2] = (40, 100, 1023, 1023)
+    return readings
+
+
+@pytest.fixture(scope='module')
+def services():
+    return {engine: FuzzyService(engine=engine, cache_size=0) for engine in ('skfuzzy', 'numpy', 'lut')}
+
+
+def test_vectorized_evaluator_matches_skfuzzy(services):
+    service = services['numpy']
+    readings = _readings(2000)
+    expected = _evaluate_points(service.plant_ctrl, readings)
+    outputs = service.evaluator.evaluate(dict(zip(INPUT_LABELS, readings.T)))
+    actual = np.column_stack([outputs[label] for label in OUTPUT_LABELS])
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9)
+
+
+def test_vectorized_evaluator_is_chunk_independent(services):
+    evaluator = services['numpy'].evaluator
+    columns = dict(zip(INPUT_LABELS, _readings(500, seed=1).T))
+    whole = evaluator.evaluate(columns)
+    chunked = evaluator.evaluate(columns, chunk_size=7)
+    for label in OUTPUT_LABELS:
+        np.testing.assert_allclose(chunked[label], whole[label], rtol=0, atol=1e-12)
+
+
+def test_numpy_engine_matches_skfuzzy_engine(services):
+    for row in _readings(100, seed=2).tolist():
+        expected = services['skfuzzy'].evaluate_conditions(*row)
+        actual = services['numpy'].evaluate_conditions(*row)
+        assert actual.keys() == expected.keys()
+        assert actual['activar_bomba'] == expected['activar_bomba']
+        assert actual['estado'] == pytest.approx(expected['estado'], abs=0.011)
+        assert actual['tiempo_bomba'] == pytest.approx(expected['tiempo_bomba'], abs=0.011)
+
+
+def test_evaluate_batch_matches_evaluate_conditions(services):
+    service = services['skfuzzy']
+    readings = _readings(200, seed=3)
+    batch = service.evaluate_batch_conditions(readings)
+    for row, result in zip(readings.tolist(), batch):
+        expected = service.evaluate_conditions(*row)
+        assert result['activar_bomba'] == expected['activar_bomba']
+        assert result['estado'] == pytest.approx(expected['estado'], abs=0.011)
+        assert result['tiempo_bomba'] == pytest.approx(expected['tiempo_bomba'], abs=0.011)
+        assert result['version_reglas'] == expected['version_reglas']
+
+
+def test_lookup_table_nodes_match_evaluator(services):
+    table = services['lut'].lookup_table
+    evaluator = services['numpy'].evaluator
+    rng = np.random.default_rng(4)
+    for label in OUTPUT_LABELS:
+        indexes = [rng.integers(0, len(axis), 500) for axis in table.axes[label]]
+        levels = {(label, term): axis[index] for term, axis, index in zip(table.terms[label], table.axes[label], indexes)}
+        expected = evaluator.defuzzify(label, levels, 500)
+        np.testing.assert_allclose(table.tables[label][tuple(indexes)], expected, rtol=0, atol=1e-12)
+    # La ruta escalar y la vectorizada dan lo mismo
+    readings = _readings(200, seed=5)
+    for row, many in zip(readings.tolist(), table.evaluate_many(readings)):
+        np.testing.assert_allclose(table.evaluate(*row), many, rtol=0, atol=1e-9)
+
+
+def test_lookup_table_within_tolerance(services):
+    table = services['lut'].lookup_table
+    readings = _readings(2000, seed=6)
+    expected = _evaluate_points(services['lut'].plant_ctrl, readings)
+    error = np.abs(table.evaluate_many(readings) - expected)
+    for label, observed, bound, limit in zip(OUTPUT_LABELS, error.max(axis=0), table.max_error, DEFAULT_TOLERANCE):
+        assert bound <= limit, label
+        assert observed <= limit, label
+
+
+def test_lookup_table_reports_missing_membership_like_numpy():
+    definition = FuzzyService(engine='numpy', cache_size=0).definition
+    definition['reglas'] = [
+        {"si": "temperatura[fría] & humedad[baja] & suelo[seco] & luz[baja]",
+         "entonces": ["estado_planta[malo]", "tiempo_bomba[largo]"]}
+    ]
+    numpy_service = FuzzyService(engine='numpy', cache_size=0, definition=definition)
+    lut_service = FuzzyService(engine='lut', cache_size=0, definition=definition)
+    assert lut_service.lookup_table is not None
+    readings = np.array([(15, 0, 0, 0), (16, 10, 100, 50), (25, 60, 600, 600), (20, 49.5, 499, 499)])
+    for row in readings.tolist():
+        expected = numpy_service.evaluate_conditions(*row)
+        actual = lut_service.evaluate_conditions(*row)
+        assert actual.keys() == expected.keys()
+        assert actual.get('error') == expected.get('error')
+        assert actual['estado'] == pytest.approx(expected['estado'], abs=1)
+        assert actual['tiempo_bomba'] == pytest.approx(expected['tiempo_bomba'], abs=0.1)
+    np.testing.assert_array_equal(lut_service.evaluate_batch(readings)['error'],
+                                  numpy_service.evaluate_batch(readings)['error'])
+
+
+def test_lookup_table_refines_cells_for_a_tighter_tolerance(services):
+    default = services['lut'].lookup_table
+    table = LookupTableEngine.build(services['lut'].plant_ctrl, default.evaluator, tolerance=(0.02, 0.02))
+    assert all(error <= 0.02 for error in table.max_error)
+    for label in OUTPUT_LABELS:
+        assert table.exact[label].sum() > default.exact[label].sum(), label
+    # Si aun así la validación supera la tolerancia, build() falla
+    with pytest.raises(ValueError, match='supera la tolerancia'):
+        LookupTableEngine.build(services['lut'].plant_ctrl, default.evaluator, tolerance=(0.01, 0.01))
+
+
+def test_lookup_table_that_cannot_be_built_falls_back_to_evaluator(services, monkeypatch):
+    monkeypatch.setattr(fuzzy_lut, 'MAX_TABLE_NODES', 100)
+    with pytest.raises(ValueError, match='nodos'):
+        LookupTableEngine.build(services['lut'].plant_ctrl, services['lut'].evaluator)
+    service = FuzzyService(engine='lut', cache_size=0)
+    assert service.lookup_table is None
+    readings = _readings(20, seed=7)
+    assert service.evaluate_batch_conditions(readings) == services['numpy'].evaluate_batch_conditions(readings)
+    for row in readings.tolist():
+        assert service.evaluate_conditions(*row) == services['numpy'].evaluate_conditions(*row)
+
+
+def test_cache_is_off_by_default():
+    service = FuzzyService(engine='numpy')
+    assert service.cache_stats() is None
+    assert service.evaluate_conditions(25.04, 60.01, 600.2, 599.9)['estado'] != \
+        service.evaluate_conditions(25.0, 60.0, 600.0, 600.0)['estado']
+
+
+def test_cache_returns_quantized_evaluation():
+    cached = FuzzyService(engine='numpy', cache_size=64)
+    plain = FuzzyService(engine='numpy', cache_size=0)
+    first = cached.evaluate_conditions(25.04, 60.01, 600.2, 599.9)
+    second = cached.evaluate_conditions(24.96, 59.99, 599.8, 600.1)
+    assert cached.cache_stats()['hits'] == 1
+    assert first['estado'] == second['estado']
+    # El resultado corresponde al punto de la rejilla, no a la lectura exacta
+    expected = plain.evaluate_conditions(25.0, 60.0, 600.0, 600.0)
+    assert first['estado'] == expected['estado']
+    assert first['tiempo_bomba'] == expected['tiempo_bomba']
+    assert first['condiciones']['temperatura'] == 25.04
+
+
+def test_cache_is_invalidated_by_rulebase_reload():
+    service = FuzzyService(engine='numpy', cache_size=64)
+    before = service.evaluate_conditions(25, 60, 300, 600)
+    definition = service.definition
+    definition['variables']['suelo']['conjuntos']['seco'] = [0, 0, 700]
+    assert service.reload(definition)
+    after = service.evaluate_conditions(25, 60, 300, 600)
+    assert after['version_reglas'] != before['version_reglas']
+    assert service.cache_stats()['hits'] == 0
+    assert after == FuzzyService(engine='numpy', cache_size=0, definition=definition).evaluate_conditions(25, 60, 300, 600)
@@ -0,0 +1,29 @@
+"""
+Validación de definiciones de la base de reglas
+"""
+import pytest
+
+from services.fuzzy_rulebase import MAX_UNIVERSE_POINTS, build_rulebase, load_definition
+
+
+def test_default_definition_is_valid():
+    assert len(build_rulebase(load_definition()).rules) == len(load_definition()['reglas'])
+
+
+@pytest.mark.parametrize('universe', [[0, 2e7, 1], [0, 1e12, 1], [0, 1, 1 / (MAX_UNIVERSE_POINTS + 1)]])
+def test_universe_over_the_point_limit_is_rejected(universe):
+    definition = load_definition()
+    definition['variables']['luz']['universo'] = universe
+    with pytest.raises(ValueError, match=f"'luz': el universo supera el máximo de {MAX_UNIVERSE_POINTS}"):
+        build_rulebase(definition)
+
+
+def test_every_input_must_appear_in_some_antecedent():
+    definition = load_definition()
+    definition['reglas'] = [
+        {"si": "temperatura[óptima] & ~humedad[alta]", "entonces": "estado_planta[bueno]"},
+        {"si": "suelo[seco]", "entonces": "tiempo_bomba[largo]"}
+    ]
+    with pytest.raises(ValueError) as error:
+        build_rulebase(definition)
+    assert str(error.value) == "Ninguna regla usa la entrada 'luz'"
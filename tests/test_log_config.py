@@ -0,0 +1,60 @@
+"""
+Muestreo de los logs por lectura y escritura asíncrona de los registros
+"""
+import logging
+import threading
+
+import pytest
+
+from services.log_config import AsyncQueueHandler, Sampler
+
+
+@pytest.mark.parametrize('rate, passed', [(1, 100), (0.25, 25), (0.3, 34), (0.01, 1), (0, 0)])
+def test_sampler_passes_one_of_every_round_inverse_rate(rate, passed):
+    sampler = Sampler(rate)
+    results = [sampler() for _ in range(100)]
+    assert sum(results) == passed
+    # El primer evento siempre pasa (salvo con rate=0)
+    assert results[0] == bool(rate)
+
+
+class BlockingHandler(logging.Handler):
+    """Destino que retiene el primer registro hasta que el test lo libera"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.unblock = threading.Event()
+        self.messages = []
+        self.done = threading.Condition()
+
+    def emit(self, record):
+        self.started.set()
+        self.unblock.wait(5)
+        with self.done:
+            self.messages.append(record.getMessage())
+            self.done.notify_all()
+
+
+def test_full_queue_drops_records_without_blocking():
+    target = BlockingHandler()
+    handler = AsyncQueueHandler([target], max_size=2)
+    logger = logging.getLogger('tests.async_queue')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        logger.warning("primero")
+        assert target.started.wait(5)
+        # El listener está ocupado con el primero: caben dos en la cola y el resto se descarta
+        for index in range(5):
+            logger.warning("registro %d", index)
+        assert handler.dropped == 3
+
+        target.unblock.set()
+        with target.done:
+            assert target.done.wait_for(lambda: len(target.messages) == 3, timeout=5)
+        assert target.messages == ["primero", "registro 0", "registro 1"]
+    finally:
+        target.unblock.set()
+        handler.stop()
+        logger.removeHandler(handler)
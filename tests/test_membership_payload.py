@@ -0,0 +1,25 @@
+"""
+Formatos del documento de funciones de pertenencia
+"""
+import base64
+
+import numpy as np
+
+from services.fuzzy_service import FuzzyService
+from services.membership_payload import FORMATS, build_payload
+
+
+def test_formats_share_keys_and_describe_the_same_sets():
+    control_system = FuzzyService(engine='numpy').plant_ctrl
+    documents = {fmt: build_payload(control_system, fmt) for fmt in FORMATS}
+    full = documents['full']
+    for label, variable in full.items():
+        for fmt in FORMATS:
+            assert set(documents[fmt][label]) == {'range', 'sets'}
+        universe = np.array(variable['range'])
+        assert documents['vertices'][label]['range'] == [universe[0], universe[-1]]
+        decoded = np.frombuffer(base64.b64decode(documents['float32'][label]['range']), dtype='<f4')
+        assert np.allclose(decoded, universe)
+        for name, mf in variable['sets'].items():
+            x, y = np.array(documents['vertices'][label]['sets'][name]).T
+            assert np.allclose(np.interp(universe, x, y), mf)
@@ -0,0 +1,79 @@
+"""
+Registro de métricas y su exportación en el formato de texto de Prometheus
+"""
+from main import app
+from routes import sensor_routes
+from services import fuzzy_registry
+from services.fuzzy_service import FuzzyService
+from services.metrics import Registry
+from services.sensor_service import SensorService
+from services.sensor_store import DeviceStore
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Peticiones', ('method',))
+    latency = registry.histogram('latency_seconds', 'Duración', buckets=(0.1, 1.0))
+    registry.gauge('queue_depth', 'Cola', lambda: 3)
+    registry.gauge('omitted', 'Sin valor', lambda: None)
+    requests.inc(method='GET')
+    requests.inc(2, method='POST')
+    requests.inc(method='GET')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(2.0)
+
+    assert registry.render() == "\n".join([
+        '# HELP requests_total Peticiones',
+        '# TYPE requests_total counter',
+        'requests_total{method="GET"} 2',
+        'requests_total{method="POST"} 2',
+        '# HELP latency_seconds Duración',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 2.55',
+        'latency_seconds_count 3',
+        '# HELP queue_depth Cola',
+        '# TYPE queue_depth gauge',
+        'queue_depth 3',
+        '# HELP omitted Sin valor',
+        '# TYPE omitted gauge',
+    ]) + "\n"
+
+
+def test_labels_are_escaped():
+    registry = Registry()
+    registry.counter('errors_total', 'Errores', ('reason',)).inc(reason='a "b"\nc\\d')
+    assert 'errors_total{reason="a \\"b\\"\\nc\\\\d"} 1' in registry.render()
+
+
+def _scrape():
+    response = app.test_client().get('/api/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    return dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                if not line.startswith('#'))
+
+
+def test_scrape_does_not_build_the_fuzzy_service(monkeypatch):
+    monkeypatch.setattr(fuzzy_registry, '_services', {})
+    monkeypatch.setattr(sensor_routes, 'sensor_service', SensorService(store=DeviceStore(retention=10)))
+    samples = _scrape()
+    assert fuzzy_registry._services == {}
+    assert samples['fuzzy_cache_entries'] == '0'
+    assert samples['fuzzy_cache_hits_total'] == '0'
+    assert samples['sensor_store_readings'] == '0'
+
+
+def test_scrape_reports_the_current_cache(monkeypatch):
+    service = SensorService(store=DeviceStore(retention=10), fuzzy_service=FuzzyService(engine='numpy', cache_size=8))
+    monkeypatch.setattr(sensor_routes, 'sensor_service', service)
+    service.save_data({"temperatura": 25, "humedad": 60, "humedadSuelo": 30, "luz": 500})
+    service.save_data({"temperatura": 25, "humedad": 60, "humedadSuelo": 30, "luz": 500})
+    samples = _scrape()
+    assert samples['fuzzy_cache_entries'] == '1'
+    assert samples['fuzzy_cache_hits_total'] == '1'
+    assert samples['fuzzy_cache_misses_total'] == '1'
+    assert samples['sensor_store_readings'] == '2'
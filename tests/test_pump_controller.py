@@ -0,0 +1,89 @@
+"""
+Decisiones de PumpController: histéresis, mínimo apagado y lotes
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from services.fuzzy_lut import INPUT_LABELS
+from services.fuzzy_service import FuzzyService
+from services.pump_controller import PumpController
+
+
+class HumidityService:
+    """Servicio difuso de prueba: tiempo_bomba = humedad / 5 (universo de 0 a 20 s)"""
+
+    rulebase_version = 'prueba'
+    plant_ctrl = SimpleNamespace(
+        antecedents=[SimpleNamespace(label=label, universe=np.arange(0, 101)) for label in INPUT_LABELS],
+        consequents=[SimpleNamespace(label='tiempo_bomba', universe=np.arange(0, 21))]
+    )
+
+    def evaluate_batch_conditions(self, points):
+        return [{"estado": 50.0, "tiempo_bomba": point[1] / 5, "activar_bomba": point[1] / 5 > 2,
+                 "version_reglas": self.rulebase_version, "condiciones": dict(zip(INPUT_LABELS, point))}
+                for point in points]
+
+
+def _controller(**kwargs):
+    # Sin suavizado ni tendencia: cada lectura se evalúa tal cual
+    options = dict(smoothing=1, trend_smoothing=0, threshold=0, min_off_seconds=0)
+    options.update(kwargs)
+    return PumpController(HumidityService(), **options)
+
+
+def _decisions(controller, humidities, start=0.0, device='d'):
+    return [controller.update(device, [25, humidity, 500, 500], start + i)['activar_bomba']
+            for i, humidity in enumerate(humidities)]
+
+
+def test_default_thresholds_come_from_the_output_universe():
+    controller = _controller()
+    # 45 % y 35 % del universo de 0 a 20 s
+    assert _decisions(controller, [40, 46, 40, 36, 34, 40, 46]) == [False, True, True, True, False, False, True]
+    assert controller.stats()['configuracion']['encender_sobre'] == 9.0
+    assert controller.stats()['configuracion']['apagar_bajo'] == 7.0
+
+
+def test_explicit_thresholds_override_the_fractions():
+    controller = _controller(on_seconds=4, off_seconds=2)
+    assert _decisions(controller, [15, 25, 15, 5]) == [False, True, True, False]
+
+
+def test_min_off_blocks_turning_back_on():
+    controller = _controller(min_off_seconds=10)
+    assert _decisions(controller, [60, 20, 60, 60]) == [True, False, False, False]
+    assert controller.update('d', [25, 60, 500, 500], 12.0)['activar_bomba']
+    assert controller.state('d')['bloqueos_minimo_apagado'] == 2
+
+
+def test_condiciones_are_the_evaluated_inputs():
+    controller = _controller(smoothing=0.5)
+    controller.update('d', [25, 40, 500, 500], 0.0)
+    result = controller.update('d', [25, 60, 500, 500], 1.0)
+    assert result['condiciones']['humedad'] == 50.0
+    assert result['control']['suavizado']['humedad'] == 50.0
+
+
+def test_batch_matches_sequential_updates():
+    service = FuzzyService(engine='numpy')
+    rng = np.random.default_rng(0)
+    count = 300
+    devices = [f"d{i}" for i in rng.integers(0, 4, count)]
+    values = np.column_stack([rng.uniform(15, 40, count), rng.uniform(0, 100, count),
+                              rng.uniform(0, 1023, count), rng.uniform(0, 1023, count)]).tolist()
+    timestamps = np.arange(count, dtype=float).tolist()
+
+    batch = PumpController(service).update_batch(devices, values, timestamps)
+    sequential = PumpController(service)
+    assert batch == [sequential.update(d, v, t) for d, v, t in zip(devices, values, timestamps)]
+    # Con la base por defecto la bomba llega a encenderse y a apagarse
+    assert {result['activar_bomba'] for result in batch} == {True, False}
+
+
+def test_off_threshold_above_on_threshold_is_rejected():
+    with pytest.raises(ValueError):
+        _controller(on_seconds=2, off_seconds=3)
+    with pytest.raises(ValueError):
+        _controller(on_fraction=0.3, off_fraction=0.4)
@@ -0,0 +1,229 @@
+"""
+Rutas de /api sobre un almacén en memoria y el motor difuso 'numpy'
+"""
+import json
+import threading
+
+import pytest
+
+from main import app
+from routes import sensor_routes
+from services.fuzzy_service import FuzzyService
+from services.sensor_ingest import IngestWorker
+from services.sensor_service import SensorService
+from services.sensor_store import DeviceStore
+
+READING = {"temperatura": 25, "humedad": 60, "humedadSuelo": 30, "luz": 500}
+
+
+@pytest.fixture(scope='module')
+def fuzzy_service():
+    return FuzzyService(engine='numpy')
+
+
+@pytest.fixture
+def service(fuzzy_service, monkeypatch):
+    service = SensorService(store=DeviceStore(retention=1000, max_devices=10), fuzzy_service=fuzzy_service)
+    monkeypatch.setattr(sensor_routes, 'sensor_service', service)
+    return service
+
+
+@pytest.fixture
+def client(service):
+    return app.test_client()
+
+
+def test_rescore_defaults_and_caps_the_limit(client, service, fuzzy_service, monkeypatch):
+    service.save_values([[25, 60, 30, 500]] * 3, [1.0, 2.0, 3.0])
+    monkeypatch.setattr(sensor_routes, 'MAX_RESCORE_ROWS', 2)
+
+    response = client.post('/api/fuzzy/rulebase/rescore', json=fuzzy_service.definition)
+    assert response.status_code == 200
+    assert response.json['lecturas'] == 2
+    assert response.json['limite'] == 2 and response.json['incompleto']
+
+    response = client.post('/api/fuzzy/rulebase/rescore?limit=3', json=fuzzy_service.definition)
+    assert response.status_code == 400
+    assert 'services.fuzzy_rescore' in response.json['error']
+
+
+def test_rescore_reports_unexpected_errors_as_json(client, fuzzy_service, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("almacén no disponible")
+
+    monkeypatch.setattr(sensor_routes, 'rescore', fail)
+    response = client.post('/api/fuzzy/rulebase/rescore', json=fuzzy_service.definition)
+    assert response.status_code == 500
+    assert response.json == {"error": "almacén no disponible"}
+
+
+def test_batch_reports_errors_per_item(client, service):
+    service.store.max_devices = 2
+    readings = [
+        dict(READING, dispositivo='a'),
+        {"temperatura": 25, "humedad": 60},
+        dict(READING, dispositivo='b'),
+        dict(READING, dispositivo='no válido'),
+        dict(READING, luz="mucha"),
+        dict(READING, dispositivo='c'),
+    ]
+    response = client.post('/api/sensors/batch', json=readings)
+    assert response.status_code == 200
+    assert response.json['almacenados'] == 2
+    assert [result['indice'] for result in response.json['resultados']] == [0, 2]
+    assert all('estado' in result['evaluacion'] for result in response.json['resultados'])
+    errors = response.json['errores']
+    assert [error['indice'] for error in errors] == [1, 3, 4, 5]
+    assert 'humedadSuelo' in errors[0]['error']
+    assert "'c'" in errors[3]['error']
+    assert len(service.store) == 2
+
+
+def test_ndjson_batch_reports_invalid_lines(client, service):
+    body = '{"temperatura": 25, "humedad": 60, "humedadSuelo": 30, "luz": 500}\n{no es json\n\n'
+    response = client.post('/api/sensors/batch', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.json['errores'] == [{"indice": 1, "error": "Línea NDJSON inválida"}]
+    assert len(service.store) == 1
+
+
+def test_batch_without_valid_readings_is_rejected(client, service):
+    response = client.post('/api/sensors/batch', json=[{"temperatura": 25}])
+    assert response.status_code == 400
+    assert response.json['almacenados'] == 0
+    assert client.post('/api/sensors/batch', json=[]).status_code == 400
+
+
+def test_oversized_ndjson_batch_is_rejected_with_413(client, service, monkeypatch):
+    monkeypatch.setattr(sensor_routes, 'MAX_BATCH_SIZE', 3)
+    body = ''.join('{"temperatura": 25, "humedad": 60, "humedadSuelo": 30, "luz": 500}\n' for _ in range(10))
+    response = client.post('/api/sensors/batch', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 413
+    assert '3' in response.json['error']
+    assert len(service.store) == 0
+    # Un arreglo JSON demasiado grande también
+    response = client.post('/api/sensors/batch', json=[READING] * 4)
+    assert response.status_code == 413
+
+
+@pytest.fixture
+def history(service):
+    service.save_values([[20 + i, 60, 30, 500] for i in range(10)], [float(i) for i in range(1, 11)],
+                        ['a', 'b'] * 5)
+    return service.query_data()
+
+
+def test_cursor_pages_cover_the_history(client, history):
+    ids, cursor = [], None
+    while True:
+        response = client.get('/api/sensors', query_string=dict(limit=3, cursor=cursor) if cursor else {'limit': 3})
+        assert response.status_code == 200
+        ids += [record['id'] for record in response.json]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+    assert ids == [record['id'] for record in history]
+    assert len(response.json) == 1
+
+
+def test_since_until_and_device_filters(client, history):
+    response = client.get('/api/sensors?since=3&until=7&dispositivo=a&limit=2')
+    assert [record['timestamp'] for record in response.json] == [3.0, 5.0]
+    assert response.headers['X-Next-Cursor'] == str(response.json[-1]['id'])
+    iso = client.get('/api/sensors', query_string={'since': '1970-01-01T00:00:09Z'})
+    assert [record['timestamp'] for record in iso.json] == [9.0, 10.0]
+    assert client.get('/api/sensors?since=ayer').status_code == 400
+    assert client.get('/api/sensors?limit=0').status_code == 400
+
+
+def test_fields_projection(client, history):
+    response = client.get('/api/sensors?fields=timestamp, evaluacion.estado,desconocido&limit=1')
+    assert response.json == [{"timestamp": 1.0, "evaluacion": {"estado": history[0]['evaluacion']['estado']}}]
+    response = client.get('/api/sensors?format=ndjson&fields=id,dispositivo&cursor=8')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{"id": record['id'], "dispositivo": record['dispositivo']} for record in history[8:]]
+
+
+@pytest.mark.parametrize('path', ['/api/sensors/evaluation', '/api/sensors/pump', '/api/pump',
+                                  '/api/devices/a/evaluation', '/api/devices/a/pump'])
+def test_latest_evaluation_is_conditional(client, service, path):
+    assert client.get(path).status_code == 404
+    service.save_values([[25, 60, 30, 500]], [1700000000.5], ['a'])
+
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.json == service.get_latest_evaluation('a')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified'] == 'Tue, 14 Nov 2023 22:13:20 GMT'
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(path, headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+
+    # Una lectura nueva cambia el ETag
+    service.save_values([[25, 60, 30, 500]], [1700000060.0], ['a'])
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_device_evaluation_ignores_other_devices(client, service):
+    service.save_values([[25, 60, 30, 500]] * 2, [1.0, 2.0], ['a', 'b'])
+    etag = client.get('/api/devices/a/pump').headers['ETag']
+    service.save_values([[25, 60, 30, 500]], [3.0], ['b'])
+    assert client.get('/api/devices/a/pump', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/pump?dispositivo=a', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/pump', headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.fixture
+def async_ingest(service, monkeypatch):
+    # El worker procesa solo cuando el test lo permite, así la cola se llena de forma determinista
+    release = threading.Event()
+    save_values = service.save_values
+
+    def blocked_save_values(*args, **kwargs):
+        release.wait(5)
+        return save_values(*args, **kwargs)
+
+    monkeypatch.setattr(service, 'save_values', blocked_save_values)
+    worker = IngestWorker(service, max_size=2, batch_size=1)
+    monkeypatch.setattr(sensor_routes, 'INGEST_MODE', 'async')
+    monkeypatch.setattr(sensor_routes, 'ingest_worker', worker)
+    yield worker, release
+    release.set()
+    worker.stop()
+
+
+def test_async_ingest_answers_202_then_429_when_the_queue_is_full(client, service, async_ingest):
+    worker, release = async_ingest
+    statuses = []
+    for _ in range(5):
+        response = client.post('/api/sensors', json=READING)
+        statuses.append(response.status_code)
+        if response.status_code == 429:
+            assert response.headers['Retry-After'] == '1'
+    accepted = statuses.count(202)
+    # Dos lecturas en la cola y, a lo sumo, una más en proceso
+    assert accepted in (2, 3) and statuses == [202] * accepted + [429] * (5 - accepted)
+    assert worker.stats()['rejected'] == 5 - accepted
+    assert client.post('/api/sensors', json={"temperatura": 25}).status_code == 400
+
+    # Al detenerse el worker procesa todo lo encolado y deja de aceptar lecturas
+    release.set()
+    worker.stop()
+    assert worker.stats()['processed'] == accepted and worker.depth() == 0
+    assert len(service.store) == accepted
+    assert client.post('/api/sensors', json=READING).status_code == 429
+
+
+def test_stop_drains_pending_readings(service):
+    worker = IngestWorker(service, batch_size=16)
+    for i in range(100):
+        assert worker.submit([25, 60, 30, 500], 'a' if i % 2 else 'b', float(i))
+    worker.stop()
+    assert worker.stats()['processed'] == 100
+    assert worker.stats()['batches'] >= 7
+    assert [record['timestamp'] for record in service.query_data()] == [float(i) for i in range(100)]
+    assert not worker.submit([25, 60, 30, 500])
@@ -0,0 +1,67 @@
+"""
+Rechazo de lecturas por el máximo de dispositivos antes de evaluarlas y agregados por bucket
+"""
+import numpy as np
+import pytest
+
+from services.sensor_service import SensorService
+from services.sensor_store import DeviceStore
+
+READING = {"temperatura": 25, "humedad": 60, "humedadSuelo": 30, "luz": 500}
+
+
+class RecordingController:
+    """Controlador de bomba que solo registra los dispositivos que evalúa"""
+
+    def __init__(self):
+        self.devices = []
+
+    def update(self, device, values, timestamp):
+        return self.update_batch([device], [values], [timestamp])[0]
+
+    def update_batch(self, devices, values, timestamps):
+        self.devices.extend(devices)
+        return [{"estado": 50.0, "tiempo_bomba": 5.0, "activar_bomba": True} for _ in devices]
+
+
+@pytest.fixture
+def service():
+    return SensorService(store=DeviceStore(retention=10, max_devices=1), controller=RecordingController())
+
+
+def test_over_limit_reading_is_rejected_before_the_controller(service):
+    service.save_data(dict(READING, dispositivo='a'))
+    with pytest.raises(ValueError, match="'b'"):
+        service.save_data(dict(READING, dispositivo='b'))
+    with pytest.raises(ValueError):
+        service.save_values([[25, 60, 30, 500]] * 2, [1.0, 2.0], ['a', 'b'])
+    assert service.controller.devices == ['a']
+    assert len(service.store) == 1
+
+
+def test_admit_devices_reports_rejected_devices(service):
+    assert service.admit_devices(['a', 'b', 'c']) == {'b', 'c'}
+    service.save_values([[25, 60, 30, 500]], [1.0], ['a'])
+    assert service.controller.devices == ['a']
+
+
+@pytest.mark.parametrize('resolution, since, until', [
+    (60.0, 10030.5, 14010.2),
+    (300.0, 10030.5, 14010.2),
+    (60.0, 12000.0, 12000.0),
+])
+def test_incremental_aggregates_match_stored_readings(resolution, since, until):
+    service = SensorService(store=DeviceStore(retention=5000), controller=RecordingController())
+    rng = np.random.default_rng(0)
+    timestamps = np.sort(rng.uniform(10000, 15000, 3000)).tolist()
+    service.save_values(rng.uniform(0, 100, (3000, 4)).tolist(), timestamps)
+
+    assert any(aggregator.covers(since, resolution) for aggregator in service.aggregators)
+    keys, stats = service.get_aggregates(resolution, since, until)
+    # Con un dispositivo se agregan las lecturas almacenadas
+    raw_keys, raw_stats = service.get_aggregates(resolution, since, until, device='default')
+    assert keys.tolist() == raw_keys.tolist()
+    assert keys[0] == np.floor(since / resolution) and keys[-1] == np.floor(until / resolution)
+    for name in ('count', 'min', 'max', 'last', 'last_ts'):
+        assert np.array_equal(stats[name], raw_stats[name])
+    assert np.allclose(stats['sum'], raw_stats['sum'])
@@ -0,0 +1,124 @@
+"""
+Persistencia de SnapshotStore: snapshot, log y restauración
+"""
+import os
+
+import numpy as np
+import pytest
+
+from services.sensor_snapshot import LOG_DTYPE, LOG_DTYPES, SnapshotStore
+
+EVALUATION = {"estado": 50.0, "tiempo_bomba": 5.0, "activar_bomba": True, "version_reglas": "abc"}
+
+
+def _fill(store, count, seed, devices=5):
+    rng = np.random.default_rng(seed)
+    timestamps = np.sort(rng.uniform(0, 1000, count)).tolist()
+    names = [f"d{i}" for i in rng.integers(0, devices, count)]
+    store.extend(timestamps, rng.uniform(0, 100, (count, 4)).tolist(), [EVALUATION] * count, names)
+
+
+def _crash(store):
+    # Simula la caída del proceso: suelta el log y el bloqueo sin tomar el snapshot final
+    store._stopping.set()
+    store._log.close()
+    store._lock_file.close()
+    store._owner = False
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'historial')
+
+
+def test_restore_replays_snapshot_and_log(directory):
+    store = SnapshotStore(directory, retention=50, interval=3600)
+    _fill(store, 300, seed=0)
+    assert store.snapshot() == len(store)
+    _fill(store, 120, seed=1)
+    expected = store.query()
+    _crash(store)
+
+    restored = SnapshotStore(directory, retention=50, interval=3600)
+    assert restored.query() == expected
+    assert restored.latest() == store.latest()
+    # Los ids nuevos continúan después de los restaurados
+    restored.append(2000.0, [1, 2, 3, 4], EVALUATION, 'd0')
+    assert restored.latest()['id'] == 421
+    _crash(restored)
+
+
+def test_torn_trailing_record_is_discarded(directory):
+    store = SnapshotStore(directory, retention=50, interval=3600)
+    _fill(store, 80, seed=2)
+    expected = store.query()
+    _crash(store)
+    logs = [name for name in os.listdir(directory) if name.startswith('log-')]
+    with open(os.path.join(directory, logs[0]), 'ab') as f:
+        f.write(b'\x01' * (LOG_DTYPE.itemsize // 2))
+
+    restored = SnapshotStore(directory, retention=50, interval=3600)
+    assert restored.query() == expected
+    # La primera escritura trunca el registro incompleto antes de continuar el log
+    restored.append(2000.0, [1, 2, 3, 4], EVALUATION, 'd9')
+    expected = restored.query()
+    _crash(restored)
+    assert SnapshotStore(directory, retention=50, interval=3600).query() == expected
+
+
+def test_only_one_process_writes_the_directory(directory):
+    owner = SnapshotStore(directory, retention=50, interval=3600)
+    owner.append(1.0, [1, 2, 3, 4], EVALUATION, 'a')
+    other = SnapshotStore(directory, retention=50, interval=3600)
+    other.append(2.0, [1, 2, 3, 4], EVALUATION, 'b')
+    assert owner._owner and not other._owner
+    assert other.snapshot() is None
+    owner.close()
+
+    # Solo la lectura del proceso que tenía el bloqueo se conserva
+    restored = SnapshotStore(directory, retention=50, interval=3600)
+    assert [record['dispositivo'] for record in restored.query()] == ['a']
+
+
+def test_restore_keeps_the_newest_devices_up_to_max_devices(directory):
+    store = SnapshotStore(directory, retention=50, interval=3600)
+    store.extend([1.0, 2.0, 3.0, 4.0], [[1, 2, 3, 4]] * 4, [EVALUATION] * 4, ['a', 'b', 'c', 'a'])
+    # Una partición reservada sin lecturas no entra al snapshot
+    store.admit(['vacio'])
+    store.snapshot()
+    _crash(store)
+
+    restored = SnapshotStore(directory, retention=50, max_devices=2, interval=3600)
+    assert [summary['dispositivo'] for summary in restored.devices()] == ['a', 'c']
+    assert restored.admit(['b']) == {'b'}
+
+
+def test_error_messages_survive_snapshot_and_log(directory):
+    failed = {"error": "Evaluación sin reglas activas " * 8, "estado": 0, "activar_bomba": False,
+              "tiempo_bomba": 0}
+    store = SnapshotStore(directory, retention=50, interval=3600)
+    store.extend([1.0, 2.0], [[1, 2, 3, 4]] * 2, [failed, EVALUATION])
+    store.snapshot()
+    store.append(3.0, [1, 2, 3, 4], dict(failed, error="Fuera del universo"))
+    _crash(store)
+
+    errors = [record['evaluacion'].get('error') for record in SnapshotStore(directory, interval=3600).query()]
+    # En disco el motivo se trunca a 128 bytes sin cortar caracteres
+    assert failed['error'].startswith(errors[0]) and len(errors[0].encode()) > 120
+    assert errors[1:] == [None, "Fuera del universo"]
+
+
+def test_restore_reads_logs_written_before_error_messages(directory):
+    os.makedirs(directory)
+    records = np.zeros(2, dtype=LOG_DTYPES[1])
+    records['id'] = [1, 2]
+    records['timestamp'] = [1.0, 2.0]
+    records['error'] = [False, True]
+    records['dispositivo'] = b'default'
+    records.tofile(os.path.join(directory, 'log-00000000.bin'))
+
+    store = SnapshotStore(directory, interval=3600)
+    assert [record['evaluacion'].get('error') for record in store.query()] == [None, "Evaluación fallida"]
+    store.append(3.0, [1, 2, 3, 4], EVALUATION)
+    _crash(store)
+    assert [record['id'] for record in SnapshotStore(directory, interval=3600).query()] == [1, 2, 3]
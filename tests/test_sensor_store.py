@@ -0,0 +1,82 @@
+"""
+Consultas de DeviceStore sobre varias particiones
+"""
+import numpy as np
+import pytest
+
+from services.sensor_store import DeviceStore, SQLiteStore, iter_records
+
+EVALUATION = {"estado": 50.0, "tiempo_bomba": 5.0, "activar_bomba": True}
+
+
+@pytest.fixture
+def store():
+    rng = np.random.default_rng(0)
+    count = 3000
+    store = DeviceStore(retention=40, max_devices=50)
+    devices = [f"d{i}" for i in rng.integers(0, 25, count)]
+    timestamps = np.sort(rng.uniform(0, 1000, count)).tolist()
+    store.extend(timestamps, rng.uniform(0, 100, (count, 4)).tolist(), [EVALUATION] * count, devices)
+    return store
+
+
+def _reference(store, since=None, until=None, after_id=None, limit=None):
+    records = sorted((record for device in store._partitions.values() for record in device.query()),
+                     key=lambda record: record['id'])
+    records = [record for record in records
+               if (since is None or record['timestamp'] >= since)
+               and (until is None or record['timestamp'] <= until)
+               and (after_id is None or record['id'] > after_id)]
+    return records[:limit] if limit is not None else records
+
+
+@pytest.mark.parametrize('since, until, after_id, limit', [
+    (None, None, None, None),
+    (None, None, None, 1),
+    (None, None, None, 100),
+    (200.0, 800.0, None, 37),
+    (None, None, 2500, 10),
+    (None, 500.0, 1000, 5000),
+])
+def test_query_merges_partitions_by_id(store, since, until, after_id, limit):
+    assert store.query(since, until, after_id, limit) == _reference(store, since, until, after_id, limit)
+
+
+def test_iter_records_pages_through_all_partitions(store):
+    assert list(iter_records(store, chunk_size=33)) == _reference(store)
+
+
+def test_admit_rejects_devices_over_the_limit():
+    store = DeviceStore(retention=10, max_devices=2)
+    assert store.admit(['a', 'b', 'c', 'a']) == {'c'}
+    assert store.admit(['a', 'b']) == set()
+    # Las particiones reservadas no se listan hasta recibir lecturas
+    assert store.devices() == []
+    store.extend([1.0, 2.0], [[1, 2, 3, 4]] * 2, [EVALUATION] * 2, ['b', 'a'])
+    assert [summary['dispositivo'] for summary in store.devices()] == ['a', 'b']
+    with pytest.raises(ValueError):
+        store.append(3.0, [1, 2, 3, 4], EVALUATION, 'c')
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_failed_evaluation_keeps_its_message(backend, tmp_path):
+    store = DeviceStore(retention=10) if backend == 'memory' else SQLiteStore(str(tmp_path / 'lecturas.db'))
+    failed = {"error": "Sin reglas activas para las condiciones dadas", "estado": 0,
+              "activar_bomba": False, "tiempo_bomba": 0}
+    store.extend([1.0, 2.0], [[1, 2, 3, 4]] * 2, [EVALUATION, failed])
+    evaluations = [record['evaluacion'] for record in store.query()]
+    assert 'error' not in evaluations[0]
+    assert evaluations[1]['error'] == failed['error']
+    assert store.latest()['evaluacion']['error'] == failed['error']
+
+
+def test_sqlite_retention_evicts_latest_of_deleted_devices(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'lecturas.db'), retention=3)
+    store.append(1.0, [1, 2, 3, 4], EVALUATION, 'a')
+    assert store.latest('a')['id'] == 1
+    store.extend([2.0, 3.0, 4.0, 5.0, 6.0], [[1, 2, 3, 4]] * 5, [EVALUATION] * 5, ['b', 'b', 'b', 'c', 'b'])
+    # Las lecturas de 'a' y las primeras del lote ya se borraron
+    assert store.latest('a') is None
+    assert store.latest('b')['id'] == 6
+    assert store.latest('c')['id'] == 5
+    assert store.latest()['id'] == 6